@@ -0,0 +1,123 @@
+"""
+Benchmarks the library's own overhead against local stub backends.
+
+Usage (from the directory containing the library):
+```
+python -m pmllib.benchmarks --scenario all --requests 500 --concurrency 32 --output results.json
+```
+"""
+
+from argparse import ArgumentParser, Namespace
+from typing import Any, Awaitable, Callable, Dict, List
+import asyncio
+import json
+import sys
+from .stubs import StubA1111Server, StubOllamaServer
+from .harness import run_benchmark
+from ..generation.chat import ChatGenerator
+from ..generation.img import ImageGenerator
+from ..generation.types.structs import GenerationInput
+from ..generation.constants.llm_models import BEST_OVERALL_MODEL as BEST_CHAT_MODEL
+from ..generation.constants.diffusion_models import BEST_OVERALL_MODEL as BEST_IMAGE_MODEL
+from ..utils.backends import BackendPool
+from ..utils.http import HttpClient
+from ..utils.service import Scheduler
+from ..utils.metrics import HistogramSink, get_default_metrics
+
+SCENARIOS = ["chat", "stream", "complete", "image"]
+
+def parse_args(argv: List[str]) -> Namespace:
+    parser = ArgumentParser(prog="benchmarks", description="Benchmarks the library against local stub backends and prints the results as JSON.")
+    parser.add_argument("--scenario", choices=SCENARIOS + ["all"], default="all", help="Which benchmark to run.")
+    parser.add_argument("--requests", type=int, default=200, help="How many requests to send per scenario.")
+    parser.add_argument("--concurrency", type=int, default=16, help="How many requests are in flight at once.")
+    parser.add_argument("--latency", type=float, default=0.01, help="How long (in seconds) the stubs take to respond.")
+    parser.add_argument("--tokens", type=int, default=64, help="How many tokens every chat response consists of.")
+    parser.add_argument("--token-interval", type=float, default=0.0, help="How long (in seconds) the Ollama stub waits between streamed tokens.")
+    parser.add_argument("--image-size", type=int, default=2 * 1024 * 1024, help="The size of every generated image in bytes.")
+    parser.add_argument("--metrics", action="store_true", help="Enable tracing and report the latency of every phase.")
+    parser.add_argument("--trace-memory", action="store_true", help="Trace Python allocations to report the peak memory of every run (slow).")
+    parser.add_argument("--output", help="Write the results to this file instead of stdout.")
+
+    return parser.parse_args(argv)
+
+async def run(args: Namespace) -> List[Dict[str, Any]]:
+    ollama = await StubOllamaServer(args.latency, args.tokens, args.token_interval).start()
+    a1111 = await StubA1111Server(args.latency, args.image_size).start()
+
+    # Everything is sized to the requested concurrency, so the library itself is what's being measured.
+    client = HttpClient(limit=args.concurrency * 2, limit_per_host=args.concurrency)
+    chat_backends = BackendPool([ollama.url], health_interval=None, client=client)
+    image_backends = BackendPool([a1111.url], exclusive_models=True, health_interval=None, client=client)
+    chat_scheduler = Scheduler(args.concurrency)
+    image_scheduler = Scheduler(args.concurrency)
+
+    image_generator = ImageGenerator(client=client, scheduler=image_scheduler, backends=image_backends)
+
+    def create_chat_generator() -> ChatGenerator:
+        return ChatGenerator(None, BEST_CHAT_MODEL, client=client, scheduler=chat_scheduler, backends=chat_backends)
+
+    async def chat(i: int) -> None:
+        await create_chat_generator().generate(GenerationInput(f"Benchmark prompt #{i}", None, None))
+
+    async def stream(i: int) -> None:
+        async for _ in create_chat_generator().stream(GenerationInput(f"Benchmark prompt #{i}", None, None)):
+            pass
+
+    async def complete(i: int) -> None:
+        await create_chat_generator().complete(f"Benchmark prompt #{i}")
+
+    async def image(i: int) -> None:
+        await image_generator.generate(GenerationInput(f"Benchmark prompt #{i}", BEST_IMAGE_MODEL._id, None))
+
+    calls: Dict[str, Callable[[int], Awaitable[None]]] = {"chat": chat, "stream": stream, "complete": complete, "image": image}
+    scenarios = SCENARIOS if args.scenario == "all" else [args.scenario]
+    parameters = {
+        "latency": args.latency,
+        "tokens": args.tokens,
+        "token_interval": args.token_interval,
+        "image_size": args.image_size,
+        "python": sys.version.split()[0],
+    }
+    results = []
+
+    try:
+        for scenario in scenarios:
+            sink = HistogramSink()
+
+            if args.metrics:
+                get_default_metrics().add_sink(sink)
+
+            try:
+                result = await run_benchmark(scenario, calls[scenario], args.requests, args.concurrency, args.trace_memory, {**parameters, "metrics": args.metrics})
+            finally:
+                get_default_metrics().remove_sink(sink)
+
+            output = result.to_dict()
+
+            if args.metrics:
+                output["phases"] = {
+                    f"{operation}.{phase}": {f"p{p}": histogram.percentile(p) * 1000 for p in (50, 95, 99)}
+                    for (operation, phase), histogram in sorted(sink.histograms.items())
+                }
+
+            results.append(output)
+    finally:
+        await client.close()
+        await ollama.stop()
+        await a1111.stop()
+
+    return results
+
+def main(argv: List[str]) -> None:
+    args = parse_args(argv)
+    output = json.dumps(asyncio.run(run(args)), indent=2)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,174 @@
+from asyncio import Semaphore, Task, ensure_future, gather, get_running_loop, sleep
+from dataclasses import asdict, dataclass, field
+from time import perf_counter
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+@dataclass
+class BenchmarkResult:
+    """
+    The measurements of a single benchmark run. Latencies are in milliseconds.
+    """
+
+    name: str
+    concurrency: int
+    requests: int
+    errors: int = 0
+    duration: float = 0.0
+    throughput: float = 0.0
+    latency: Dict[str, float] = field(default_factory=dict)
+    loop_lag: Dict[str, float] = field(default_factory=dict)
+    memory: Dict[str, Optional[float]] = field(default_factory=dict)
+    parameters: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the result as a JSON serializable dictionary.
+        """
+
+        return asdict(self)
+
+class LoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a coroutine sleeping for `interval` seconds.
+    A consistently high lag means something is blocking the loop.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        """How often (in seconds) the lag is sampled."""
+
+        self.samples: List[float] = []
+        """Every measured lag in milliseconds."""
+
+        self.__task: Optional[Task] = None
+
+    def start(self) -> None:
+        """
+        Starts sampling in the background of the running event loop.
+        """
+
+        self.__task = ensure_future(self.__run())
+
+    def stop(self) -> None:
+        """
+        Stops sampling. The samples collected so far are kept.
+        """
+
+        if self.__task:
+            self.__task.cancel()
+            self.__task = None
+
+    async def __run(self) -> None:
+        loop = get_running_loop()
+
+        while True:
+            expected = loop.time() + self.interval
+            await sleep(self.interval)
+            self.samples.append(max(loop.time() - expected, 0.0) * 1000)
+
+def percentile(samples: List[float], p: float) -> float:
+    """
+    Returns the `p`th percentile (0-100) of `samples` using linear interpolation, or `0.0` if there are none.
+    """
+
+    if not samples:
+        return 0.0
+
+    ordered = sorted(samples)
+    rank = (len(ordered) - 1) * p / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def summarize(samples: List[float]) -> Dict[str, float]:
+    """
+    Returns the usual latency statistics of `samples`.
+    """
+
+    return {
+        "mean": sum(samples) / len(samples) if samples else 0.0,
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": max(samples) if samples else 0.0,
+    }
+
+def get_max_rss() -> Optional[float]:
+    """
+    Returns the peak resident set size of the process in MiB, if the platform reports it.
+    It's the peak over the lifetime of the process, so it never goes down from one run to the next.
+    """
+
+    if resource is None:
+        return None
+
+    # Reported in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+async def run_benchmark(
+        name: str,
+        call: Callable[[int], Awaitable[Any]],
+        requests: int,
+        concurrency: int,
+        trace_memory: bool = False,
+        parameters: Optional[Dict[str, Any]] = None,
+) -> BenchmarkResult:
+    """
+    Awaits `call(i)` `requests` times with at most `concurrency` calls in flight and measures the run.
+
+    With `trace_memory`, Python allocations are traced to report the peak memory used by the run itself.
+    Tracing slows every allocation down, so throughput and latencies aren't comparable to untraced runs.
+
+    The peak RSS of the process so far is reported as `max_rss_mib`, and how much the run raised it as `max_rss_growth_mib`,
+    which stays at `0` for runs that didn't need more memory than earlier ones.
+    """
+
+    result = BenchmarkResult(name, concurrency, requests, parameters=parameters or {})
+    latencies: List[float] = []
+    semaphore = Semaphore(concurrency)
+    monitor = LoopLagMonitor()
+
+    async def run(i: int) -> None:
+        async with semaphore:
+            start = perf_counter()
+
+            try:
+                await call(i)
+            except Exception:
+                result.errors += 1
+                return
+
+            latencies.append((perf_counter() - start) * 1000)
+
+    if trace_memory:
+        tracemalloc.start()
+
+    rss_before = get_max_rss()
+    monitor.start()
+    start = perf_counter()
+
+    try:
+        await gather(*[run(i) for i in range(requests)])
+    finally:
+        result.duration = perf_counter() - start
+        monitor.stop()
+
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result.memory["traced_peak_mib"] = peak / 1024 / 1024
+
+    result.throughput = len(latencies) / result.duration if result.duration else 0.0
+    result.latency = summarize(latencies)
+    result.loop_lag = summarize(monitor.samples)
+    result.memory["max_rss_mib"] = get_max_rss()
+    result.memory["max_rss_growth_mib"] = result.memory["max_rss_mib"] - rss_before if rss_before is not None else None
+
+    return result
@@ -0,0 +1,202 @@
+from abc import ABC, abstractmethod
+from asyncio import sleep
+from typing import Dict, Optional
+import base64
+import json
+import os
+from aiohttp import web
+
+class StubServer(ABC):
+    """
+    A local stand-in for a backend, used to benchmark the library without GPUs.
+
+    Every response is delayed by `latency` seconds to simulate the model's work.
+    The server listens on a random free port of `host` unless a `port` is provided.
+    """
+
+    def __init__(self, latency: float = 0.0, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.latency = latency
+        """How long (in seconds) every response is delayed."""
+
+        self.host = host
+        """The address the server listens on."""
+
+        self.port = port
+        """The port the server listens on. Updated once the server is started if it was `0`."""
+
+        self.requests: Dict[str, int] = {}
+        """How many requests were received by path."""
+
+        self.__runner: Optional[web.AppRunner] = None
+
+    @property
+    def url(self) -> str:
+        """
+        Returns the base URL of the server, to be used as an API base.
+        """
+
+        return f"http://{self.host}:{self.port}"
+
+    @abstractmethod
+    def create_app(self) -> web.Application:
+        """
+        Returns the application serving the stubbed endpoints.
+        """
+
+        pass
+
+    async def start(self) -> "StubServer":
+        """
+        Starts listening and returns the server itself.
+        """
+
+        self.__runner = web.AppRunner(self.create_app(), access_log=None)
+        await self.__runner.setup()
+
+        site = web.TCPSite(self.__runner, self.host, self.port)
+        await site.start()
+
+        self.port = self.__runner.addresses[0][1]
+        return self
+
+    async def stop(self) -> None:
+        """
+        Stops the server.
+        """
+
+        if self.__runner:
+            await self.__runner.cleanup()
+            self.__runner = None
+
+    async def __aenter__(self) -> "StubServer":
+        return await self.start()
+
+    async def __aexit__(self, *_) -> None:
+        await self.stop()
+
+    def count(self, request: web.Request) -> None:
+        """
+        Counts the request towards `requests`.
+        """
+
+        self.requests[request.path] = self.requests.get(request.path, 0) + 1
+
+class StubOllamaServer(StubServer):
+    """
+    Serves Ollama compatible `/api/chat` (including NDJSON streaming) and `/api/generate` endpoints.
+
+    Responses consist of `tokens` words. When streaming, `latency` is spent before the first token
+    and `token_interval` seconds pass between tokens.
+    """
+
+    def __init__(self, latency: float = 0.0, tokens: int = 64, token_interval: float = 0.0, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__(latency, host, port)
+
+        self.tokens = tokens
+        """How many tokens every response consists of."""
+
+        self.token_interval = token_interval
+        """How long (in seconds) to wait between streamed tokens."""
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/", self.__root)
+        app.router.add_get("/api/version", self.__root)
+        app.router.add_post("/api/chat", self.__chat)
+        app.router.add_post("/api/generate", self.__generate)
+
+        return app
+
+    async def __root(self, request: web.Request) -> web.Response:
+        return web.Response(text="Ollama is running")
+
+    async def __chat(self, request: web.Request) -> web.StreamResponse:
+        self.count(request)
+        body = await request.json()
+
+        if body.get("stream"):
+            return await self.__stream(request, body)
+
+        await sleep(self.latency)
+
+        return web.json_response({
+            "model": body.get("model"),
+            "message": {"role": "assistant", "content": " ".join(["token"] * self.tokens)},
+            "done": True,
+            **self.__stats(),
+        })
+
+    async def __generate(self, request: web.Request) -> web.Response:
+        self.count(request)
+        body = await request.json()
+        await sleep(self.latency)
+
+        return web.json_response({
+            "model": body.get("model"),
+            "response": " ".join(["token"] * self.tokens),
+            "context": list(range(self.tokens)),
+            "done": True,
+            **self.__stats(),
+        })
+
+    async def __stream(self, request: web.Request, body: Dict) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+        await response.prepare(request)
+        await sleep(self.latency)
+
+        for _ in range(self.tokens):
+            await response.write((json.dumps({"model": body.get("model"), "message": {"role": "assistant", "content": "token "}, "done": False}) + "\n").encode("utf-8"))
+
+            if self.token_interval:
+                await sleep(self.token_interval)
+
+        await response.write((json.dumps({"model": body.get("model"), "message": {"role": "assistant", "content": ""}, "done": True, **self.__stats()}) + "\n").encode("utf-8"))
+        await response.write_eof()
+
+        return response
+
+    def __stats(self) -> Dict[str, int]:
+        return {
+            "load_duration": 0,
+            "eval_count": self.tokens,
+            "eval_duration": int((self.latency + self.tokens * self.token_interval) * 1e9),
+        }
+
+class StubA1111Server(StubServer):
+    """
+    Serves an A1111 compatible `/sdapi/v1/txt2img` endpoint returning random base64 encoded images of `image_size` bytes.
+    """
+
+    def __init__(self, latency: float = 0.0, image_size: int = 2 * 1024 * 1024, host: str = "127.0.0.1", port: int = 0) -> None:
+        super().__init__(latency, host, port)
+
+        self.image_size = image_size
+        """The size of every returned image in bytes (before base64 encoding)."""
+
+        # Encoded once up front, so the stub itself doesn't skew the measurements.
+        self.__image = base64.b64encode(os.urandom(image_size)).decode("ascii")
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_get("/", self.__details)
+        app.router.add_post("/sdapi/v1/txt2img", self.__txt2img)
+        app.router.add_get("/sdapi/v1/options", self.__details)
+        app.router.add_post("/sdapi/v1/options", self.__details)
+
+        return app
+
+    async def __details(self, request: web.Request) -> web.Response:
+        return web.json_response({"model": "stub", "sd_model_checkpoint": "stub"})
+
+    async def __txt2img(self, request: web.Request) -> web.Response:
+        self.count(request)
+        body = await request.json()
+        await sleep(self.latency)
+
+        batch_size = int(body.get("batch_size", 1))
+
+        return web.json_response({
+            "images": [self.__image] * batch_size,
+            "parameters": {},
+            "info": json.dumps({"all_seeds": list(range(batch_size))}),
+        })
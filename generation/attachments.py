@@ -0,0 +1,105 @@
+from asyncio import get_running_loop
+from concurrent.futures import Executor
+from io import BytesIO
+from importlib.util import find_spec
+from typing import Optional, Union
+import base64
+import hashlib
+from .types.enums import ImageFormat
+from .types.exceptions import MissingDependencyException
+from .constants.llm_constants import ATTACHMENT_STORE_MAX_BYTES, ATTACHMENT_JPEG_QUALITY
+from ..utils.cache import CacheStats, LRUCache
+
+class AttachmentStore:
+    """
+    Keeps the images attached to chat messages once, no matter how many messages (or conversations) they're attached to.
+
+    Images are identified by a hash of their content. Adding an image that is already stored returns the stored copy,
+    so every message it's attached to shares the same string instead of holding a copy of its own.
+    If a `resolution` is given (see `ChatModel.image_resolution`), larger images are downscaled to fit it first,
+    since the model would scale them down itself anyway. Hashing and downscaling are done by `executor` (the event loop's default one if `None`),
+    so multi-megabyte images don't stall the event loop.
+
+    The stored images are limited to `max_bytes` (of base64 encoded data), the least recently used one is dropped first.
+    Downscaling requires the optional Pillow package. Unless `downscale` is set explicitly, images are only downscaled if it's installed.
+    """
+
+    def __init__(self, max_bytes: int = ATTACHMENT_STORE_MAX_BYTES, downscale: Optional[bool] = None, executor: Optional[Executor] = None) -> None:
+        # Pillow is only imported once an image is downscaled, so text-only use doesn't pay for loading it.
+        has_pillow = find_spec("PIL") is not None
+
+        if downscale and not has_pillow:
+            raise MissingDependencyException("Pillow", "Downscaling chat images")
+
+        self.downscale = downscale if downscale is not None else has_pillow
+        """Whether images larger than the requested resolution are downscaled."""
+
+        self.executor = executor
+        """The executor images are hashed and downscaled by. `None` means the event loop's default executor."""
+
+        self.__images = LRUCache[str](max_bytes)
+
+    @property
+    def stats(self) -> CacheStats:
+        """
+        Returns the hit/miss statistics of the store.
+        """
+
+        return self.__images.stats
+
+    @property
+    def size(self) -> int:
+        """
+        Returns the total size of the stored images.
+        """
+
+        return self.__images.size
+
+    async def add(self, data: Union[str, bytes], resolution: Optional[int] = None) -> str:
+        """
+        Returns the stored copy of the base64 encoded image `data`, downscaled to fit `resolution` (in pixels) if it's larger.
+        """
+
+        loop = get_running_loop()
+        digest = await loop.run_in_executor(self.executor, _hash, data)
+        key = (digest, resolution if self.downscale else None)
+        image = self.__images.get(key)
+
+        if image is not None:
+            return image
+
+        image = await loop.run_in_executor(self.executor, _downscale, data, resolution) if self.downscale and resolution else _to_str(data)
+        self.__images.set(key, image)
+        return image
+
+    def clear(self) -> None:
+        """
+        Drops every stored image. Messages keep the images already attached to them.
+        """
+
+        self.__images.clear()
+
+def _to_str(data: Union[str, bytes]) -> str:
+    return data if isinstance(data, str) else data.decode("ascii")
+
+def _hash(data: Union[str, bytes]) -> str:
+    return hashlib.sha256(data.encode("ascii") if isinstance(data, str) else data).hexdigest()
+
+def _downscale(data: Union[str, bytes], resolution: int) -> str:
+    from PIL import Image
+
+    with Image.open(BytesIO(base64.b64decode(data))) as image:
+        if max(image.size) <= resolution:
+            return _to_str(data)
+
+        # Photos are kept as JPEG, everything else (like screenshots, whose text must stay sharp) becomes a PNG.
+        image_format, options = (ImageFormat.JPEG, {"quality": ATTACHMENT_JPEG_QUALITY}) if image.format == "JPEG" else (ImageFormat.PNG, {})
+        image.thumbnail((resolution, resolution), Image.LANCZOS)
+
+        if image_format == ImageFormat.JPEG and image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+
+        output = BytesIO()
+        image.save(output, format=image_format.value, **options)
+
+    return base64.b64encode(output.getvalue()).decode("ascii")
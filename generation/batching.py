@@ -0,0 +1,203 @@
+from asyncio import CancelledError, Future, Task, TimerHandle, ensure_future, get_running_loop
+from datetime import datetime, timedelta, UTC
+from time import perf_counter_ns
+from io import BytesIO
+from typing import Dict, List, Optional, Set
+import json
+from .types.contracts import GeneratorContract
+from .types.structs import GenerationInput, GenerationOutput, ImageModel
+from .types.enums import Degradation
+from .types.exceptions import GenerationAPIException
+from .helpers.payload_helpers import get_load_duration, has_fixed_seed, payload_key
+from .constants.img_constants import BATCH_WINDOW, MAX_BATCH_SIZE
+from .img import ImageGenerator
+from ..utils.resilience import Deadline
+
+class _BatchEntry:
+    def __init__(self, _input: GenerationInput, result: Future, deadline: Deadline, degradations: List[Degradation]) -> None:
+        self.input = _input
+        self.result = result
+        self.deadline = deadline
+        self.degradations = degradations
+        self.queued_stamp = datetime.now(UTC)
+
+class _PendingBatch:
+    def __init__(self, model: ImageModel, payload: Dict) -> None:
+        self.model = model
+        self.payload = payload
+        self.entries: List[_BatchEntry] = []
+        self.timer: Optional[TimerHandle] = None
+        self.task: Optional[Task] = None
+
+class BatchingImageGenerator(GeneratorContract):
+    """
+    Opt-in layer in front of an `ImageGenerator` that coalesces similar requests into batched A1111 calls.
+
+    Requests arriving within `window` seconds of each other that would produce the exact same payload
+    (same model, dimensions, steps, sampler, prompt, etc.) are sent as a single txt2img call using `batch_size`,
+    and the returned images are handed back to the callers one by one.
+    Only requests without a fixed seed can be batched, because A1111 derives the seeds of a batch from the first one.
+    Seeded requests are forwarded to the wrapped generator unchanged.
+
+    Batched requests get the same treatment from the wrapped generator as the ones it handles itself: they're checked against its
+    `BackendCatalog`, degraded or shed by its `DegradationPolicy` (requests degraded the same way are batched together),
+    charged against the rate limits of their tenant and bound by their own `timeout`. A batch is sent with the latest deadline of its callers,
+    and the render is interrupted once every caller of the batch has left (see `ImageGenerator.interrupt()`).
+    """
+
+    def __init__(self, generator: Optional[ImageGenerator] = None, window: float = BATCH_WINDOW, max_batch_size: int = MAX_BATCH_SIZE) -> None:
+        self.generator = generator if generator else ImageGenerator()
+        """The generator the batched requests are sent through."""
+
+        self.window = window
+        """How long (in seconds) the first request of a batch waits for others to join."""
+
+        self.max_batch_size = max_batch_size
+        """The largest number of requests sent in a single call. A full batch is sent immediately."""
+
+        self.__pending: Dict[str, _PendingBatch] = {}
+        self.__sending: Set[Task] = set()
+
+    async def generate(self, _input: GenerationInput) -> GenerationOutput:
+        if has_fixed_seed(_input.seed):
+            return await self.generator.generate(_input)
+
+        deadline = Deadline(_input.timeout if _input.timeout is not None else self.generator.timeout)
+        model, degradations = await self.generator.plan(_input, deadline)
+        rate_limiter = self.generator.scheduler.rate_limiter
+
+        # The batch itself isn't charged to anyone, so every caller is charged for its own image up front.
+        if rate_limiter is not None and _input.tenant is not None:
+            rate_limiter.check(_input.tenant, model.estimate_cost())
+
+        payload = model.to_a1_payload(_input.prompt)
+        key = payload_key(payload)
+
+        batch = self.__pending.get(key)
+
+        if batch is None:
+            batch = self.__pending[key] = _PendingBatch(model, payload)
+            batch.timer = get_running_loop().call_later(self.window, self.__flush, key)
+
+        result: Future = get_running_loop().create_future()
+        result.add_done_callback(lambda _: self.__leave(batch))
+        batch.entries.append(_BatchEntry(_input, result, deadline, degradations))
+
+        if len(batch.entries) >= self.max_batch_size:
+            self.__flush(key)
+
+        async with deadline.enforce():
+            return await result
+
+    def __flush(self, key: str) -> None:
+        batch = self.__pending.pop(key, None)
+
+        if batch is None:
+            return
+
+        if batch.timer:
+            batch.timer.cancel()
+
+        task = batch.task = ensure_future(self.__send(batch))
+        self.__sending.add(task)
+        task.add_done_callback(self.__sending.discard)
+
+    def __leave(self, batch: _PendingBatch) -> None:
+        # Once nobody waits for the batch anymore, it's cancelled, which interrupts the render if it already started.
+        if batch.task is not None and not batch.task.done() and all(entry.result.cancelled() for entry in batch.entries):
+            batch.task.cancel()
+
+    async def __send(self, batch: _PendingBatch) -> None:
+        entries = [entry for entry in batch.entries if not entry.result.done()]
+
+        if not entries:
+            return
+
+        # The batch is sent as long as any of its callers is still willing to wait.
+        deadline = max((entry.deadline for entry in entries), key=lambda deadline: deadline.expires_at if deadline.expires_at is not None else float("inf"))
+
+        payload = dict(batch.payload)
+        payload["batch_size"] = len(entries)
+
+        if len(entries) > 1:
+            payload["override_settings"] = {"return_grid": False}
+
+        trace = self.generator.metrics.trace("image.batch", model=batch.model.model, batch_size=len(entries))
+
+        try:
+            queued_ns = perf_counter_ns()
+
+            # A batch is shared by its callers, so it's charged to nobody in particular, but at the cost of all of its images.
+            async with deadline.enforce():
+                async with self.generator.scheduler.slot(max(entry.input.priority for entry in entries), group=batch.model.model, cost=batch.model.estimate_cost() * len(entries)):
+                    trace.record("queue_wait", queued_ns)
+                    start_stamp = datetime.now(UTC)
+                    image_data, details = await self.generator.txt2img(payload, trace, deadline=deadline, template=batch.model.payload_template)
+
+            images: List[bytes] = list(image_data.get("images") or [])
+
+            if len(images) < len(entries):
+                raise GenerationAPIException(f"Expected {len(entries)} images but received {len(images)}.")
+        except Exception as e:
+            trace.finish(e)
+            self.__fail(entries, e)
+            return
+        except CancelledError as e:
+            trace.finish(e)
+            self.__fail(entries, None)
+            raise
+
+        if self.generator.degradation is not None:
+            # Recorded per image, since the render time of a batch grows with its size. Switching checkpoints isn't part of the render itself.
+            load_duration = get_load_duration(details)
+            self.generator.degradation.record(batch.model, (datetime.now(UTC) - start_stamp - (load_duration if load_duration else timedelta())).total_seconds() / len(entries))
+
+        seeds = self.__get_seeds(image_data)
+
+        # Some servers still prepend a grid of the whole batch.
+        images = images[len(images) - len(entries):]
+
+        for i, entry in enumerate(entries):
+            if entry.result.done():
+                continue
+
+            entry_details = {**details, "degradations": [str(degradation) for degradation in entry.degradations]} if entry.degradations else details
+
+            try:
+                image_binary, image_details = await self.generator.process_image(images[i], entry_details, trace)
+            except Exception as e:
+                entry.result.set_exception(e)
+                continue
+
+            if entry.result.done():
+                continue
+
+            entry.result.set_result(GenerationOutput[BytesIO](
+                prompt=entry.input.prompt,
+                model_name=batch.model.model,
+                seed=seeds[i] if i < len(seeds) else entry.input.seed,
+                duration=(datetime.now(UTC) - entry.queued_stamp),
+                data=image_binary,
+                extra=image_details,
+                load_duration=get_load_duration(image_details),
+            ))
+
+        trace.finish()
+
+    @staticmethod
+    def __fail(entries: List[_BatchEntry], e: Optional[Exception]) -> None:
+        for entry in entries:
+            if entry.result.done():
+                continue
+
+            if e is None:
+                entry.result.cancel()
+            else:
+                entry.result.set_exception(e)
+
+    @staticmethod
+    def __get_seeds(image_data: Dict) -> List[str]:
+        try:
+            return [str(seed) for seed in json.loads(image_data.get("info", "{}")).get("all_seeds", [])]
+        except (TypeError, ValueError, AttributeError):
+            return []
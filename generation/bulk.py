@@ -0,0 +1,371 @@
+"""
+Runs generations in bulk from a JSONL file of inputs.
+
+Usage (from the directory containing the library):
+```
+python -m pmllib.generation.bulk prompts.jsonl output --kind image --concurrency 4
+```
+
+Every line of the input file is a JSON object with the fields of `GenerationInput` (only `prompt` is required)
+and an optional `id`, which defaults to the line number. Lines that aren't valid inputs are recorded as failed. Results are appended to `results.jsonl` in the output directory,
+and images are written next to it. Running the same command again resumes where the previous run stopped.
+"""
+
+from argparse import ArgumentParser, Namespace
+from asyncio import Queue, Task, ensure_future, gather, sleep, to_thread
+from dataclasses import dataclass, fields
+from io import BytesIO
+from time import monotonic
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Set, TextIO, Tuple, Union
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+from .types.structs import GenerationInput, GenerationOutput
+from ..utils.service import ServiceBusyException
+
+RESULTS_FILE = "results.jsonl"
+IMAGES_DIRECTORY = "images"
+
+_INPUT_FIELDS = {field.name for field in fields(GenerationInput)}
+
+# IDs made of these characters (and not starting with a dot) are used as file names as they are.
+_SAFE_ID = re.compile(r"[A-Za-z0-9_.-]{1,128}")
+
+@dataclass
+class BulkProgress:
+    """
+    The progress of a `BulkRunner`.
+    """
+
+    completed: int = 0
+    """How many inputs were generated successfully."""
+
+    failed: int = 0
+    """How many inputs couldn't be generated."""
+
+    skipped: int = 0
+    """How many inputs were skipped because a previous run already completed them."""
+
+    elapsed: float = 0.0
+    """How long (in seconds) the run has been going."""
+
+    @property
+    def throughput(self) -> float:
+        """
+        Returns how many inputs were generated per second.
+        """
+
+        return self.completed / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.completed} completed, {self.failed} failed, {self.skipped} skipped in {self.elapsed:.1f}s ({self.throughput:.2f}/s)"
+
+def read_inputs(path: str) -> Iterator[Tuple[str, Union[GenerationInput, ValueError]]]:
+    """
+    Yields the ID and input of every line of the JSONL file at `path`, reading one line at a time.
+    Blank lines are skipped, and unknown fields are ignored. A line that isn't a valid input yields a `ValueError` describing why instead.
+    """
+
+    with open(path, "r", encoding="utf-8") as file:
+        for number, line in enumerate(file, start=1):
+            line = line.strip()
+
+            if not line:
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield str(number), ValueError(f"Line {number} isn't valid JSON: {e}")
+                continue
+
+            if not isinstance(record, dict):
+                yield str(number), ValueError(f"Line {number} isn't a JSON object.")
+                continue
+
+            _id = str(record.get("id", number))
+
+            try:
+                yield _id, GenerationInput(**{
+                    "model_name": None,
+                    "seed": None,
+                    **{key: value for key, value in record.items() if key in _INPUT_FIELDS},
+                })
+            except TypeError as e:
+                yield _id, ValueError(f"Line {number} isn't a valid input: {e}")
+
+def read_completed(path: str) -> Set[str]:
+    """
+    Returns the IDs of the inputs that were generated successfully according to the results file at `path`.
+    A line left incomplete by a crash is ignored.
+    """
+
+    completed: Set[str] = set()
+
+    if not os.path.exists(path):
+        return completed
+
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+
+            if result.get("status") == "ok":
+                completed.add(str(result["id"]))
+
+    return completed
+
+class BulkRunner:
+    """
+    Feeds inputs from a JSONL file to `generate` with at most `concurrency` calls in flight.
+
+    Inputs are read lazily, so the file is never loaded as a whole, and the reader waits while every worker is busy.
+    Results are written as soon as they arrive: images (outputs with `BytesIO` data) to the `images` folder of `output_directory`,
+    and a line of metadata per input to `results.jsonl`, which also serves as the checkpoint:
+    a later run with the same output directory skips every input that was already generated successfully.
+
+    Calls rejected because the backend is busy are retried with a random backoff up to `max_attempts` times,
+    other failures are recorded and the run moves on. `on_progress` is called every `progress_interval` seconds and once at the end.
+
+    Usage:
+    ```
+    generator = ImageGenerator()
+    runner = BulkRunner(generator.generate, "output", concurrency=4, on_progress=print)
+    progress = await runner.run("prompts.jsonl")
+    ```
+    """
+
+    def __init__(
+            self,
+            generate: Callable[[GenerationInput], Awaitable[GenerationOutput]],
+            output_directory: str,
+            concurrency: int = 4,
+            max_attempts: int = 5,
+            on_progress: Optional[Callable[[BulkProgress], None]] = None,
+            progress_interval: float = 5.0,
+    ) -> None:
+        self.generate = generate
+        """Generates the output of a single input."""
+
+        self.output_directory = output_directory
+        """Where the results and images are written."""
+
+        self.concurrency = concurrency
+        """How many inputs are generated at once."""
+
+        self.max_attempts = max_attempts
+        """How many times a call rejected because the backend is busy is attempted."""
+
+        self.on_progress = on_progress
+        """Called with the progress periodically."""
+
+        self.progress_interval = progress_interval
+        """How often (in seconds) `on_progress` is called."""
+
+        self.progress = BulkProgress()
+        """The progress of the current (or last) run."""
+
+        self.__results: Optional[TextIO] = None
+        self.__start = 0.0
+
+    @property
+    def results_path(self) -> str:
+        """
+        Returns the path of the results file.
+        """
+
+        return os.path.join(self.output_directory, RESULTS_FILE)
+
+    async def run(self, input_path: str) -> BulkProgress:
+        """
+        Generates every input of the JSONL file at `input_path` that wasn't completed by a previous run and returns the progress.
+        """
+
+        os.makedirs(os.path.join(self.output_directory, IMAGES_DIRECTORY), exist_ok=True)
+
+        completed = read_completed(self.results_path)
+        queue: Queue[Optional[Tuple[str, GenerationInput]]] = Queue(maxsize=self.concurrency * 2)
+
+        self.progress = BulkProgress()
+        self.__start = monotonic()
+        self.__results = self.__open_results()
+
+        workers = [ensure_future(self.__work(queue)) for _ in range(self.concurrency)]
+        reporter: Optional[Task] = ensure_future(self.__report()) if self.on_progress else None
+
+        try:
+            for _id, _input in read_inputs(input_path):
+                if _id in completed:
+                    self.progress.skipped += 1
+                    continue
+
+                if isinstance(_input, ValueError):
+                    self.progress.failed += 1
+                    self.__write({"id": _id, "status": "error", "prompt": None, "error": str(_input)})
+                    continue
+
+                # Blocks while the queue is full, so only a handful of inputs are held in memory at once.
+                await queue.put((_id, _input))
+
+            for _ in workers:
+                await queue.put(None)
+
+            await gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+            if reporter:
+                reporter.cancel()
+
+            self.__results.close()
+            self.__results = None
+            self.progress.elapsed = monotonic() - self.__start
+
+        if self.on_progress:
+            self.on_progress(self.progress)
+
+        return self.progress
+
+    def __open_results(self) -> TextIO:
+        file = open(self.results_path, "a+", encoding="utf-8")
+
+        # A crash may have left the last line incomplete, which must not be continued by the next result.
+        if file.tell() > 0:
+            file.seek(file.tell() - 1)
+
+            if file.read(1) != "\n":
+                file.write("\n")
+
+        return file
+
+    async def __work(self, queue: "Queue[Optional[Tuple[str, GenerationInput]]]") -> None:
+        while True:
+            item = await queue.get()
+
+            if item is None:
+                return
+
+            _id, _input = item
+
+            try:
+                output = await self.__generate(_input)
+                result = await self.__save(_id, output)
+                self.progress.completed += 1
+            except Exception as e:
+                result = {"id": _id, "status": "error", "prompt": _input.prompt, "error": str(e)}
+                self.progress.failed += 1
+
+            self.__write(result)
+
+    def __write(self, result: Dict[str, Any]) -> None:
+        self.__results.write(json.dumps(result, default=str) + "\n")
+        self.__results.flush()
+
+    async def __generate(self, _input: GenerationInput) -> GenerationOutput:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await self.generate(_input)
+            except ServiceBusyException:
+                if attempt >= self.max_attempts:
+                    raise
+
+                await sleep(random.uniform(0, min(2 ** attempt, 30)))
+
+        raise RuntimeError("Unreachable")
+
+    async def __save(self, _id: str, output: GenerationOutput) -> Dict[str, Any]:
+        result: Dict[str, Any] = {
+            "id": _id,
+            "status": "ok",
+            "prompt": output.prompt,
+            "model_name": output.model_name,
+            "seed": output.seed,
+            "duration": output.duration.total_seconds() if output.duration else None,
+            "load_duration": output.load_duration.total_seconds() if output.load_duration else None,
+        }
+
+        if isinstance(output.data, BytesIO):
+            path = os.path.join(IMAGES_DIRECTORY, f"{_get_file_name(_id)}.{_get_extension(output.data)}")
+            await to_thread(_write_file, os.path.join(self.output_directory, path), output.data.getvalue())
+            result["path"] = path
+        else:
+            result["data"] = output.data
+
+        if output.extra:
+            # Binary details (like thumbnails) don't belong in the metadata.
+            result["extra"] = {key: value for key, value in output.extra.items() if isinstance(value, (str, int, float, bool, type(None)))}
+
+        return result
+
+    async def __report(self) -> None:
+        while True:
+            await sleep(self.progress_interval)
+            self.progress.elapsed = monotonic() - self.__start
+            self.on_progress(self.progress)
+
+def _get_file_name(_id: str) -> str:
+    # IDs come from the input file, so any other ID (like one with a path separator) is replaced by its hash.
+    if _SAFE_ID.fullmatch(_id) and not _id.startswith("."):
+        return _id
+
+    return hashlib.sha256(_id.encode("utf-8")).hexdigest()[:32]
+
+def _get_extension(data: BytesIO) -> str:
+    header = data.getbuffer()[:12].tobytes()
+
+    if header.startswith(b"\xff\xd8"):
+        return "jpg"
+
+    if header.startswith(b"RIFF") and header[8:12] == b"WEBP":
+        return "webp"
+
+    return "png"
+
+def _write_file(path: str, data: bytes) -> None:
+    with open(path, "wb") as file:
+        file.write(data)
+
+def parse_args(argv: List[str]) -> Namespace:
+    parser = ArgumentParser(prog="bulk", description="Generates every input of a JSONL file and writes the results to a directory.")
+    parser.add_argument("input", help="The JSONL file of inputs.")
+    parser.add_argument("output", help="The directory the results are written to. Reusing it resumes a previous run.")
+    parser.add_argument("--kind", choices=["image", "chat"], default="image", help="What to generate.")
+    parser.add_argument("--concurrency", type=int, default=4, help="How many inputs are generated at once.")
+    parser.add_argument("--progress-interval", type=float, default=5.0, help="How often (in seconds) the progress is reported.")
+
+    return parser.parse_args(argv)
+
+async def run(args: Namespace) -> BulkProgress:
+    # Imported here, so using the runner as a library doesn't pull in both generators.
+    from .chat import ChatGenerator
+    from .img import ImageGenerator
+    from ..utils.http import close_default_client
+
+    if args.kind == "image":
+        generate = ImageGenerator().generate
+    else:
+        # Every input is an independent conversation.
+        generate = lambda _input: ChatGenerator(None).generate(_input)
+
+    runner = BulkRunner(generate, args.output, args.concurrency, on_progress=lambda progress: print(progress, file=sys.stderr), progress_interval=args.progress_interval)
+
+    try:
+        return await runner.run(args.input)
+    finally:
+        await close_default_client()
+
+def main(argv: List[str]) -> None:
+    progress = asyncio.run(run(parse_args(argv)))
+
+    if progress.failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,14 +1,45 @@
-from typing import Optional
-import aiohttp
+from contextlib import aclosing
+from typing import TYPE_CHECKING, AsyncGenerator, AsyncIterator, Callable, Dict, List, Optional, Set
+from aiohttp import ClientResponseError
 from .types.contracts import GeneratorContract
 from .types.structs import ChatModel, GenerationInput, GenerationOutput
-from ..utils.service import AsyncService
-from .types.exceptions import ServiceBusyException, GenerationAPIException
-from datetime import datetime, UTC
-from .constants.llm_constants import API_BASE, COMPLETION_ENDPOINT
+from ..utils.service import AsyncService, Scheduler
+from ..utils.http import HttpClient, get_default_client
+from ..utils.backends import BackendPool, RoutingStrategy
+from ..utils.singleflight import SingleFlight
+from ..utils.metrics import NULL_TRACE, Metrics, Trace, get_default_metrics
+from ..utils.resilience import Deadline, HedgePolicy, RetryPolicy
+from .types.exceptions import GenerationAPIException
+from datetime import datetime, timedelta, UTC
+from time import perf_counter_ns
+from .constants.llm_constants import API_BASES, COMPLETION_ENDPOINT, GENERATE_ENDPOINT, HEALTH_ENDPOINT, HEALTH_CHECK_INTERVAL, MAX_FAILURES, MAX_CONCURRENCY, MAX_QUEUE_SIZE, QUEUE_TIMEOUT
+from .constants.llm_constants import BREAKER_RESET_TIMEOUT, REQUEST_TIMEOUT, RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, PREFIX_PRIME_TOKENS, PREFIX_TEMPLATE, MAX_RESENT_IMAGES
 from .types.structs import ChatMessage, ChatHistory
-from .types.enums import ChatRole
+from .types.enums import ChatRole, StreamCancelPolicy
 from .constants.llm_models import BEST_OVERALL_MODEL
+from .helpers.model_helpers import normalize_chat_model_name
+from .helpers.payload_helpers import get_load_duration, payload_key, with_encoded_system_prompt, with_image_limit, with_keep_alive
+from .prefixes import PrefixCache
+from .attachments import AttachmentStore
+from ..utils.codec import Fragment
+
+if TYPE_CHECKING:
+    from .summarizer import RollingSummarizer
+    from .retrieval import MessageRetriever
+    from .residency import ResidencyManager
+    from .chat_cache import CacheLookup, ResponseCache
+
+# Shared by every generator that wasn't given its own, so identical requests are coalesced process-wide.
+_shared_flights = SingleFlight()
+
+# Shared by every generator that wasn't given its own, so a prompt prefix is only evaluated once process-wide.
+_shared_prefixes = PrefixCache()
+
+# Shared by every generator that wasn't given its own, so an image attached in several conversations is only kept once.
+_shared_attachments = AttachmentStore()
+
+# Shared by every generator that wasn't given its own, so the load of all of them is balanced across the Ollama servers.
+_shared_backends = BackendPool(API_BASES, RoutingStrategy.MODEL_AFFINITY, health_path=HEALTH_ENDPOINT, health_interval=HEALTH_CHECK_INTERVAL, max_failures=MAX_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT)
 
 class ChatGenerator(GeneratorContract, AsyncService):
     """
@@ -18,12 +49,69 @@ class ChatGenerator(GeneratorContract, AsyncService):
     However, you have the option to provide a custom history object and/or model to use.
     This is useful for maintaining a conversation across multiple requests or using a specific model.
     Otherwise, it will use the best overall model and start a new conversation.
-    """
 
-    history = ChatHistory()
+    All requests go through a pooled `HttpClient`. Unless one is provided, the process-wide default client is used
+    so connections to the backend are shared with every other generator.
+    Requests are spread over the Ollama servers of a `BackendPool` (all of `API_BASES` by default), preferring servers
+    which already have the model loaded. Calls wait for a free slot of the `Scheduler` shared by every generator
+    using the same servers, unless a custom scheduler is provided.
+    Identical concurrent `summarize_history()` calls share a single request.
+    The Ollama context of the fixed instructions of summaries is kept in a `PrefixCache` (shared by every generator unless one is provided),
+    so they aren't evaluated again for every summary (see `complete()`).
+    If a `MessageRetriever` is attached, only the latest messages of the history are sent, along with the earlier messages most relevant to the prompt.
+    If a `ResponseCache` is provided, prompts it has already seen (in the same context) are answered from it without a request.
+
+    Attached images are kept in an `AttachmentStore` (shared by every generator unless one is provided), which downscales them
+    to the model's `image_resolution` and keeps identical images once. Only the latest `max_images` images of the conversation
+    are sent along with a request, earlier messages are sent without theirs.
+
+    The model's `keep_alive` hint is sent along with every request. If a `ResidencyManager` is provided,
+    the load times Ollama reports for servers which didn't have the model loaded yet are recorded by it.
+
+    Every call is traced through `metrics` (the process-wide registry by default): the time spent waiting in the queue,
+    on the request itself (see `HttpClient`) and updating the history, along with the token counts and timings Ollama reports.
+
+    Calls have to complete within `timeout` seconds (or the input's own `timeout`), waiting in line included,
+    otherwise a `DeadlineExceededException` is raised. Failed requests are retried on another server according to `retry`.
+    If a `HedgePolicy` is provided, requests taking longer than usual are also sent to a second server and
+    whichever responds first is used. Streams are neither retried nor hedged once they started.
+    A stream has to receive its first chunk within the time budget, and every later chunk within the budget of the previous one.
+    """
 
-    def __init__(self, custom_history: Optional[ChatHistory], model: ChatModel = BEST_OVERALL_MODEL) -> None:
+    def __init__(
+            self,
+            custom_history: Optional[ChatHistory],
+            model: ChatModel = BEST_OVERALL_MODEL,
+            client: Optional[HttpClient] = None,
+            scheduler: Optional[Scheduler] = None,
+            flights: Optional[SingleFlight] = None,
+            backends: Optional[BackendPool] = None,
+            residency: Optional["ResidencyManager"] = None,
+            metrics: Optional[Metrics] = None,
+            retry: Optional[RetryPolicy] = None,
+            hedge: Optional[HedgePolicy] = None,
+            timeout: Optional[float] = REQUEST_TIMEOUT,
+            prefixes: Optional[PrefixCache] = None,
+            cache: Optional["ResponseCache"] = None,
+            attachments: Optional[AttachmentStore] = None,
+            max_images: Optional[int] = MAX_RESENT_IMAGES,
+    ) -> None:
+        self.backends = backends if backends else _shared_backends
+        AsyncService.__init__(self, scheduler if scheduler else Scheduler.for_backend(self.backends.key, MAX_CONCURRENCY * len(self.backends), MAX_QUEUE_SIZE, QUEUE_TIMEOUT))
         self.model = model
+        self.client = client if client else get_default_client()
+        self.flights = flights if flights else _shared_flights
+        self.residency = residency
+        self.metrics = metrics if metrics else get_default_metrics()
+        self.retry = retry if retry else RetryPolicy(RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+        self.hedge = hedge
+        self.timeout = timeout
+        self.prefixes = prefixes if prefixes else _shared_prefixes
+        self.cache = cache
+        self.attachments = attachments if attachments else _shared_attachments
+        self.max_images = max_images
+        self.summarizer: Optional["RollingSummarizer"] = None
+        self.retriever: Optional["MessageRetriever"] = None
         self.__default_system_prompt_entry = ChatMessage(
             role=ChatRole.SYSTEM,
             content=self.model.system_prompt,
@@ -35,70 +123,123 @@ class ChatGenerator(GeneratorContract, AsyncService):
             images=None,
         )
     
-        if custom_history:
+        if custom_history is not None:
             self.history = custom_history
         else:
-            self.history.push(self.__default_system_prompt_entry)
-            self.history.push(self.__default_conversation_starter_entry)
-
-    async def generate(self, _input: GenerationInput) -> GenerationOutput:
-        if await self.get_busyness():
-            raise ServiceBusyException()
-        
-        self.set_busyness(True)
-        start_stamp = datetime.now(UTC)
-
-        self.history.push(ChatMessage(
-            role=ChatRole.USER,
-            content=_input.prompt,
-            images=[_input.image] if _input.image else None,
-        ))
-
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=API_BASE + COMPLETION_ENDPOINT, json={
-                    "model": self.model.name, # "llava:7b",
-                    "messages": self.history.to_ollama_payload(),
-                    "stream": False,
-                    "images": [_input.image] if _input.image else None,
-                }) as generation_req:
-                gen_resp: dict = await generation_req.json()
-
-        if "error" in gen_resp.keys():
-            self.set_busyness(False)
-            raise GenerationAPIException(gen_resp["error"])
-        
-        self.history.push(ChatMessage.from_ollama_response(gen_resp))
-
-        self.set_busyness(False)
-        end_stamp = datetime.now(UTC)
+            self.history = self.new_history()
+
+        if self.history.token_budget is None:
+            self.history.token_budget = self.model.token_budget
+
+    async def generate(self, _input: GenerationInput, on_position: Optional[Callable[[int], None]] = None) -> GenerationOutput:
+        """
+        Generates a response to the prompt and appends both to the history.
+
+        If the backend is busy, the call waits in line. `on_position` is called with the call's position in the queue whenever it changes.
+        """
+
+        deadline = Deadline(_input.timeout if _input.timeout is not None else self.timeout)
+
+        with self.metrics.trace("chat.generate", model=self.model.name) as trace:
+            async with deadline.enforce():
+                prompt_message = await self.create_prompt_message(_input, trace)
+                cached = await self.lookup_response(prompt_message, trace)
+
+                if cached is not None and cached.response is not None:
+                    # Served without a request, so there's no need to wait for a slot either.
+                    start_stamp = datetime.now(UTC)
+                    gen_resp = self.push_cached_response(prompt_message, cached, trace)
+                    end_stamp = datetime.now(UTC)
+                else:
+                    recalled = await self.recall(_input.prompt, trace)
+                    queued_ns = perf_counter_ns()
+
+                    async with self.scheduler.slot(_input.priority, on_position=on_position, group=self.model.name, tenant=_input.tenant):
+                        trace.record("queue_wait", queued_ns)
+                        start_stamp = datetime.now(UTC)
+
+                        with trace.phase("history"):
+                            self.history.push(prompt_message)
+
+                        gen_resp = await self.post(COMPLETION_ENDPOINT, with_keep_alive({
+                            "model": self.model.name, # "llava:7b",
+                            "messages": with_encoded_system_prompt(with_image_limit(self.to_ollama_payload(recalled), self.max_images)),
+                            "stream": False,
+                            "options": {"num_ctx": self.model.context_size},
+                        }, self.model.keep_alive), trace, deadline)
+
+                        record_ollama_stats(trace, gen_resp)
+
+                        with trace.phase("history"):
+                            self.history.push(ChatMessage.from_ollama_response(gen_resp))
+
+                        end_stamp = datetime.now(UTC)
+
+                    if cached is not None:
+                        self.cache.store(cached, self.history.get_last().content, self.model.name)
+
+            if self.summarizer:
+                await self.summarizer.after_turn()
+
+            if self.retriever is not None:
+                await self.retriever.after_turn([prompt_message, self.history.get_last()])
 
         return GenerationOutput[str](
             prompt=_input.prompt,
             model_name=_input.model_name,
             duration=(end_stamp - start_stamp),
             data=self.history.get_last().content,
-            extra=gen_resp
+            extra=gen_resp,
+            load_duration=get_load_duration(gen_resp),
         )
     
+    def stream(self, _input: GenerationInput, cancel_policy: StreamCancelPolicy = StreamCancelPolicy.DISCARD) -> "ChatStream":
+        """
+        Returns a `ChatStream` which yields the response in chunks as the LLM generates it.
+
+        The request is only sent once iteration starts. See `ChatStream` for details on how the history is updated.
+        """
+
+        return ChatStream(self, _input, cancel_policy)
+
     def replace_history(self, history: ChatHistory) -> None:
         """
         Overrides the current history object with a new one.
 
         Please note that this replaces the current history object but
-        doesn't inject a system prompt.
+        doesn't inject a system prompt (see `new_history()`). Histories without a `token_budget` get the model's.
         """
 
         self.history = history
 
+        if self.history.token_budget is None:
+            self.history.token_budget = self.model.token_budget
+
+        if self.summarizer:
+            self.summarizer.attach(self.history)
+
     def reset_history(self) -> None:
         """
         Resets the conversation history (makes the LLM forget everything) so the LLM behaves
         just like it would when starting a new conversation.
         """
 
-        self.history = ChatHistory()
-        self.history.push(self.__default_system_prompt_entry)
-        self.history.push(self.__default_conversation_starter_entry)
+        self.history = self.new_history()
+
+        if self.summarizer:
+            self.summarizer.attach(self.history)
+
+    def new_history(self) -> ChatHistory:
+        """
+        Returns a new history limited to the model's `token_budget`, starting with the (pinned) default system prompt.
+        Can be used as the `factory` of a `SessionManager`, so every conversation starts like a fresh generator's.
+        """
+
+        history = ChatHistory(token_budget=self.model.token_budget)
+        history.push(self.__default_system_prompt_entry)
+        history.push(self.__default_conversation_starter_entry)
+
+        return history
 
     def append_to_history(self, message: ChatMessage) -> None:
         """
@@ -113,46 +254,435 @@ class ChatGenerator(GeneratorContract, AsyncService):
         If no history is provided, it will use the current history object.
         """
 
-        if await self.get_busyness():
-            raise ServiceBusyException()
-        
-        self.set_busyness(True)
-        start_stamp = datetime.now(UTC)
-
-        history = history if history else self.history
+        history = history if history is not None else self.history
         history_as_string = "\n".join([message.content for message in history.items])
 
-        prompt = f"""
+        # The instructions come first and don't depend on the conversation, so their context can be reused by every summary.
+        instructions = f"""
         You are a language model that has been trained on a large corpus of text data.
         You should write a short and consise description about the relationship between {assistant_name} and each other person.
         You are instructing an actor who is playing the role of {assistant_name}.
 
         Follow the style of this example: "You are {assistant_name}... You have these experiences with these people:"
         Only include details about the conversation and its themes and subjects.
+        """
 
+        prompt = f"""
         This is the conversation:
         {history_as_string}
         """
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url=API_BASE + "/api/generate", json={
-                    "model": self.model.name, # "llava:7b",
-                    "prompt": prompt,
-                    "stream": False,
-                }) as generation_req:
-                    gen_resp: dict = await generation_req.json()
+        # Summaries don't depend on the generator's state, so identical concurrent requests can share a single call.
+        return await self.flights.do(payload_key([self.backends.key, self.model.name, instructions, prompt]), lambda: self.complete(prompt, prefix=instructions))
+
+    async def complete(self, prompt: str, options: Optional[Dict[str, int]] = None, timeout: Optional[float] = None, prefix: Optional[str] = None) -> GenerationOutput[str]:
+        """
+        Returns the LLM's completion of a raw, stateless prompt (without using or affecting the history).
+        `options` are passed to Ollama in addition to the model's context size.
+        `timeout` overrides the generator's default time budget.
+
+        A `prefix` is sent ahead of the prompt. It's meant for long instructions shared by many calls:
+        the first call evaluates the prefix on its own and stores the `context` Ollama returns for it in the generator's `PrefixCache`,
+        every later call with the same prefix sends that context along with just the prompt, so the prefix isn't evaluated again.
+        If a server rejects a stored context, it's dropped and the call is made with the prefix's text instead.
+
+        Calls with a prefix aren't wrapped in the model's template, so the LLM sees the same text (the prefix, a line break
+        and the prompt) whether the context was cached or not.
+        """
+
+        deadline = Deadline(timeout if timeout is not None else self.timeout)
+
+        with self.metrics.trace("chat.complete", model=self.model.name) as trace:
+            async with deadline.enforce():
+                queued_ns = perf_counter_ns()
+
+                async with self.scheduler.slot(group=self.model.name):
+                    trace.record("queue_wait", queued_ns)
+                    start_stamp = datetime.now(UTC)
 
-        if "error" in gen_resp.keys():
-            self.set_busyness(False)
-            raise GenerationAPIException(gen_resp["error"])
+                    context = await self.__get_prefix_context(prefix, trace, deadline) if prefix else None
+
+                    try:
+                        gen_resp = await self.post(GENERATE_ENDPOINT, self.__generate_payload(prompt, options, prefix, context), trace, deadline)
+                    except GenerationAPIException:
+                        if context is None:
+                            raise
+
+                        self.prefixes.invalidate(self.model.name, prefix)
+                        gen_resp = await self.post(GENERATE_ENDPOINT, self.__generate_payload(prompt, options, prefix, None), trace, deadline)
+
+                    record_ollama_stats(trace, gen_resp)
+                    end_stamp = datetime.now(UTC)
 
-        self.set_busyness(False)
-        end_stamp = datetime.now(UTC)
-        
         return GenerationOutput[str](
             prompt=prompt,
             model_name=self.model.name,
             duration=(end_stamp - start_stamp),
             data=str(gen_resp["response"]),
-            extra=gen_resp
-        )
\ No newline at end of file
+            extra=gen_resp,
+            load_duration=get_load_duration(gen_resp),
+        )
+
+    async def post(self, endpoint: str, payload: dict, trace: Trace, deadline: Optional[Deadline] = None) -> dict:
+        """
+        Sends a non-streaming request to `endpoint` of one of the backends and returns the response.
+
+        Failed requests are retried on another server if possible, and slow ones are hedged if the generator has a `HedgePolicy`.
+        Doesn't wait for a slot of the scheduler, that's up to the caller.
+        """
+
+        tried: Set[str] = set()
+        model_name = normalize_chat_model_name(self.model.name)
+
+        # Encoded once up front, so retries and hedges don't encode the whole conversation again.
+        with trace.phase("json_encode"):
+            body = self.client.encode(payload)
+
+        async def attempt(_: int) -> dict:
+            async with self.backends.acquire(model_name, tried) as backend:
+                tried.add(backend.url)
+                was_loaded = model_name in backend.loaded_models
+                response: dict = await self.client.post_json(backend.url + endpoint, body, trace)
+
+            if "error" in response.keys():
+                raise GenerationAPIException(response["error"])
+
+            self.record_load(response, was_loaded)
+            return response
+
+        async def send() -> dict:
+            return await self.hedge.run(attempt) if self.hedge else await attempt(0)
+
+        try:
+            # Chat requests don't change anything on the server, so they can always be retried.
+            return await self.retry.run(send, idempotent=True, deadline=deadline)
+        except ClientResponseError as e:
+            raise GenerationAPIException(e.message) from e
+
+    def __generate_payload(self, prompt: str, options: Optional[Dict[str, int]], prefix: Optional[str], context: Optional[Fragment]) -> dict:
+        payload = {
+            "model": self.model.name, # "llava:7b",
+            "prompt": prompt if prefix is None else f"\n{prompt}" if context is not None else f"{prefix}\n{prompt}",
+            "stream": False,
+            "options": {"num_ctx": self.model.context_size, **(options or {})},
+        }
+
+        # Ollama prepends the context as text, so the prefix and the prompt have to be sent as one untemplated text either way.
+        if prefix is not None:
+            payload["template"] = PREFIX_TEMPLATE
+
+        if context is not None:
+            payload["context"] = context
+
+        return with_keep_alive(payload, self.model.keep_alive)
+
+    async def __get_prefix_context(self, prefix: str, trace: Trace, deadline: Deadline) -> Optional[Fragment]:
+        context = self.prefixes.get(self.model.name, prefix)
+
+        if context is not None:
+            trace.count("prefix_cache_hit")
+            return context
+
+        trace.count("prefix_cache_miss")
+
+        async def prime() -> Optional[Fragment]:
+            response = await self.post(GENERATE_ENDPOINT, with_keep_alive({
+                "model": self.model.name,
+                "prompt": prefix,
+                "template": PREFIX_TEMPLATE,
+                "stream": False,
+                "options": {"num_ctx": self.model.context_size, "num_predict": PREFIX_PRIME_TOKENS},
+            }, self.model.keep_alive), NULL_TRACE, deadline)
+
+            # The tokens generated to get a response end the context, so they're cut off to keep only the evaluated prefix.
+            context = list(response.get("context") or [])
+            generated = int(response.get("eval_count") or 0)
+            context = context[:len(context) - generated] if generated < len(context) else []
+
+            return self.prefixes.put(self.model.name, prefix, context) if context else None
+
+        # Concurrent calls with the same new prefix share a single priming request.
+        with trace.phase("prefix_prime"):
+            try:
+                return await self.flights.do(payload_key(["prefix", self.backends.key, self.model.name, prefix]), prime)
+            except GenerationAPIException:
+                # The call itself can still be made with the prefix's text.
+                return None
+
+    async def recall(self, prompt: str, trace: Trace) -> List[ChatMessage]:
+        """
+        Returns the earlier messages relevant to `prompt` according to the generator's `MessageRetriever`, if it has one.
+        """
+
+        if self.retriever is None:
+            return []
+
+        with trace.phase("retrieval"):
+            recalled = await self.retriever.recall(prompt)
+
+        trace.count("recalled_messages", len(recalled))
+        return recalled
+
+    async def create_prompt_message(self, _input: GenerationInput, trace: Trace) -> ChatMessage:
+        """
+        Returns the user message of `_input`, with its image (if any) taken from the generator's `AttachmentStore`.
+        """
+
+        if not _input.image:
+            return ChatMessage(role=ChatRole.USER, content=_input.prompt)
+
+        with trace.phase("attachments"):
+            image = await self.attachments.add(_input.image, self.model.image_resolution)
+
+        return ChatMessage(role=ChatRole.USER, content=_input.prompt, images=[image])
+
+    async def lookup_response(self, prompt_message: ChatMessage, trace: Trace) -> Optional["CacheLookup"]:
+        """
+        Looks up the response to `prompt_message` in the generator's `ResponseCache`.
+        Returns `None` if the generator has no cache or the response may not be cached.
+        """
+
+        if self.cache is None or not self.cache.accepts(self.model, prompt_message):
+            return None
+
+        with trace.phase("response_cache"):
+            lookup = await self.cache.lookup(self.model, self.history, prompt_message)
+
+        trace.count("response_cache_hit" if lookup.response is not None else "response_cache_miss")
+        return lookup
+
+    def push_cached_response(self, prompt_message: ChatMessage, cached: "CacheLookup", trace: Trace) -> dict:
+        """
+        Pushes `prompt_message` and the cached response of a hit to the history, and returns the response shaped like Ollama's.
+        """
+
+        with trace.phase("history"):
+            self.history.push(prompt_message)
+            self.history.push(ChatMessage(role=ChatRole.ASSISTANT, content=cached.response.content))
+
+        # Shaped like an Ollama response, with the tier the response came from.
+        return {
+            "model": cached.response.model_name,
+            "message": {"role": str(ChatRole.ASSISTANT), "content": cached.response.content},
+            "done": True,
+            "cache": cached.tier,
+        }
+
+    def to_ollama_payload(self, recalled: List[ChatMessage]) -> List[dict]:
+        """
+        Returns the messages to send: the whole history, or the latest messages along with the `recalled` ones if the generator has a `MessageRetriever`.
+        """
+
+        return self.retriever.to_ollama_payload(self.history, recalled) if self.retriever is not None else self.history.to_ollama_payload()
+
+    def record_load(self, response: dict, was_loaded: bool) -> None:
+        """
+        Reports the load time of the model to the residency manager, if the server handling `response` had to load it.
+        """
+
+        if self.residency and not was_loaded:
+            self.residency.record_load(self.model.name, get_load_duration(response))
+
+def record_ollama_stats(trace: Trace, response: Optional[dict]) -> None:
+    """
+    Adds the token counts and timings (reported in nanoseconds) of an Ollama response to `trace`.
+    """
+
+    if not trace.enabled or not response:
+        return
+
+    for name in ("prompt_eval_count", "eval_count"):
+        if isinstance(response.get(name), int):
+            trace.count(name, response[name])
+
+    for name in ("load_duration", "prompt_eval_duration", "eval_duration"):
+        if isinstance(response.get(name), int):
+            trace.add(name, response[name])
+
+class ChatStream:
+    """
+    An async iterator over the content deltas of a streamed chat response.
+
+    The history of the generator is only updated once the stream completes, at which point
+    both the user's prompt and the fully assembled response are pushed to it and `output` becomes available.
+    If the stream doesn't complete, the generator's history is updated according to `cancel_policy`.
+    A stream that is cancelled, or closed with `aclose()` before it completed, closes its connection to Ollama, which stops generating right away.
+
+    The generator's `timeout` (or the input's own) bounds the wait for a slot along with the first chunk, and then the wait for each further chunk,
+    so a server that stops sending without closing the connection raises a `DeadlineExceededException` instead of hanging the consumer.
+
+    Usage:
+    ```
+    stream = generator.stream(_input)
+
+    async for delta in stream:
+        print(delta, end="")
+
+    print(stream.time_to_first_token, stream.output.duration)
+    ```
+    """
+
+    def __init__(self, generator: ChatGenerator, _input: GenerationInput, cancel_policy: StreamCancelPolicy) -> None:
+        self.__generator = generator
+        self.__input = _input
+
+        self.cancel_policy = cancel_policy
+        """What to do with the history if the stream doesn't complete."""
+
+        self.time_to_first_token: Optional[timedelta] = None
+        """How long it took to receive the first non-empty delta."""
+
+        self.output: Optional[GenerationOutput[str]] = None
+        """The final output. Only set once the stream has completed."""
+
+        self.__deltas: List[str] = []
+        self.__iterator: Optional[AsyncGenerator[str, None]] = None
+
+    @property
+    def content(self) -> str:
+        """
+        Returns the response assembled from the deltas received so far.
+        """
+
+        return "".join(self.__deltas)
+
+    @property
+    def completed(self) -> bool:
+        """
+        Returns `True` if the stream has completed successfully.
+        """
+
+        return self.output is not None
+
+    async def aclose(self) -> None:
+        """
+        Stops the stream if it's still running. Meant for consumers that stop iterating before the stream completed.
+        """
+
+        if self.__iterator is not None:
+            await self.__iterator.aclose()
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        self.__iterator = self.__iterate()
+        return self.__iterator
+
+    async def __iterate(self) -> AsyncIterator[str]:
+        generator = self.__generator
+
+        with generator.metrics.trace("chat.stream", model=generator.model.name) as trace:
+            prompt_message = await generator.create_prompt_message(self.__input, trace)
+            cached = await generator.lookup_response(prompt_message, trace)
+
+            if cached is not None and cached.response is not None:
+                # The whole response is yielded as a single delta.
+                start_stamp = datetime.now(UTC)
+                last_chunk = generator.push_cached_response(prompt_message, cached, trace)
+                self.time_to_first_token = datetime.now(UTC) - start_stamp
+                self.__deltas.append(cached.response.content)
+                self.output = GenerationOutput[str](
+                    prompt=self.__input.prompt,
+                    model_name=self.__input.model_name,
+                    duration=self.time_to_first_token,
+                    data=cached.response.content,
+                    extra=last_chunk,
+                    load_duration=None,
+                )
+
+                yield cached.response.content
+            else:
+                recalled = await generator.recall(self.__input.prompt, trace)
+                timeout = self.__input.timeout if self.__input.timeout is not None else generator.timeout
+                deadline = Deadline(timeout)
+                queued_ns = perf_counter_ns()
+
+                # Enforced around every wait separately, since a timeout can't span the yields of the stream.
+                async with deadline.enforce():
+                    ticket = await generator.scheduler.acquire(self.__input.priority, group=generator.model.name, tenant=self.__input.tenant)
+
+                try:
+                    trace.record("queue_wait", queued_ns)
+                    start_stamp = datetime.now(UTC)
+                    last_chunk: Optional[dict] = None
+
+                    try:
+                        model_name = normalize_chat_model_name(generator.model.name)
+
+                        async with generator.backends.acquire(model_name) as backend:
+                            was_loaded = model_name in backend.loaded_models
+
+                            # Closed explicitly, so the response is released as soon as the last chunk arrives.
+                            async with aclosing(generator.client.stream_json_lines(backend.url + COMPLETION_ENDPOINT, with_keep_alive({
+                                "model": generator.model.name,
+                                "messages": with_encoded_system_prompt(with_image_limit(generator.to_ollama_payload(recalled) + [prompt_message.to_json()], generator.max_images)),
+                                "stream": True,
+                                "options": {"num_ctx": generator.model.context_size},
+                            }, generator.model.keep_alive), trace)) as chunks:
+                                while True:
+                                    async with deadline.enforce():
+                                        chunk = await anext(chunks, None)
+
+                                    if chunk is None:
+                                        break
+
+                                    # Every chunk restarts the budget, so only a server that stops sending runs out of it.
+                                    deadline = Deadline(timeout)
+
+                                    if "error" in chunk.keys():
+                                        raise GenerationAPIException(chunk["error"])
+
+                                    delta: str = chunk.get("message", {}).get("content", "")
+
+                                    if delta:
+                                        if self.time_to_first_token is None:
+                                            self.time_to_first_token = datetime.now(UTC) - start_stamp
+
+                                        self.__deltas.append(delta)
+                                        yield delta
+
+                                    if chunk.get("done"):
+                                        last_chunk = chunk
+                                        break
+
+                        if last_chunk is None:
+                            raise GenerationAPIException("The stream ended before the response was completed.")
+
+                        generator.record_load(last_chunk, was_loaded)
+                        record_ollama_stats(trace, last_chunk)
+
+                        with trace.phase("history"):
+                            generator.history.push(prompt_message)
+                            generator.history.push(ChatMessage(role=ChatRole.ASSISTANT, content=self.content.strip()))
+
+                        self.output = GenerationOutput[str](
+                            prompt=self.__input.prompt,
+                            model_name=self.__input.model_name,
+                            duration=(datetime.now(UTC) - start_stamp),
+                            data=generator.history.get_last().content,
+                            extra=last_chunk,
+                            load_duration=get_load_duration(last_chunk),
+                        )
+                    except ClientResponseError as e:
+                        raise GenerationAPIException(e.message) from e
+                    finally:
+                        if not self.completed:
+                            self.__apply_cancel_policy(prompt_message)
+                finally:
+                    generator.scheduler.release(ticket)
+
+                if cached is not None:
+                    generator.cache.store(cached, self.output.data, generator.model.name)
+
+            if generator.summarizer:
+                await generator.summarizer.after_turn()
+
+            if generator.retriever is not None:
+                await generator.retriever.after_turn([prompt_message, generator.history.get_last()])
+
+    def __apply_cancel_policy(self, prompt_message: ChatMessage) -> None:
+        if self.cancel_policy == StreamCancelPolicy.DISCARD:
+            return
+
+        self.__generator.history.push(prompt_message)
+
+        if self.cancel_policy == StreamCancelPolicy.KEEP_PARTIAL and self.__deltas:
+            self.__generator.history.push(ChatMessage(role=ChatRole.ASSISTANT, content=self.content.strip()))
\ No newline at end of file
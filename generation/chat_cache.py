@@ -0,0 +1,250 @@
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Dict, List, Optional, Sequence
+import string
+from .embeddings import EmbeddingGenerator
+from .types.structs import ChatHistory, ChatMessage, ChatModel
+from .types.exceptions import MissingDependencyException
+from .helpers.payload_helpers import payload_key
+from .constants.llm_constants import RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL, RESPONSE_CACHE_CONTEXT_MESSAGES, RESPONSE_CACHE_SIMILARITY
+from ..utils.cache import CacheStats
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+@dataclass(init=True, repr=True, frozen=True)
+class CachedResponse:
+    """
+    A chat response served from a `ResponseCache`.
+    """
+
+    content: str
+    """The content of the response."""
+
+    model_name: str
+    """The model which generated the response."""
+
+@dataclass(repr=True)
+class CacheLookup:
+    """
+    The result of looking up a prompt in a `ResponseCache`. It's also used to store the response of a miss.
+    """
+
+    key: str
+    """The hash of the model and the normalized messages the response depends on."""
+
+    partition: str
+    """The hash of the model and the normalized messages before the prompt. Only responses from the same partition are similar."""
+
+    response: Optional[CachedResponse] = None
+    """The cached response, if there was a hit."""
+
+    tier: Optional[str] = None
+    """Which tier the hit came from (`"exact"` or `"semantic"`)."""
+
+    vector: Optional[List[float]] = field(repr=False, default=None)
+    """The embedding of the prompt, if it was embedded."""
+
+class ResponseCache:
+    """
+    Serves repeated chat prompts (like greetings, FAQs or the same question asked in several channels) from memory
+    instead of generating a response again (see `ChatGenerator`).
+
+    Responses are keyed on a hash of the model, the system prompt and the last `context_messages` messages (the prompt included),
+    whose content is normalized (case, whitespace, leading and trailing punctuation), so `"Hi!"` and `"hi"` share a response.
+    If an `EmbeddingGenerator` is provided, prompts which miss the exact tier are also compared to the cached ones with the same
+    earlier messages, and the response of the most similar one is served if their cosine similarity is at least `similarity`.
+
+    At most `max_entries` responses are kept (the least recently used is dropped first), each for `ttl` seconds.
+    Prompts with images are never cached, and neither are the responses of models with `cache_responses` turned off.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+            ttl: Optional[float] = RESPONSE_CACHE_TTL,
+            context_messages: int = RESPONSE_CACHE_CONTEXT_MESSAGES,
+            embeddings: Optional[EmbeddingGenerator] = None,
+            similarity: float = RESPONSE_CACHE_SIMILARITY,
+    ) -> None:
+        if embeddings is not None and np is None:
+            raise MissingDependencyException("numpy", "Semantic response caching")
+
+        self.max_entries = max_entries
+        """The maximum number of responses kept."""
+
+        self.ttl = ttl
+        """How long (in seconds) a response stays valid. `None` means forever."""
+
+        self.context_messages = context_messages
+        """How many of the latest messages (the prompt included) a response is keyed on."""
+
+        self.embeddings = embeddings
+        """Embeds prompts for the semantic tier. `None` means only exact matches are served."""
+
+        self.similarity = similarity
+        """How similar (cosine) a prompt has to be to a cached one to be served its response."""
+
+        self.stats = {"exact": CacheStats(), "semantic": CacheStats()}
+        """Hit/miss statistics of each tier."""
+
+        self.__entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.__vectors: Optional["np.ndarray"] = None
+        self.__partitions: Optional["np.ndarray"] = None
+        self.__row_keys: List[Optional[str]] = [None] * max_entries if embeddings is not None else []
+        self.__free_rows: List[int] = list(range(max_entries - 1, -1, -1)) if embeddings is not None else []
+
+    def accepts(self, model: ChatModel, prompt: ChatMessage) -> bool:
+        """
+        Returns `True` if the response to `prompt` may be cached.
+        """
+
+        return model.cache_responses and not prompt.images
+
+    async def lookup(self, model: ChatModel, history: ChatHistory, prompt: ChatMessage) -> CacheLookup:
+        """
+        Looks up the response to `prompt` sent after the messages of `history`.
+        """
+
+        earlier = [_normalize_message(message) for message in history.items[-(self.context_messages - 1):]] if self.context_messages > 1 else []
+        system_prompt = _normalize_message(history.pinned) if history.pinned else None
+
+        # The pinned message may already be among the latest ones.
+        if history.pinned and len(history) <= self.context_messages - 1:
+            earlier = earlier[1:]
+
+        partition = payload_key([model.name, system_prompt, earlier])
+        lookup = CacheLookup(payload_key([partition, _normalize_message(prompt)]), partition)
+        entry = self.__get(lookup.key)
+
+        if entry is not None:
+            self.stats["exact"].hits += 1
+            lookup.response, lookup.tier = entry.response, "exact"
+            return lookup
+
+        self.stats["exact"].misses += 1
+
+        if self.embeddings is None:
+            return lookup
+
+        try:
+            lookup.vector = await self.embeddings.embed(_normalize(prompt.content))
+        except Exception:
+            # The semantic tier is best effort, the response is generated (and cached for exact matches) anyway.
+            return lookup
+
+        entry = self.__find_similar(lookup.vector, partition)
+
+        if entry is None:
+            self.stats["semantic"].misses += 1
+            return lookup
+
+        self.stats["semantic"].hits += 1
+        lookup.response, lookup.tier = entry.response, "semantic"
+
+        return lookup
+
+    def store(self, lookup: CacheLookup, content: str, model_name: str) -> None:
+        """
+        Stores the response `content` generated by the given model after missing the cache with `lookup`.
+        """
+
+        self.__delete(lookup.key)
+
+        while len(self.__entries) >= self.max_entries:
+            _, evicted = self.__entries.popitem(last=False)
+            self.__release(evicted)
+            self.stats["exact"].evictions += 1
+
+        row = self.__free_rows.pop() if lookup.vector is not None else None
+
+        if row is not None:
+            vector = np.asarray(lookup.vector, dtype=np.float32)
+
+            if self.__vectors is None:
+                self.__vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                self.__partitions = np.full(self.max_entries, -1, dtype=np.int64)
+
+            norm = np.linalg.norm(vector)
+            self.__vectors[row] = vector / norm if norm else vector
+            self.__partitions[row] = _partition_id(lookup.partition)
+            self.__row_keys[row] = lookup.key
+
+        self.__entries[lookup.key] = _Entry(CachedResponse(content, model_name), monotonic(), row)
+
+    def clear(self) -> None:
+        """
+        Removes every response.
+        """
+
+        for key in list(self.__entries):
+            self.__delete(key)
+
+    def __get(self, key: str) -> Optional["_Entry"]:
+        entry = self.__entries.get(key)
+
+        if entry is None:
+            return None
+
+        if self.ttl is not None and monotonic() - entry.stamp > self.ttl:
+            self.__delete(key)
+            return None
+
+        self.__entries.move_to_end(key)
+        return entry
+
+    def __find_similar(self, vector: Sequence[float], partition: str) -> Optional["_Entry"]:
+        if self.__vectors is None:
+            return None
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+
+        if not norm:
+            return None
+
+        # Rows of other partitions (and free rows) are masked out, only the best of the rest is a candidate.
+        scores = self.__vectors @ (query / norm)
+        scores[self.__partitions != _partition_id(partition)] = -1.0
+        row = int(np.argmax(scores))
+
+        if scores[row] < self.similarity:
+            return None
+
+        return self.__get(self.__row_keys[row])
+
+    def __delete(self, key: str) -> None:
+        entry = self.__entries.pop(key, None)
+
+        if entry is not None:
+            self.__release(entry)
+
+    def __release(self, entry: "_Entry") -> None:
+        if entry.row is not None:
+            self.__partitions[entry.row] = -1
+            self.__row_keys[entry.row] = None
+            self.__free_rows.append(entry.row)
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+@dataclass
+class _Entry:
+    response: CachedResponse
+    stamp: float
+    row: Optional[int]
+
+_STRIPPED = string.punctuation + string.whitespace
+
+def _partition_id(partition: str) -> int:
+    # The first 60 bits of the hash, which fit a non-negative int64.
+    return int(partition[:15], 16)
+
+def _normalize(text: str) -> str:
+    return " ".join(text.casefold().split()).strip(_STRIPPED)
+
+def _normalize_message(message: ChatMessage) -> Dict[str, str]:
+    return {"role": str(message.role), "content": _normalize(message.content)}
@@ -5,6 +5,7 @@ from ..types.structs import ImageModel, ImageSize
 
 SD_15 = ImageModel(
     _id="sd15",
+    aliases=["sd1.5"],
     dimensions=ImageSize(512, 512),
     model="sd_v1.5_f16.ckpt",
     guidance_scale=7,
@@ -16,6 +17,7 @@ SD_15 = ImageModel(
 
 DREAMSHAPER_XL_LIGHTNING = ImageModel(
     _id="dreamxl_lightning",
+    aliases=["dreamshaper"],
     dimensions=ImageSize(640, 640),
     model="dreamshaperxl_lightning_f16.ckpt",
     guidance_scale=2,
@@ -23,10 +25,12 @@ DREAMSHAPER_XL_LIGHTNING = ImageModel(
     steps=4,
     refiner_model="sd_xl_refiner_1.0_f16.ckpt",
     user_description="Balanced between speed and quality filtered",
+    allows_nsfw=False,
 )
 
 AAM_XL_ANIMEMIX_V10 = ImageModel(
     _id="animexl",
+    aliases=["animemix"],
     dimensions=ImageSize(768, 768),
     model="aamxlanimemix_v10_f16.ckpt",
     guidance_scale=2,
@@ -37,6 +41,7 @@ AAM_XL_ANIMEMIX_V10 = ImageModel(
 
 JUGGERNAUTXL_V8_RUNDIFFUSION = ImageModel(
     _id="jv8r",
+    aliases=["juggernautxl_v8"],
     dimensions=ImageSize(768, 768),
     model="juggernautxl_v8rundiffusion_f16.ckpt",
     guidance_scale=7,
@@ -44,11 +49,13 @@ JUGGERNAUTXL_V8_RUNDIFFUSION = ImageModel(
     steps=15,
     refiner_model="sd_xl_refiner_1.0_f16.ckpt",
     user_description="Optimized for speed and quality, filtered",
+    allows_nsfw=False,
 )
 
 # Configuration based on recommended values by model author
 JUGGERNAUTXL_V9_LIGHTNING = ImageModel(
     _id="jv9l",
+    aliases=["juggernaut", "juggernautxl"],
     dimensions=ImageSize(832, 1216),
     model="juggernautxl_v9rdphoto2lightning_f16.ckpt",
     guidance_scale=2,
@@ -57,6 +64,7 @@ JUGGERNAUTXL_V9_LIGHTNING = ImageModel(
     negative_prompt=GENERAL_NEGATIVE_PROMPT,
     refiner_model="sd_xl_refiner_1.0_f16.ckpt",
     user_description="Optimized for speed and quality, filtered",
+    allows_nsfw=False,
 )
 
 # SDXL_TURBO_V1 = ImageModel(
@@ -70,6 +78,7 @@ JUGGERNAUTXL_V9_LIGHTNING = ImageModel(
 
 SDXL_BASE_V1 = ImageModel(
     _id="sdxlv1_base",
+    aliases=["sdxl"],
     dimensions=ImageSize(1024, 1024),
     model="sd_xl_base_1.0_f16.ckpt",
     guidance_scale=2,
@@ -77,6 +86,7 @@ SDXL_BASE_V1 = ImageModel(
     steps=15,
     refiner_model="sd_xl_refiner_1.0_f16.ckpt",
     user_description="Optimized for really high quality, filtered",
+    allows_nsfw=False,
 )
 
 # Note: this does not really work at the moment.
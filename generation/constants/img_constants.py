@@ -1,5 +1,63 @@
 API_BASE = "http://127.0.0.1:7860"
 TXT2IMG_ENDPOINT = "/sdapi/v1/txt2img"
+OPTIONS_ENDPOINT = "/sdapi/v1/options"
+SD_MODELS_ENDPOINT = "/sdapi/v1/sd-models"
+SAMPLERS_ENDPOINT = "/sdapi/v1/samplers"
+PROGRESS_ENDPOINT = "/sdapi/v1/progress"
+INTERRUPT_ENDPOINT = "/sdapi/v1/interrupt"
+
+# Every A1111 server requests are spread over, how many failed requests in a row eject one and how often (in seconds) they're checked.
+API_BASES = [API_BASE]
+HEALTH_ENDPOINT = "/"
+MAX_FAILURES = 3
+HEALTH_CHECK_INTERVAL = 15.0
+
+# How long (in seconds) a call may take by default, how often failed requests are attempted (with a random backoff
+# of up to the given delays) and how long (in seconds) a failing A1111 server isn't sent any requests.
+REQUEST_TIMEOUT = 900.0
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 8.0
+BREAKER_RESET_TIMEOUT = 60.0
+
+# How many requests each A1111 server is allowed to handle at once and how many may wait in line.
+MAX_CONCURRENCY = 1
+MAX_QUEUE_SIZE = 16
+QUEUE_TIMEOUT = 600.0
+
+# The generation the cost of others is estimated relative to, and how much more expensive using a refiner makes one
+# (the refiner has to be swapped in for the last steps).
+COST_REFERENCE_STEPS = 20
+COST_REFERENCE_PIXELS = 512 * 512
+REFINER_COST_FACTOR = 1.5
+
+# The shortest and longest time (in seconds) between two polls of the progress of a render (see `ImageJob`),
+# and how long (in seconds) an A1111 server is given to acknowledge that a render was interrupted.
+PROGRESS_POLL_MIN_INTERVAL = 0.25
+PROGRESS_POLL_MAX_INTERVAL = 2.0
+INTERRUPT_TIMEOUT = 5.0
+
+# How long (in seconds) what the servers report about themselves (checkpoints, samplers, options and models) is reused
+# before they're asked again, and how long (in seconds) they're given to answer (see `BackendCatalog`).
+METADATA_TTL = 300.0
+METADATA_TIMEOUT = 10.0
+
+# How long (in seconds) image generations should take at most, waiting in line included, which percentile of the recent render times
+# predicts how long one takes, and how far steps and dimensions may be reduced to stay within that (see `DegradationPolicy`).
+LATENCY_OBJECTIVE = 120.0
+DEGRADATION_PERCENTILE = 75
+DEGRADATION_MIN_SAMPLES = 3
+MIN_STEPS_RATIO = 0.5
+MIN_DIMENSIONS_RATIO = 0.75
+
+# How long (in seconds) to wait for similar requests to batch together and the largest batch allowed.
+BATCH_WINDOW = 0.05
+MAX_BATCH_SIZE = 4
+
+# Limits of the result cache used for generations with a fixed seed.
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_DISK_MAX_BYTES = 4 * 1024 * 1024 * 1024
+CACHE_TTL = 7 * 24 * 60 * 60.0
 
 HIGHLY_RESTRICTIVE_NEGATIVE_PROMPT = """
 bad quality, worst quality, low resolution, worst resolution,
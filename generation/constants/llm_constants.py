@@ -1,10 +1,20 @@
-from datetime import datetime
-from zoneinfo import ZoneInfo
+from datetime import datetime, tzinfo
+from functools import lru_cache
 
-TIMEZONE = ZoneInfo("Europe/Budapest")
+TIMEZONE_NAME = "Europe/Budapest"
+
+@lru_cache(maxsize=None)
+def get_timezone() -> tzinfo:
+    """
+    Returns the timezone the current date is given in. The time zone database is only loaded on first use.
+    """
+
+    from zoneinfo import ZoneInfo
+
+    return ZoneInfo(TIMEZONE_NAME)
 
 def get_system_prompt() -> str:
-    __now = datetime.now(TIMEZONE)
+    __now = datetime.now(get_timezone())
 
     return f""""
     The current date is {__now.date()} ({__now.strftime("%A")}).
@@ -13,4 +23,83 @@ def get_system_prompt() -> str:
     """.strip()
 
 API_BASE = "http://localhost:11434"
-COMPLETION_ENDPOINT = "/api/chat"
\ No newline at end of file
+COMPLETION_ENDPOINT = "/api/chat"
+GENERATE_ENDPOINT = "/api/generate"
+PS_ENDPOINT = "/api/ps"
+TAGS_ENDPOINT = "/api/tags"
+EMBED_ENDPOINT = "/api/embed"
+LEGACY_EMBED_ENDPOINT = "/api/embeddings"
+
+# Every Ollama server requests are spread over, how many failed requests in a row eject one and how often (in seconds) they're checked.
+API_BASES = [API_BASE]
+HEALTH_ENDPOINT = "/api/version"
+MAX_FAILURES = 3
+HEALTH_CHECK_INTERVAL = 15.0
+
+# How long (in seconds) a call may take by default, how often failed requests are attempted (with a random backoff
+# of up to the given delays) and how long (in seconds) a failing Ollama server isn't sent any requests.
+REQUEST_TIMEOUT = 300.0
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.25
+RETRY_MAX_DELAY = 4.0
+BREAKER_RESET_TIMEOUT = 30.0
+
+# How many requests each Ollama server is allowed to handle at once and how many may wait in line.
+MAX_CONCURRENCY = 1
+MAX_QUEUE_SIZE = 32
+QUEUE_TIMEOUT = 120.0
+
+# Used to approximate how many tokens a message takes up without running the model's tokenizer.
+CHARS_PER_TOKEN = 4
+MESSAGE_TOKEN_OVERHEAD = 4
+IMAGE_TOKENS = 576
+
+# How many tokens of the context window are kept free for the response.
+RESPONSE_TOKEN_RESERVE = 512
+
+# The maximum length (in tokens) of the rolling summary of a conversation.
+SUMMARY_MAX_TOKENS = 256
+
+# How many evicted messages may wait to be folded into the summary before the oldest ones are dropped.
+SUMMARY_MAX_PENDING = 200
+
+# How many prompt prefixes the Ollama context is kept of, and how many tokens are generated when capturing one.
+PREFIX_CACHE_SIZE = 32
+PREFIX_PRIME_TOKENS = 1
+
+# The template of prompts sent with a prefix, which keeps Ollama from wrapping the prefix and the prompt in separate turns.
+PREFIX_TEMPLATE = "{{ .Prompt }}"
+
+# Limits of the conversations kept in memory by the session manager.
+SESSION_MAX_IN_MEMORY = 1000
+SESSION_MAX_BYTES = 256 * 1024 * 1024
+SESSION_IDLE_TIMEOUT = 30 * 60.0
+
+# The model embeddings are generated with, how long (in seconds) a text waits for others to join its batch,
+# how many texts are sent in a single call, and how long (in seconds) a call may take by default.
+EMBEDDING_MODEL = "nomic-embed-text"
+EMBED_BATCH_WINDOW = 0.005
+EMBED_MAX_BATCH_SIZE = 64
+EMBED_TIMEOUT = 60.0
+
+# How many vectors an index has room for before it has to grow.
+VECTOR_INDEX_CAPACITY = 1024
+
+# How many earlier messages are recalled per request, how similar (cosine) they have to be to the prompt,
+# and how many of the latest messages are always sent.
+RETRIEVAL_TOP_K = 4
+RETRIEVAL_MIN_SCORE = 0.3
+RETRIEVAL_RECENT_MESSAGES = 6
+
+# Limits of the chat response cache, how many of the latest messages a response is keyed on,
+# and how similar (cosine) a prompt has to be to a cached one to be served its response.
+RESPONSE_CACHE_MAX_ENTRIES = 10000
+RESPONSE_CACHE_TTL = 60 * 60.0
+RESPONSE_CACHE_CONTEXT_MESSAGES = 1
+RESPONSE_CACHE_SIMILARITY = 0.95
+
+# How much (base64 encoded) image data the store of chat attachments keeps, the quality downscaled photos are saved with,
+# and how many of the latest images of a conversation are sent along with a request.
+ATTACHMENT_STORE_MAX_BYTES = 64 * 1024 * 1024
+ATTACHMENT_JPEG_QUALITY = 90
+MAX_RESENT_IMAGES = 1
@@ -6,13 +6,17 @@ LLAMA2_7B = ChatModel(
     name="llama2:7b",
     is_multimodal=False,
     allows_nsfw=False,
+    context_size=4096,
 )
 
 LLAVA_7B = ChatModel(
     _id="llava7b",
+    aliases=["llava"],
     name="llava:7b",
     is_multimodal=True,
     allows_nsfw=False,
+    context_size=4096,
+    image_resolution=672,
 )
 
 LLAMA3_8B = ChatModel(
@@ -20,13 +24,16 @@ LLAMA3_8B = ChatModel(
     name="llama3",
     is_multimodal=False,
     allows_nsfw=False,
+    context_size=8192,
 )
 
 LLAMA3_8B_UNCENSORED = ChatModel(
     _id="llama3_uncensored",
+    aliases=["lexi"],
     name="sunapi386/llama-3-lexi-uncensored:8b",
     is_multimodal=False,
     allows_nsfw=True,
+    context_size=8192,
 )
 
 LLAVA3_8B = ChatModel(
@@ -34,6 +41,8 @@ LLAVA3_8B = ChatModel(
     name="llava-llama3",
     is_multimodal=True,
     allows_nsfw=False,
+    context_size=8192,
+    image_resolution=336,
 )
 
 BEST_OVERALL_MODEL = LLAMA3_8B_UNCENSORED
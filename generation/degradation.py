@@ -0,0 +1,164 @@
+from math import ceil
+from typing import Dict, List, Optional, Tuple
+from .types.structs import ImageModel, ImageSize
+from .types.enums import Degradation
+from .types.exceptions import LoadSheddingException
+from .constants.diffusion_models import DREAMSHAPER_XL_LIGHTNING
+from .constants.img_constants import LATENCY_OBJECTIVE, DEGRADATION_PERCENTILE, DEGRADATION_MIN_SAMPLES, MIN_STEPS_RATIO, MIN_DIMENSIONS_RATIO
+from ..utils.service import Scheduler
+from ..utils.resilience import LatencyWindow
+
+class DegradationPolicy:
+    """
+    Trades image quality for latency when the image service is under pressure (see `ImageGenerator`).
+
+    The render times of the latest generations are recorded per model, relative to their estimated cost (see `ImageModel.estimate_cost()`).
+    Before a generation is queued, the time it would take is predicted from the `percentile` of those times, along with the time
+    it would wait for the work already queued. If that exceeds the `objective`, the generation is made cheaper step by step until it fits:
+    the refiner is skipped, the steps are reduced (down to `min_steps_ratio` of the model's), the dimensions are shrunk
+    (down to `min_dimensions_ratio`), and finally the `fallback` model is used instead, reduced the same way.
+    If not even that fits, the call is rejected with a `LoadSheddingException` right away instead of waiting in line.
+
+    Models with fewer than `min_samples` render times of their own are predicted from the render times of every model,
+    and nothing is degraded until there are enough of those. The fallback model isn't used for models which don't allow NSFW content if it does.
+    """
+
+    def __init__(
+            self,
+            objective: float = LATENCY_OBJECTIVE,
+            fallback: Optional[ImageModel] = DREAMSHAPER_XL_LIGHTNING,
+            percentile: float = DEGRADATION_PERCENTILE,
+            min_samples: int = DEGRADATION_MIN_SAMPLES,
+            min_steps_ratio: float = MIN_STEPS_RATIO,
+            min_dimensions_ratio: float = MIN_DIMENSIONS_RATIO,
+            window: int = 200,
+    ) -> None:
+        self.objective = objective
+        """How long (in seconds) a generation should take at most, waiting in line included."""
+
+        self.fallback = fallback
+        """The faster model used as a last resort. `None` means models are never swapped."""
+
+        self.percentile = percentile
+        """Which percentile (0-100) of the recent render times predicts how long a render takes."""
+
+        self.min_samples = min_samples
+        """How many render times are needed before they're used for predictions."""
+
+        self.min_steps_ratio = min_steps_ratio
+        """The smallest share of a model's steps a degraded generation uses."""
+
+        self.min_dimensions_ratio = min_dimensions_ratio
+        """The smallest share of a model's width and height a degraded generation uses."""
+
+        self.__window = window
+        self.__rates: Dict[str, LatencyWindow] = {}
+        self.__overall = LatencyWindow(window)
+
+    def record(self, model: ImageModel, seconds: float) -> None:
+        """
+        Records that a generation with `model` (as it was sent, degraded or not) took `seconds` to render.
+        """
+
+        cost = model.estimate_cost()
+
+        if cost <= 0:
+            return
+
+        rates = self.__rates.get(model.model)
+
+        if rates is None:
+            rates = self.__rates[model.model] = LatencyWindow(self.__window)
+
+        rates.add(seconds / cost)
+        self.__overall.add(seconds / cost)
+
+    def predict(self, model: ImageModel) -> Optional[float]:
+        """
+        Returns how long (in seconds) rendering with `model` is expected to take, or `None` if there aren't enough render times yet.
+        Models without enough render times of their own are predicted from the render times of every model.
+        """
+
+        rate = self.__get_rate(self.__rates.get(model.model))
+        rate = rate if rate is not None else self.__get_rate(self.__overall)
+
+        return rate * model.estimate_cost() if rate is not None else None
+
+    def estimate_wait(self, scheduler: Scheduler) -> float:
+        """
+        Returns how long (in seconds) a call would wait for the work already queued by `scheduler` (including the calls being handled).
+        """
+
+        rate = self.__get_rate(self.__overall)
+        return rate * scheduler.pending_cost / max(scheduler.concurrency, 1) if rate is not None else 0.0
+
+    def plan(self, model: ImageModel, scheduler: Scheduler, budget: Optional[float] = None) -> Tuple[ImageModel, List[Degradation]]:
+        """
+        Returns the model to generate with (the given one unless it had to be degraded) and the degradations applied to it.
+        `budget` (like the time left of the call's own deadline) lowers the objective if it's shorter.
+
+        Raises a `LoadSheddingException` if the generation wouldn't fit even with every degradation applied.
+        """
+
+        objective = min(self.objective, budget) if budget is not None else self.objective
+        wait = self.estimate_wait(scheduler)
+        expected = 0.0
+
+        for candidate, degradations in self.__candidates(model):
+            expected = self.predict(candidate)
+
+            # Without any render times, there's nothing to base a decision on.
+            if expected is None:
+                return model, []
+
+            if wait + expected <= objective:
+                return candidate, degradations
+
+        raise LoadSheddingException(wait + expected, objective)
+
+    def __candidates(self, model: ImageModel) -> List[Tuple[ImageModel, List[Degradation]]]:
+        candidates = [(model, [])] + self.__reduce(model, [])
+        fallback = self.fallback
+
+        if fallback is None or fallback.model == model.model or (fallback.allows_nsfw and not model.allows_nsfw):
+            return candidates
+
+        return candidates + [(fallback, [Degradation.FALLBACK_MODEL])] + self.__reduce(fallback, [Degradation.FALLBACK_MODEL])
+
+    def __reduce(self, model: ImageModel, applied: List[Degradation]) -> List[Tuple[ImageModel, List[Degradation]]]:
+        reduced: List[Tuple[ImageModel, List[Degradation]]] = []
+
+        # From the least to the most noticeable, each on top of the previous ones.
+        if model.refiner_model:
+            model = model.copy(refiner_model="")
+            applied = applied + [Degradation.NO_REFINER]
+            reduced.append((model, applied))
+
+        steps = max(ceil(model.steps * self.min_steps_ratio), 1) if model.steps else None
+
+        if steps is not None and steps < model.steps:
+            model = model.copy(steps=steps)
+            applied = applied + [Degradation.REDUCED_STEPS]
+            reduced.append((model, applied))
+
+        dimensions = self.__shrink(model.dimensions)
+
+        if dimensions != model.dimensions:
+            model = model.copy(dimensions=dimensions)
+            applied = applied + [Degradation.SMALLER_DIMENSIONS]
+            reduced.append((model, applied))
+
+        return reduced
+
+    def __shrink(self, dimensions: ImageSize) -> ImageSize:
+        # Diffusion models work in blocks of 64 pixels.
+        width = max(round(dimensions.width * self.min_dimensions_ratio / 64) * 64, 64)
+        height = max(round(dimensions.height * self.min_dimensions_ratio / 64) * 64, 64)
+
+        return ImageSize(min(width, dimensions.width), min(height, dimensions.height))
+
+    def __get_rate(self, rates: Optional[LatencyWindow]) -> Optional[float]:
+        if rates is None or len(rates.samples) < self.min_samples:
+            return None
+
+        return rates.percentile(self.percentile)
@@ -0,0 +1,299 @@
+from asyncio import Task, ensure_future, gather, shield, wait_for
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+import os
+from .prefixes import PrefixCache
+from .registry import get_chat_models, get_image_models
+from .helpers.model_helpers import normalize_chat_model_name
+from .types.structs import ChatModel, ImageModel
+from .types.exceptions import ModelUnavailableException
+from .constants.img_constants import SD_MODELS_ENDPOINT, SAMPLERS_ENDPOINT, OPTIONS_ENDPOINT, METADATA_TTL, METADATA_TIMEOUT
+from .constants.llm_constants import TAGS_ENDPOINT
+from .chat import _shared_backends as _shared_chat_backends, _shared_prefixes
+from .img import _shared_backends as _shared_image_backends
+from ..utils.backends import Backend, BackendPool
+from ..utils.http import HttpClient, get_default_client
+
+@dataclass
+class BackendCapabilities:
+    """
+    What a server reported about itself the last time it was asked (see `BackendCatalog`).
+    """
+
+    url: str
+    """The base URL of the server."""
+
+    models: Set[str] = field(default_factory=set)
+    """The names of the checkpoints (A1111) or models (Ollama) the server has, case-folded."""
+
+    samplers: Set[str] = field(default_factory=set)
+    """The names and aliases of the samplers the server offers, case-folded. Always empty for Ollama servers."""
+
+    options: Dict[str, Any] = field(default_factory=dict)
+    """The configuration of the server. Always empty for Ollama servers."""
+
+    digests: Dict[str, str] = field(default_factory=dict)
+    """The digest of every model by name. Always empty for A1111 servers."""
+
+    error: Optional[str] = None
+    """Why the last refresh failed, if it did. The previously reported capabilities are kept in that case."""
+
+    @property
+    def reported(self) -> bool:
+        """
+        Returns `True` if the server reported its capabilities at least once.
+        """
+
+        return bool(self.models or self.options)
+
+class BackendCatalog:
+    """
+    Caches what the A1111 servers (checkpoints, samplers and options) and Ollama servers (models and their digests) offer,
+    so generators don't have to ask them on every request.
+
+    The catalog is loaded by `refresh()` (like at startup) or on first use, and reused for `ttl` seconds.
+    Once it's stale, the next use still gets the cached capabilities while they're refreshed in the background.
+    A server that doesn't answer keeps the capabilities it reported last.
+
+    An `ImageGenerator` attaches the cached options of the server that rendered an image as the output's `extra`,
+    and rejects checkpoints and samplers no server offers before queueing the call, instead of after waiting for a slot.
+    `validate()` checks every registered model up front. When the digest of an Ollama model changes (because it was pulled again),
+    the contexts cached for it by `prefixes` are dropped, since they were tokenized by the old model.
+
+    Usage:
+    ```
+    catalog = get_default_catalog()
+
+    for problem in await catalog.validate():
+        print(problem)
+    ```
+    """
+
+    def __init__(
+            self,
+            chat_backends: Optional[BackendPool] = None,
+            image_backends: Optional[BackendPool] = None,
+            client: Optional[HttpClient] = None,
+            ttl: Optional[float] = METADATA_TTL,
+            prefixes: Optional[PrefixCache] = None,
+    ) -> None:
+        self.chat_backends = chat_backends if chat_backends else _shared_chat_backends
+        """The Ollama servers whose models are cached."""
+
+        self.image_backends = image_backends if image_backends else _shared_image_backends
+        """The A1111 servers whose checkpoints, samplers and options are cached."""
+
+        self.client = client if client else get_default_client()
+
+        self.ttl = ttl
+        """How long (in seconds) the capabilities are reused before they're refreshed. `None` means they're only refreshed explicitly."""
+
+        self.prefixes = prefixes if prefixes is not None else _shared_prefixes
+        """The cached prompt prefixes dropped for Ollama models whose digest changed."""
+
+        self.__chat: Dict[str, BackendCapabilities] = {}
+        self.__image: Dict[str, BackendCapabilities] = {}
+        self.__refreshed_at: Optional[float] = None
+        self.__refreshing: Optional[Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        """
+        Returns `True` if the catalog was refreshed at least once.
+        """
+
+        return self.__refreshed_at is not None
+
+    @property
+    def stale(self) -> bool:
+        """
+        Returns `True` if the catalog was never refreshed or is older than its `ttl`.
+        """
+
+        if self.__refreshed_at is None:
+            return True
+
+        return self.ttl is not None and monotonic() - self.__refreshed_at > self.ttl
+
+    async def refresh(self) -> None:
+        """
+        Asks every server what it offers. Calls made while a refresh is running wait for that one instead of starting another.
+        """
+
+        if self.__refreshing is None or self.__refreshing.done():
+            self.__refreshing = ensure_future(self.__refresh())
+
+        # Shielded, so a cancelled caller doesn't abort the refresh for everyone else waiting on it.
+        await shield(self.__refreshing)
+
+    async def ensure_fresh(self) -> None:
+        """
+        Loads the catalog if it was never loaded, or starts refreshing it in the background if it's stale.
+        """
+
+        if self.__refreshed_at is None:
+            await self.refresh()
+        elif self.stale and (self.__refreshing is None or self.__refreshing.done()):
+            self.__refreshing = ensure_future(self.__refresh())
+
+    def get(self, url: str) -> Optional[BackendCapabilities]:
+        """
+        Returns what the A1111 (or, if there's none, Ollama) server with the given base URL reported, or `None` if it was never asked.
+        """
+
+        capabilities = self.__image.get(url)
+        return capabilities if capabilities is not None else self.__chat.get(url)
+
+    async def get_details(self, url: str) -> Dict[str, Any]:
+        """
+        Returns the cached options of the A1111 server with the given base URL, which are attached to outputs as `extra`.
+        """
+
+        await self.ensure_fresh()
+        capabilities = self.__image.get(url)
+
+        return dict(capabilities.options) if capabilities is not None else {}
+
+    def has_checkpoint(self, name: str) -> Optional[bool]:
+        """
+        Returns whether any A1111 server has the checkpoint with the given filename (with or without its extension or hash),
+        or `None` if none of them reported their checkpoints yet.
+        """
+
+        return _has(self.__reported(self.image_backends.backends, self.__image), lambda capabilities: _checkpoint_names(name) & capabilities.models)
+
+    def has_sampler(self, name: str) -> Optional[bool]:
+        """
+        Returns whether any A1111 server offers the sampler with the given name or alias,
+        or `None` if none of them reported their samplers yet.
+        """
+
+        return _has(self.__reported(self.image_backends.backends, self.__image), lambda capabilities: name.casefold() in capabilities.samplers)
+
+    def has_chat_model(self, name: str) -> Optional[bool]:
+        """
+        Returns whether any Ollama server has the model with the given name (names without a tag refer to `:latest`),
+        or `None` if none of them reported their models yet.
+        """
+
+        return _has(self.__reported(self.chat_backends.backends, self.__chat), lambda capabilities: normalize_chat_model_name(name) in capabilities.models)
+
+    def check_image_model(self, model: ImageModel) -> None:
+        """
+        Raises a `ModelUnavailableException` if no A1111 server offers the checkpoint, refiner or sampler of `model`.
+        Nothing is checked against servers that didn't report their capabilities yet.
+        """
+
+        for problem in self.__image_model_problems(model):
+            raise ModelUnavailableException(problem)
+
+    async def validate(self, chat_models: Optional[Iterable[ChatModel]] = None, image_models: Optional[Iterable[ImageModel]] = None) -> List[str]:
+        """
+        Refreshes the catalog and returns a description of every checkpoint, sampler or chat model used by the given models
+        (every registered one by default, see `get_chat_models()` and `get_image_models()`) which no server offers.
+        """
+
+        await self.refresh()
+        problems: List[str] = []
+
+        for model in image_models if image_models is not None else get_image_models():
+            problems.extend(self.__image_model_problems(model))
+
+        for model in chat_models if chat_models is not None else get_chat_models():
+            if self.has_chat_model(model.name) is False:
+                problems.append(f"The chat model \"{model.name}\" of \"{model._id}\" isn't available on any Ollama server.")
+
+        return problems
+
+    async def __refresh(self) -> None:
+        await gather(
+            *[self.__refresh_chat(backend) for backend in self.chat_backends.backends],
+            *[self.__refresh_image(backend) for backend in self.image_backends.backends],
+        )
+
+        self.__refreshed_at = monotonic()
+
+    async def __refresh_chat(self, backend: Backend) -> None:
+        capabilities = self.__chat.setdefault(backend.url, BackendCapabilities(backend.url))
+
+        try:
+            resp = await wait_for(self.client.get_json(backend.url + TAGS_ENDPOINT), METADATA_TIMEOUT)
+        except Exception as e:
+            capabilities.error = str(e) or type(e).__name__
+            return
+
+        digests = {normalize_chat_model_name(str(model.get("name"))): str(model.get("digest", "")) for model in resp.get("models", [])}
+
+        # A model that was pulled again may tokenize differently, so contexts cached for the old one are useless.
+        for name, digest in digests.items():
+            previous = capabilities.digests.get(name)
+
+            if previous is not None and previous != digest:
+                self.prefixes.invalidate(name)
+                self.prefixes.invalidate(name.removesuffix(":latest"))
+
+        capabilities.models, capabilities.digests, capabilities.error = set(digests), digests, None
+
+    async def __refresh_image(self, backend: Backend) -> None:
+        capabilities = self.__image.setdefault(backend.url, BackendCapabilities(backend.url))
+
+        try:
+            checkpoints, samplers, options = await gather(*[
+                wait_for(self.client.get_json(backend.url + endpoint), METADATA_TIMEOUT)
+                for endpoint in (SD_MODELS_ENDPOINT, SAMPLERS_ENDPOINT, OPTIONS_ENDPOINT)
+            ])
+        except Exception as e:
+            capabilities.error = str(e) or type(e).__name__
+            return
+
+        models: Set[str] = set()
+
+        for checkpoint in checkpoints:
+            # A1111 reports checkpoints as "<filename> [<hash>]", along with their name and path.
+            for name in (checkpoint.get("title"), checkpoint.get("model_name"), os.path.basename(checkpoint.get("filename") or "")):
+                if name:
+                    models |= _checkpoint_names(name)
+
+        capabilities.models = models
+        capabilities.samplers = {str(alias).casefold() for sampler in samplers for alias in [sampler.get("name"), *(sampler.get("aliases") or [])] if alias}
+        capabilities.options = dict(options)
+        capabilities.error = None
+
+    def __image_model_problems(self, model: ImageModel) -> List[str]:
+        problems: List[str] = []
+
+        if self.has_checkpoint(model.model) is False:
+            problems.append(f"The checkpoint \"{model.model}\" of \"{model._id}\" isn't available on any A1111 server.")
+
+        if model.refiner_model and self.has_checkpoint(model.refiner_model) is False:
+            problems.append(f"The refiner \"{model.refiner_model}\" of \"{model._id}\" isn't available on any A1111 server.")
+
+        if model.sampler and self.has_sampler(str(model.sampler)) is False:
+            problems.append(f"The sampler \"{model.sampler}\" of \"{model._id}\" isn't available on any A1111 server.")
+
+        return problems
+
+    def __reported(self, backends: List[Backend], capabilities: Dict[str, BackendCapabilities]) -> List[BackendCapabilities]:
+        return [reported for reported in (capabilities.get(backend.url) for backend in backends) if reported is not None and reported.reported]
+
+def _has(reported: List[BackendCapabilities], predicate: Callable[[BackendCapabilities], Any]) -> Optional[bool]:
+    return any(predicate(capabilities) for capabilities in reported) if reported else None
+
+def _checkpoint_names(name: str) -> Set[str]:
+    name = name.split(" [")[0].casefold()
+    return {name, os.path.splitext(name)[0]}
+
+_default_catalog: Optional[BackendCatalog] = None
+
+def get_default_catalog() -> BackendCatalog:
+    """
+    Returns the process-wide catalog of the shared Ollama and A1111 servers, which is used by every generator that wasn't given its own.
+    """
+
+    global _default_catalog
+
+    if _default_catalog is None:
+        _default_catalog = BackendCatalog()
+
+    return _default_catalog
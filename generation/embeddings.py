@@ -0,0 +1,203 @@
+from asyncio import Future, Task, TimerHandle, ensure_future, gather, get_running_loop
+from datetime import datetime, UTC
+from time import perf_counter_ns
+from typing import Dict, List, Optional, Set, Tuple
+from aiohttp import ClientResponseError
+from .types.contracts import GeneratorContract
+from .types.structs import GenerationInput, GenerationOutput
+from .types.exceptions import GenerationAPIException
+from .constants.llm_constants import EMBED_ENDPOINT, LEGACY_EMBED_ENDPOINT, EMBEDDING_MODEL, EMBED_BATCH_WINDOW, EMBED_MAX_BATCH_SIZE, EMBED_TIMEOUT
+from .constants.llm_constants import MAX_QUEUE_SIZE, QUEUE_TIMEOUT, RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from .chat import _shared_backends, record_ollama_stats
+from .helpers.model_helpers import normalize_chat_model_name
+from ..utils.service import AsyncService, Scheduler
+from ..utils.http import HttpClient, get_default_client
+from ..utils.backends import BackendPool
+from ..utils.metrics import Metrics, Trace, get_default_metrics
+from ..utils.resilience import Deadline, RetryPolicy
+
+class EmbeddingGenerator(GeneratorContract, AsyncService):
+    """
+    Turns text into embedding vectors with an Ollama embedding model.
+
+    Texts passed to `embed()` (or `generate()`) within `window` seconds of each other are sent together
+    as a single batched `/api/embed` call of up to `max_batch_size` texts, and `embed_many()` sends a whole list at once.
+    Servers which predate `/api/embed` are sent a `/api/embeddings` call per text instead.
+
+    Requests are spread over the same Ollama servers as chat requests (see `ChatGenerator`), but wait for slots
+    of their own scheduler, so a quick embedding doesn't have to wait for a long chat response.
+    Failed requests are retried on another server according to `retry`.
+
+    Usage:
+    ```
+    embeddings = EmbeddingGenerator()
+    vectors = await embeddings.embed_many(["A cat", "A dog"])
+    ```
+    """
+
+    def __init__(
+            self,
+            model_name: str = EMBEDDING_MODEL,
+            client: Optional[HttpClient] = None,
+            scheduler: Optional[Scheduler] = None,
+            backends: Optional[BackendPool] = None,
+            metrics: Optional[Metrics] = None,
+            retry: Optional[RetryPolicy] = None,
+            window: float = EMBED_BATCH_WINDOW,
+            max_batch_size: int = EMBED_MAX_BATCH_SIZE,
+            timeout: Optional[float] = EMBED_TIMEOUT,
+    ) -> None:
+        self.backends = backends if backends else _shared_backends
+        AsyncService.__init__(self, scheduler if scheduler else Scheduler.for_backend(f"{self.backends.key}#embeddings", len(self.backends), MAX_QUEUE_SIZE, QUEUE_TIMEOUT))
+
+        self.model_name = model_name
+        """The Ollama name of the embedding model."""
+
+        self.client = client if client else get_default_client()
+        self.metrics = metrics if metrics else get_default_metrics()
+        self.retry = retry if retry else RetryPolicy(RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+
+        self.window = window
+        """How long (in seconds) the first text of a batch waits for others to join."""
+
+        self.max_batch_size = max_batch_size
+        """The largest number of texts sent in a single call. A full batch is sent immediately."""
+
+        self.timeout = timeout
+        """How long (in seconds) a call may take, waiting in line included."""
+
+        self.__pending: List[Tuple[str, Future]] = []
+        self.__timer: Optional[TimerHandle] = None
+        self.__sending: Set[Task] = set()
+        self.__legacy = False
+
+    async def generate(self, _input: GenerationInput) -> GenerationOutput:
+        """
+        Returns the embedding of the prompt.
+        """
+
+        start_stamp = datetime.now(UTC)
+        vector = await self.embed(_input.prompt)
+
+        return GenerationOutput[List[float]](
+            prompt=_input.prompt,
+            model_name=self.model_name,
+            duration=(datetime.now(UTC) - start_stamp),
+            data=vector,
+            extra=None,
+        )
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Returns the embedding of `text`, batched with the other texts requested around the same time.
+        """
+
+        loop = get_running_loop()
+        result: Future = loop.create_future()
+        self.__pending.append((text, result))
+
+        if len(self.__pending) >= self.max_batch_size:
+            self.__flush()
+        elif self.__timer is None:
+            self.__timer = loop.call_later(self.window, self.__flush)
+
+        return await result
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """
+        Returns the embeddings of `texts` (in the same order), sent in batches of up to `max_batch_size`.
+        """
+
+        batches = [texts[i:i + self.max_batch_size] for i in range(0, len(texts), self.max_batch_size)]
+        results = await gather(*[self.__request(batch) for batch in batches])
+
+        return [vector for vectors in results for vector in vectors]
+
+    def __flush(self) -> None:
+        if self.__timer:
+            self.__timer.cancel()
+            self.__timer = None
+
+        entries, self.__pending = self.__pending, []
+
+        if not entries:
+            return
+
+        task = ensure_future(self.__send(entries))
+        self.__sending.add(task)
+        task.add_done_callback(self.__sending.discard)
+
+    async def __send(self, entries: List[Tuple[str, Future]]) -> None:
+        entries = [entry for entry in entries if not entry[1].done()]
+
+        if not entries:
+            return
+
+        # The same text requested twice is only embedded once.
+        texts = list(dict.fromkeys(text for text, _ in entries))
+
+        try:
+            vectors = dict(zip(texts, await self.__request(texts)))
+        except BaseException as e:
+            for _, result in entries:
+                if not result.done():
+                    result.set_exception(e)
+
+            if not isinstance(e, Exception):
+                raise
+
+            return
+
+        for text, result in entries:
+            if not result.done():
+                result.set_result(vectors[text])
+
+    async def __request(self, texts: List[str]) -> List[List[float]]:
+        deadline = Deadline(self.timeout)
+
+        with self.metrics.trace("embeddings.embed", model=self.model_name, batch_size=len(texts)) as trace:
+            async with deadline.enforce():
+                queued_ns = perf_counter_ns()
+
+                async with self.scheduler.slot(group=self.model_name, cost=len(texts) / self.max_batch_size):
+                    trace.record("queue_wait", queued_ns)
+
+                    try:
+                        if not self.__legacy:
+                            try:
+                                response = await self.__post(EMBED_ENDPOINT, {"model": self.model_name, "input": texts}, trace, deadline)
+                                vectors = response.get("embeddings")
+                            except ClientResponseError as e:
+                                # Unlike a missing endpoint, a missing model is reported as a JSON error which mentions it.
+                                if e.status != 404 or "model" in e.message.lower():
+                                    raise
+
+                                self.__legacy = True
+
+                        if self.__legacy:
+                            responses = await gather(*[self.__post(LEGACY_EMBED_ENDPOINT, {"model": self.model_name, "prompt": text}, trace, deadline) for text in texts])
+                            vectors = [response.get("embedding") for response in responses]
+                    except ClientResponseError as e:
+                        raise GenerationAPIException(e.message) from e
+
+        if not isinstance(vectors, list) or len(vectors) != len(texts):
+            raise GenerationAPIException(f"Expected {len(texts)} embeddings but received {len(vectors) if isinstance(vectors, list) else 0}.")
+
+        return vectors
+
+    async def __post(self, endpoint: str, payload: Dict, trace: Trace, deadline: Deadline) -> Dict:
+        tried: Set[str] = set()
+
+        async def attempt() -> Dict:
+            async with self.backends.acquire(normalize_chat_model_name(self.model_name), tried) as backend:
+                tried.add(backend.url)
+                response: Dict = await self.client.post_json(backend.url + endpoint, payload, trace)
+
+            if "error" in response.keys():
+                raise GenerationAPIException(response["error"])
+
+            record_ollama_stats(trace, response)
+            return response
+
+        # Embedding doesn't change anything on the server, so it can always be retried.
+        return await self.retry.run(attempt, idempotent=True, deadline=deadline)
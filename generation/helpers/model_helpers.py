@@ -1,14 +1,35 @@
 from typing import List, Optional
-from ..types.structs import ImageModel
-from ..constants.diffusion_models import MODELS as DIFFUSION_MODELS
+from ..types.structs import ChatModel, ImageModel
+from ..registry import get_chat_models, get_image_models
 
-def find_model_by_id(_id: str, _fallback: ImageModel, _models: List[ImageModel] = DIFFUSION_MODELS) -> Optional[ImageModel]:
+def find_model_by_id(_id: str, _fallback: ImageModel, _models: Optional[List[ImageModel]] = None) -> Optional[ImageModel]:
     """
-    Iterates over the (provided) models and returns the first match.
+    Returns the image model with the given ID, alias or filename (case-insensitively) from the registry (see `get_image_models()`),
+    or the first match of the provided models instead.
     Optionally accepts a `__fallback` value which will be returned if no match was found instead of `None`.
     """
 
+    if _models is None:
+        return get_image_models().find(_id, _fallback if _fallback else None)
+
     for m in _models:
-        if m._id.lower() == _id.lower():
+        if _id and m._id.casefold() == _id.casefold():
             return m
     return None if not _fallback else _fallback
+
+def find_chat_model_by_id(_id: str, _fallback: Optional[ChatModel] = None) -> Optional[ChatModel]:
+    """
+    Returns the chat model with the given ID, alias or filename (case-insensitively) from the registry (see `get_chat_models()`).
+    Optionally accepts a `__fallback` value which will be returned if no match was found instead of `None`.
+    """
+
+    return get_chat_models().find(_id, _fallback)
+
+def normalize_chat_model_name(name: str) -> str:
+    """
+    Returns the name of an Ollama model the way Ollama reports it (case-folded, with the implicit `:latest` tag),
+    so `"llama3"` and `"llama3:latest"` are recognized as the same model.
+    """
+
+    name = name.strip().casefold()
+    return name if ":" in name else f"{name}:latest"
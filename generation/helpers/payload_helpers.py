@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Union
+import hashlib
+import json
+from ...utils.codec import Fragment, get_codec
+
+# How many distinct system prompts are kept pre-encoded.
+_MAX_MESSAGE_FRAGMENTS = 128
+
+_message_fragments: "OrderedDict[str, Fragment]" = OrderedDict()
+
+def payload_key(payload: Any) -> str:
+    """
+    Returns a stable hash of a JSON serializable backend payload.
+    Payloads that only differ in the order of their keys produce the same hash.
+    """
+
+    normalized = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def has_fixed_seed(seed: Optional[Union[str, int]]) -> bool:
+    """
+    Returns `True` if `seed` pins the generation to a specific result instead of letting the backend pick one at random.
+    """
+
+    return seed not in (None, "", "-1", -1)
+
+def with_keep_alive(payload: Dict[str, Any], keep_alive: Optional[Union[str, int]]) -> Dict[str, Any]:
+    """
+    Returns the Ollama `payload` with the `keep_alive` hint added, unless it's `None`.
+    """
+
+    return payload if keep_alive is None else {**payload, "keep_alive": keep_alive}
+
+def get_load_duration(response: Optional[Dict[str, Any]]) -> Optional[timedelta]:
+    """
+    Returns the `load_duration` (in nanoseconds) reported by a backend as a `timedelta`, or `None` if it's missing.
+    """
+
+    nanoseconds = response.get("load_duration") if response else None
+    return timedelta(microseconds=nanoseconds / 1000) if isinstance(nanoseconds, (int, float)) else None
+
+def with_image_limit(messages: List[Dict[str, Any]], max_images: Optional[int]) -> List[Dict[str, Any]]:
+    """
+    Returns the Ollama `messages` with the images of all but the latest `max_images` removed. `None` means no limit.
+    The messages themselves are only copied if their images are removed, since they're usually shared with the history.
+    """
+
+    if max_images is None:
+        return messages
+
+    limited: List[Dict[str, Any]] = []
+    remaining = max_images
+
+    for message in reversed(messages):
+        images = message.get("images")
+
+        if images:
+            kept = images[len(images) - remaining:] if remaining < len(images) else images
+            remaining -= len(kept)
+
+            if len(kept) < len(images):
+                message = {**message, "images": kept if kept else None}
+
+        limited.append(message)
+
+    limited.reverse()
+    return limited
+
+def with_encoded_system_prompt(messages: List[Dict[str, Any]]) -> List[Union[Dict[str, Any], Fragment]]:
+    """
+    Returns the Ollama `messages` with the leading system prompt (if any) replaced by a pre-encoded `Fragment`,
+    so the same (usually long) prompt isn't encoded again for every request.
+    """
+
+    if not messages or messages[0].get("role") != "system" or messages[0].get("images"):
+        return messages
+
+    content = messages[0].get("content", "")
+    fragment = _message_fragments.get(content)
+
+    if fragment is None:
+        fragment = _message_fragments[content] = get_codec().fragment(messages[0])
+
+        if len(_message_fragments) > _MAX_MESSAGE_FRAGMENTS:
+            _message_fragments.popitem(last=False)
+    else:
+        _message_fragments.move_to_end(content)
+
+    return [fragment] + messages[1:]
@@ -0,0 +1,11 @@
+from typing import Optional
+from ..constants.llm_constants import CHARS_PER_TOKEN, MESSAGE_TOKEN_OVERHEAD, IMAGE_TOKENS
+
+def estimate_tokens(text: str, image_count: Optional[int] = 0) -> int:
+    """
+    Returns the approximate number of tokens a chat message with the provided content and number of images takes up.
+
+    This is a cheap heuristic and not the model's actual tokenizer, so it should only be used for budgeting.
+    """
+
+    return MESSAGE_TOKEN_OVERHEAD + -(-len(text) // CHARS_PER_TOKEN) + IMAGE_TOKENS * (image_count or 0)
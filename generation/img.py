@@ -1,55 +1,582 @@
-from aiohttp import ClientSession
 from .types.contracts import GeneratorContract
 from .types.structs import GenerationInput, GenerationOutput
-from ..utils.service import AsyncService
-from .types.exceptions import ServiceBusyException, GenerationAPIException
+from ..utils.service import AsyncService, Scheduler
+from ..utils.http import HttpClient, get_default_client
+from ..utils.backends import Backend, BackendPool, RoutingStrategy
+from ..utils.singleflight import SingleFlight
+from ..utils.metrics import NULL_TRACE, Metrics, Trace, get_default_metrics
+from ..utils.resilience import Deadline, RetryPolicy
+from .types.exceptions import GenerationAPIException
 from .types.structs import ImageModel
+from .types.enums import Degradation
+from ..utils.codec import PayloadTemplate
+from .postprocessing import ImagePostProcessor
 from .helpers.model_helpers import find_model_by_id
+from .helpers.payload_helpers import get_load_duration, has_fixed_seed, payload_key
 from .constants.diffusion_models import BEST_OVERALL_MODEL
-from .constants.img_constants import API_BASE, TXT2IMG_ENDPOINT
-from datetime import datetime, UTC
-from typing import Dict, Union
+from .constants.img_constants import API_BASES, TXT2IMG_ENDPOINT, HEALTH_ENDPOINT, HEALTH_CHECK_INTERVAL, MAX_FAILURES, MAX_CONCURRENCY, MAX_QUEUE_SIZE, QUEUE_TIMEOUT
+from .constants.img_constants import BREAKER_RESET_TIMEOUT, REQUEST_TIMEOUT, RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY
+from .constants.img_constants import PROGRESS_ENDPOINT, INTERRUPT_ENDPOINT, PROGRESS_POLL_MIN_INTERVAL, PROGRESS_POLL_MAX_INTERVAL, INTERRUPT_TIMEOUT
+from asyncio import CancelledError, Future, Task, ensure_future, get_running_loop, shield, sleep, wait_for
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, UTC
+from time import perf_counter_ns
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable, Dict, Generator, List, Optional, Set, Tuple, Union
 from io import BytesIO
 import base64
+from aiohttp import ClientResponseError
+
+if TYPE_CHECKING:
+    from .residency import ResidencyManager
+    from .degradation import DegradationPolicy
+    from .discovery import BackendCatalog
+
+# Shared by every generator that wasn't given its own, so identical requests are coalesced process-wide.
+_shared_flights = SingleFlight()
+
+# Shared by every generator that wasn't given its own, so the load of all of them is balanced across the A1111 servers.
+_shared_backends = BackendPool(API_BASES, RoutingStrategy.MODEL_AFFINITY, exclusive_models=True, health_path=HEALTH_ENDPOINT, health_interval=HEALTH_CHECK_INTERVAL, max_failures=MAX_FAILURES, reset_timeout=BREAKER_RESET_TIMEOUT)
 
 class ImageGenerator(GeneratorContract, AsyncService):
     """
     Handles image generation.
+
+    All requests go through a pooled `HttpClient`. Unless one is provided, the process-wide default client is used.
+    Requests are spread over the A1111 servers of a `BackendPool` (all of `API_BASES` by default), preferring servers
+    which already have the checkpoint loaded. Calls wait for a free slot of the `Scheduler` shared by every generator
+    using the same servers, unless a custom scheduler is provided.
+
+    Identical requests with a fixed seed that arrive while one of them is already being rendered
+    share that render instead of sending a duplicate request. The shared render is traced on its own (as `"image.render"`),
+    keeps going until the latest deadline of the callers still waiting for it, and reports its queue position and server to all of them.
+
+    Images are decoded (and optionally re-encoded, see `PostProcessOptions`) by an `ImagePostProcessor` off the event loop.
+    If the processor generates thumbnails, they are attached to the output's `extra` under `"thumbnail"` as a `BytesIO`.
+
+    If a `ResidencyManager` is provided, a server that doesn't have the requested checkpoint loaded is switched to it
+    before rendering, and the time that took is reported as the output's `load_duration`.
+
+    Every call is traced through `metrics` (the process-wide registry by default): the time spent waiting in the queue,
+    on the request itself (see `HttpClient`), switching checkpoints and decoding the image.
+
+    Calls have to complete within `timeout` seconds (or the input's own `timeout`), waiting in line included,
+    otherwise a `DeadlineExceededException` is raised. Requests that never reached a server are retried on another one
+    according to `retry`, but other failures are only retried for generations with a fixed seed,
+    so a render that may have already happened isn't silently repeated with a different result.
+    A call that is cancelled (or runs out of time) while rendering interrupts the render, so the server is free for the next one right away.
+    `submit()` returns an `ImageJob` instead, which reports the progress of the render while it's going.
+
+    If a `DegradationPolicy` is provided, generations that wouldn't complete within its latency objective (because of the queue)
+    are made cheaper before they're queued, or rejected with a `LoadSheddingException` if that's not enough.
+    The degradations applied to a generation are listed in the output's `extra` under `"degradations"`.
+
+    What the servers offer is cached by a `BackendCatalog` (the process-wide one when using the shared servers), so a checkpoint or sampler
+    no server has is rejected with a `ModelUnavailableException` before the call is queued, and the `extra` of outputs
+    (the options of the server that rendered the image) doesn't cost a request of its own.
     """
 
-    async def generate(self, _input: GenerationInput) -> GenerationOutput:
-        if await self.get_busyness():
-            raise ServiceBusyException()
-        
-        self.set_busyness(True)
-        start_stamp = datetime.now(UTC)
+    def __init__(
+            self,
+            client: Optional[HttpClient] = None,
+            scheduler: Optional[Scheduler] = None,
+            flights: Optional[SingleFlight] = None,
+            post_processor: Optional[ImagePostProcessor] = None,
+            backends: Optional[BackendPool] = None,
+            residency: Optional["ResidencyManager"] = None,
+            metrics: Optional[Metrics] = None,
+            retry: Optional[RetryPolicy] = None,
+            timeout: Optional[float] = REQUEST_TIMEOUT,
+            degradation: Optional["DegradationPolicy"] = None,
+            catalog: Optional["BackendCatalog"] = None,
+    ) -> None:
+        # Imported here, since the catalog is built on the shared backends of this module.
+        from .discovery import BackendCatalog, get_default_catalog
 
-        model: ImageModel = find_model_by_id(_input.model_name, BEST_OVERALL_MODEL)
-        
-        async with ClientSession() as s:
-           async with s.post(url=API_BASE + TXT2IMG_ENDPOINT, json=model.to_a1_payload(_input.prompt, _input.seed)) as gen_req:
-               image_data = await gen_req.json()
-    
-               if dict(image_data).get("error", None):
-                   raise GenerationAPIException()
-               
-           async with s.get(API_BASE) as details_req:
-               details: Dict[str, Union[str, int, float, bool]] = dict(await details_req.json())
-
-
-        image_bytes = base64.b64decode(list(image_data.get("images"))[0])
-        image_binary = BytesIO(image_bytes)
-        image_binary.seek(0)
+        self.backends = backends if backends else _shared_backends
+        AsyncService.__init__(self, scheduler if scheduler else Scheduler.for_backend(self.backends.key, MAX_CONCURRENCY * len(self.backends), MAX_QUEUE_SIZE, QUEUE_TIMEOUT))
+        self.client = client if client else get_default_client()
+        self.flights = flights if flights else _shared_flights
+        self.post_processor = post_processor if post_processor else ImagePostProcessor()
+        self.residency = residency
+        self.metrics = metrics if metrics else get_default_metrics()
+        self.retry = retry if retry else RetryPolicy(RETRY_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+        self.timeout = timeout
+        self.degradation = degradation
+
+        if catalog is None:
+            catalog = get_default_catalog() if self.backends is _shared_backends else BackendCatalog(image_backends=self.backends, client=self.client)
+
+        self.catalog = catalog
+
+    async def generate(
+            self,
+            _input: GenerationInput,
+            on_position: Optional[Callable[[int], None]] = None,
+            on_start: Optional[Callable[[Backend], None]] = None,
+    ) -> GenerationOutput:
+        """
+        Generates an image from the prompt.
+
+        If the backend is busy, the call waits in line. `on_position` is called with the call's position in the queue whenever it changes.
+        `on_start` is called with the server the image is rendered on once the request is sent to it (again if it's retried on another one).
+        """
+
+        seeded = has_fixed_seed(_input.seed)
+        deadline = Deadline(_input.timeout if _input.timeout is not None else self.timeout)
+        model, degradations = await self.plan(_input, deadline)
+
+        payload = model.to_a1_payload(_input.prompt, _input.seed)
+
+        with self.metrics.trace("image.generate", model=model.model) as trace:
+            async with deadline.enforce():
+                if seeded:
+                    image_data, details, start_stamp = await self.__render_shared(payload, model, _input, on_position, on_start, trace, deadline)
+                else:
+                    image_data, details, start_stamp = await self.__render(payload, model, _input, on_position, on_start, trace, False, deadline)
+
+                if degradations:
+                    trace.count("degraded")
+                    details = {**details, "degradations": [str(degradation) for degradation in degradations]}
+
+                images = image_data.get("images")
+
+                if not images:
+                    raise GenerationAPIException("The response didn't contain any image.")
+
+                image_binary, details = await self.process_image(images[0], details, trace)
+                end_stamp = datetime.now(UTC)
 
-        self.set_busyness(False)
-        end_stamp = datetime.now(UTC)
-        
         return GenerationOutput[BytesIO](
             prompt=_input.prompt,
             model_name=model.model,
             seed=_input.seed,
             duration=(end_stamp - start_stamp),
             data=image_binary,
-            extra=details
+            extra=details,
+            load_duration=get_load_duration(details),
         )
-    
\ No newline at end of file
+
+    async def plan(self, _input: GenerationInput, deadline: Deadline) -> Tuple[ImageModel, List[Degradation]]:
+        """
+        Returns the model `_input` should be rendered with and the degradations applied to it (see `DegradationPolicy`),
+        before the call is queued. Raises a `ModelUnavailableException` if no server offers the model (or the fallback it was degraded to),
+        or a `LoadSheddingException` if the call wouldn't complete in time.
+        """
+
+        model: ImageModel = find_model_by_id(_input.model_name, BEST_OVERALL_MODEL)
+        degradations: List[Degradation] = []
+
+        async with deadline.enforce():
+            # Loading the catalog (on first use) counts against the budget the degradation policy plans with.
+            await self.catalog.ensure_fresh()
+            self.catalog.check_image_model(model)
+
+            if self.degradation is not None:
+                model, degradations = self.degradation.plan(model, self.scheduler, deadline.remaining)
+
+                # The policy's fallback model has to be available as well.
+                if degradations:
+                    self.catalog.check_image_model(model)
+
+        return model, degradations
+
+    async def __render_shared(
+            self,
+            payload: Dict[str, Union[str, int, float]],
+            model: ImageModel,
+            _input: GenerationInput,
+            on_position: Optional[Callable[[int], None]],
+            on_start: Optional[Callable[[Backend], None]],
+            trace: Trace,
+            deadline: Deadline,
+    ) -> Tuple[Dict, Dict, datetime]:
+        key = payload_key([self.backends.key, payload])
+        render: Optional[_SharedRender] = self.flights.get_state(key)
+
+        if render is None:
+            render = _SharedRender(deadline)
+        else:
+            trace.count("coalesced")
+
+        async def start() -> Tuple[Dict, Dict, datetime]:
+            # The render outlives the caller that started it if others are still waiting, so it's traced on its own.
+            with self.metrics.trace("image.render", model=model.model) as render_trace:
+                return await self.__render(payload, model, _input, render.notify_position, render.notify_start, render_trace, True, render.deadline)
+
+        render.join(deadline, on_position, on_start)
+
+        try:
+            return await self.flights.do(key, start, render)
+        finally:
+            render.leave(on_position, on_start)
+
+    async def __render(
+            self,
+            payload: Dict[str, Union[str, int, float]],
+            model: ImageModel,
+            _input: GenerationInput,
+            on_position: Optional[Callable[[int], None]],
+            on_start: Optional[Callable[[Backend], None]],
+            trace: Trace,
+            seeded: bool,
+            deadline: Deadline,
+    ) -> Tuple[Dict, Dict, datetime]:
+        queued_ns = perf_counter_ns()
+
+        async with self.scheduler.slot(_input.priority, on_position=on_position, group=str(payload.get("model")), tenant=_input.tenant, cost=model.estimate_cost()):
+            trace.record("queue_wait", queued_ns)
+            start_stamp = datetime.now(UTC)
+
+            image_data, details = await self.txt2img(payload, trace, seeded, deadline, model.payload_template, on_start)
+
+        if self.degradation is not None:
+            # Switching checkpoints isn't part of the render itself.
+            load_duration = get_load_duration(details)
+            self.degradation.record(model, (datetime.now(UTC) - start_stamp - (load_duration if load_duration else timedelta())).total_seconds())
+
+        return image_data, details, start_stamp
+
+    async def txt2img(
+            self,
+            payload: Dict[str, Union[str, int, float]],
+            trace: Trace = NULL_TRACE,
+            idempotent: bool = False,
+            deadline: Optional[Deadline] = None,
+            template: Optional[PayloadTemplate] = None,
+            on_start: Optional[Callable[[Backend], None]] = None,
+    ) -> Tuple[Dict, Dict]:
+        """
+        Sends a raw txt2img request to one of the backends and returns the decoded response
+        along with the details of the server that handled it. If the checkpoint had to be switched first,
+        the details include the time that took in nanoseconds under `"load_duration"`.
+
+        Failed requests are retried on another server if possible, but only if they never reached a server
+        or the request is `idempotent` (e.g. has a fixed seed). No retry is started past the `deadline`.
+        Doesn't wait for a slot of the scheduler, that's up to the caller.
+
+        The payload is encoded with `template` if provided (see `ImageModel.payload_template`).
+        The returned images are the raw base64 encoded `bytes`, extracted from the response without decoding it as a whole.
+
+        `on_start` is called with the server right before the request is sent to it. If the call is cancelled while the server
+        is rendering, the render is interrupted (see `interrupt()`), unless the server is handling other requests of the process as well,
+        since A1111 can only interrupt whichever render is current.
+        """
+
+        model_name = str(payload.get("model"))
+        tried: Set[str] = set()
+
+        with trace.phase("json_encode"):
+            body = template.render(payload) if template else self.client.encode(payload)
+
+        async def attempt() -> Tuple[Dict, Dict]:
+            load_duration = None
+
+            async with self.backends.acquire(model_name, tried) as backend:
+                tried.add(backend.url)
+
+                if self.residency and model_name not in backend.loaded_models:
+                    with trace.phase("load"):
+                        load_duration = await self.residency.load_checkpoint(model_name, backend)
+
+                if on_start:
+                    on_start(backend)
+
+                try:
+                    image_data = await self.client.post_json_extract(backend.url + TXT2IMG_ENDPOINT, body, "images", trace)
+                except CancelledError:
+                    # Otherwise the server keeps rendering an image nobody receives. Still within the slot, so it can't be another call's render.
+                    if backend.outstanding == 1:
+                        await self.interrupt(backend.url)
+
+                    raise
+
+                if dict(image_data).get("error", None):
+                    raise GenerationAPIException(image_data["error"])
+
+                details = await self.catalog.get_details(backend.url)
+
+            if load_duration is not None:
+                details = {**details, "load_duration": load_duration // timedelta(microseconds=1) * 1000}
+
+            return image_data, details
+
+        try:
+            return await self.retry.run(attempt, idempotent, deadline)
+        except ClientResponseError as e:
+            raise GenerationAPIException(e.message) from e
+
+    def submit(self, _input: GenerationInput, previews: bool = False, on_position: Optional[Callable[[int], None]] = None) -> "ImageJob":
+        """
+        Starts generating an image from the prompt and returns an `ImageJob` reporting its progress.
+        If `previews` is enabled, the progress includes the preview images A1111 renders along the way.
+        """
+
+        return ImageJob(self, _input, previews, on_position)
+
+    async def get_progress(self, base_url: str, previews: bool = False) -> Dict[str, Any]:
+        """
+        Returns the progress of the current render of an A1111 server, with its latest preview image (if any) if `previews` is enabled.
+        """
+
+        return dict(await self.client.get_json(f"{base_url}{PROGRESS_ENDPOINT}?skip_current_image={'false' if previews else 'true'}"))
+
+    async def interrupt(self, base_url: str) -> bool:
+        """
+        Asks an A1111 server to stop its current render. Returns `False` if the server couldn't be reached in time.
+        """
+
+        try:
+            # Shielded, so the request is still sent when the caller is cancelled again while waiting.
+            await wait_for(shield(self.client.post_json(base_url + INTERRUPT_ENDPOINT, {})), INTERRUPT_TIMEOUT)
+        except Exception:
+            return False
+
+        return True
+
+    async def get_details(self, base_url: Optional[str] = None) -> Dict[str, Union[str, int, float, bool]]:
+        """
+        Returns details about an A1111 server (the first backend by default), which are attached to outputs as `extra`.
+        They're taken from the generator's `BackendCatalog` instead of asking the server.
+        """
+
+        return await self.catalog.get_details(base_url if base_url else self.backends.backends[0].url)
+
+    async def process_image(self, data: Union[str, bytes], details: Dict, trace: Trace = NULL_TRACE) -> Tuple[BytesIO, Dict]:
+        """
+        Decodes and post-processes a base64 encoded image returned by A1111 with the generator's processor.
+        Returns the image and `details` extended with the thumbnail, if one was generated.
+        """
+
+        processed = await self.post_processor.process(data, trace=trace)
+
+        if processed.thumbnail_raw is not None:
+            details = {**details, "thumbnail": processed.thumbnail}
+
+        return processed.data, details
+
+    @staticmethod
+    def decode_image(data: Union[str, bytes]) -> BytesIO:
+        """
+        Decodes a base64 encoded image returned by A1111.
+        """
+
+        image_binary = BytesIO(base64.b64decode(data))
+        image_binary.seek(0)
+
+        return image_binary
+
+class _SharedRender:
+    """
+    The callers waiting for the same render (see `SingleFlight`), whose callbacks are all called by it.
+    """
+
+    def __init__(self, deadline: Deadline) -> None:
+        self.deadline = Deadline(deadline.remaining)
+        """The deadline of the render, which is the latest deadline of its callers."""
+
+        self.position: Optional[int] = None
+        """The latest position of the render in the queue."""
+
+        self.backend: Optional[Backend] = None
+        """The server the render was last sent to."""
+
+        self.__on_position: List[Callable[[int], None]] = []
+        self.__on_start: List[Callable[[Backend], None]] = []
+
+    def join(self, deadline: Deadline, on_position: Optional[Callable[[int], None]], on_start: Optional[Callable[[Backend], None]]) -> None:
+        """
+        Adds a caller, extending the render's deadline to the caller's and catching its callbacks up with what already happened.
+        """
+
+        if self.deadline.expires_at is not None and (deadline.expires_at is None or deadline.expires_at > self.deadline.expires_at):
+            self.deadline.budget, self.deadline.expires_at = deadline.budget, deadline.expires_at
+
+        if on_position:
+            self.__on_position.append(on_position)
+
+            if self.position is not None:
+                on_position(self.position)
+
+        if on_start:
+            self.__on_start.append(on_start)
+
+            if self.backend is not None:
+                on_start(self.backend)
+
+    def leave(self, on_position: Optional[Callable[[int], None]], on_start: Optional[Callable[[Backend], None]]) -> None:
+        """
+        Removes the callbacks of a caller that stopped waiting.
+        """
+
+        if on_position in self.__on_position:
+            self.__on_position.remove(on_position)
+
+        if on_start in self.__on_start:
+            self.__on_start.remove(on_start)
+
+    def notify_position(self, position: int) -> None:
+        self.position = position
+
+        for callback in list(self.__on_position):
+            callback(position)
+
+    def notify_start(self, backend: Backend) -> None:
+        self.backend = backend
+
+        for callback in list(self.__on_start):
+            callback(backend)
+
+@dataclass(repr=True, frozen=True)
+class ImageProgress:
+    """
+    The progress of an `ImageJob`.
+    """
+
+    fraction: float = 0.0
+    """How much of the render is done, from 0 to 1."""
+
+    eta: Optional[timedelta] = None
+    """How long the rest of the render is expected to take, if it started."""
+
+    step: Optional[int] = None
+    """The sampling step the render is at, if it started."""
+
+    steps: Optional[int] = None
+    """The number of sampling steps of the render, if it started."""
+
+    position: Optional[int] = None
+    """The position of the job in the queue, while it's waiting for a slot."""
+
+    preview: Optional[BytesIO] = field(repr=False, default=None)
+    """The latest (low resolution) preview of the image, if previews were requested and A1111 rendered one."""
+
+class ImageJob:
+    """
+    A handle on an image generation started by `ImageGenerator.submit()`.
+
+    While the job waits in line, its position is reported. Once its render reached a server, the progress
+    A1111 reports for it is polled in the background. The time between two polls follows the expected remaining time
+    (between `PROGRESS_POLL_MIN_INTERVAL` and `PROGRESS_POLL_MAX_INTERVAL` seconds), so short renders are updated often
+    and long ones don't flood the server. A1111 only reports the progress of its current render, so progress is only polled
+    while the server handles no other request of the process. Renders shared with an identical request aren't reported.
+
+    Iterating over the job yields the latest `ImageProgress` whenever it changes, until the job is done.
+    Awaiting it returns the output. Cancelling the job (or the task awaiting it) interrupts the render on the server.
+
+    Usage:
+    ```
+    job = generator.submit(_input, previews=True)
+
+    async for progress in job:
+        print(f"{progress.fraction:.0%}", progress.eta)
+
+    output = await job
+    ```
+    """
+
+    def __init__(self, generator: ImageGenerator, _input: GenerationInput, previews: bool, on_position: Optional[Callable[[int], None]]) -> None:
+        self.__generator = generator
+        self.__on_position = on_position
+
+        self.previews = previews
+        """Whether the preview images A1111 renders along the way are requested."""
+
+        self.progress: Optional[ImageProgress] = None
+        """The latest progress, `None` until the first update."""
+
+        self.__backend: Optional[Backend] = None
+        self.__poller: Optional[Task] = None
+        self.__update: Future = get_running_loop().create_future()
+        self.__task: Task = ensure_future(generator.generate(_input, on_position=self.__queued, on_start=self.__started))
+        self.__task.add_done_callback(self.__finish)
+
+    def done(self) -> bool:
+        """
+        Returns `True` if the job has completed, failed or been cancelled.
+        """
+
+        return self.__task.done()
+
+    def cancel(self) -> bool:
+        """
+        Cancels the job, interrupting its render if it started. Returns `False` if the job was already done.
+        """
+
+        return self.__task.cancel()
+
+    def __await__(self) -> Generator[Any, None, GenerationOutput]:
+        return self.__task.__await__()
+
+    def __aiter__(self) -> AsyncIterator[ImageProgress]:
+        return self.__iterate()
+
+    async def __iterate(self) -> AsyncIterator[ImageProgress]:
+        while not self.done():
+            # Shielded, so a consumer that stops waiting doesn't cancel the update for everyone else.
+            await shield(self.__update)
+
+            if self.progress is not None and not self.done():
+                yield self.progress
+
+    def __publish(self, progress: Optional[ImageProgress]) -> None:
+        if progress is not None:
+            self.progress = progress
+
+        update, self.__update = self.__update, get_running_loop().create_future()
+
+        if not update.done():
+            update.set_result(None)
+
+    def __queued(self, position: int) -> None:
+        self.__publish(ImageProgress(position=position))
+
+        if self.__on_position:
+            self.__on_position(position)
+
+    def __started(self, backend: Backend) -> None:
+        self.__backend = backend
+        self.__publish(ImageProgress())
+
+        if self.__poller is None:
+            self.__poller = ensure_future(self.__poll())
+
+    async def __poll(self) -> None:
+        interval = PROGRESS_POLL_MIN_INTERVAL
+        preview: Optional[BytesIO] = None
+
+        while True:
+            await sleep(interval)
+            backend = self.__backend
+
+            if backend is None or backend.outstanding != 1:
+                continue
+
+            try:
+                data = await self.__generator.get_progress(backend.url, self.previews)
+            except Exception:
+                # Progress is best effort, the render itself isn't affected.
+                interval = PROGRESS_POLL_MAX_INTERVAL
+                continue
+
+            state: Dict[str, Any] = data.get("state") or {}
+            eta = data.get("eta_relative")
+
+            if data.get("current_image"):
+                preview = ImageGenerator.decode_image(data["current_image"])
+
+            self.__publish(ImageProgress(
+                fraction=min(max(float(data.get("progress") or 0.0), 0.0), 1.0),
+                eta=timedelta(seconds=eta) if isinstance(eta, (int, float)) and eta > 0 else None,
+                step=state.get("sampling_step"),
+                steps=state.get("sampling_steps"),
+                preview=preview,
+            ))
+
+            # About ten updates over the rest of the render.
+            interval = min(max(eta / 10, PROGRESS_POLL_MIN_INTERVAL), PROGRESS_POLL_MAX_INTERVAL) if isinstance(eta, (int, float)) and eta > 0 else PROGRESS_POLL_MIN_INTERVAL
+
+    def __finish(self, _: Task) -> None:
+        if self.__poller is not None:
+            self.__poller.cancel()
+
+        self.__publish(None)
@@ -0,0 +1,127 @@
+from asyncio import Task, ensure_future, to_thread
+from datetime import datetime, UTC
+from io import BytesIO
+from typing import Any, Dict, Optional, Set, Tuple, Union
+import json
+from .types.contracts import GeneratorContract
+from .types.structs import GenerationInput, GenerationOutput, ImageModel
+from .helpers.model_helpers import find_model_by_id
+from .helpers.payload_helpers import has_fixed_seed, payload_key
+from .constants.diffusion_models import BEST_OVERALL_MODEL
+from .constants.img_constants import CACHE_MAX_BYTES, CACHE_DISK_MAX_BYTES, CACHE_TTL
+from .img import ImageGenerator
+from ..utils.cache import CacheStats, DiskCache, LRUCache
+
+_CacheEntry = Tuple[Union[bytes, memoryview], Optional[Dict]]
+
+class CachingImageGenerator(GeneratorContract):
+    """
+    Serves repeated image generations with a fixed seed from a cache instead of rendering them again.
+
+    Since the A1111 payload fully determines the output when the seed is fixed, results are cached
+    under a hash of the payload. Results live in an in-memory LRU tier limited by `max_bytes`
+    and, if `disk_directory` is provided, also in an on-disk tier which is read through memory maps.
+    Requests without a fixed seed are always forwarded to the wrapped generator, and degraded renders are never cached.
+
+    Only the plain values of an output's `extra` are cached (binary details like thumbnails are left out).
+    Results are written to the on-disk tier in the background, so a miss doesn't wait for the disk.
+    """
+
+    def __init__(
+            self,
+            generator: Optional[GeneratorContract] = None,
+            max_bytes: int = CACHE_MAX_BYTES,
+            ttl: Optional[float] = CACHE_TTL,
+            disk_directory: Optional[str] = None,
+            disk_max_bytes: int = CACHE_DISK_MAX_BYTES,
+    ) -> None:
+        self.generator = generator if generator else ImageGenerator()
+        """The generator used on cache misses."""
+
+        self.memory = LRUCache[_CacheEntry](max_bytes, ttl, sizeof=lambda entry: len(entry[0]))
+        """The in-memory tier."""
+
+        self.disk = DiskCache(disk_directory, disk_max_bytes, ttl) if disk_directory else None
+        """The optional on-disk tier."""
+
+        self.__writing: Set[Task] = set()
+
+    @property
+    def stats(self) -> Dict[str, CacheStats]:
+        """
+        Returns the hit/miss statistics of each tier.
+        """
+
+        stats = {"memory": self.memory.stats}
+
+        if self.disk:
+            stats["disk"] = self.disk.stats
+
+        return stats
+
+    async def generate(self, _input: GenerationInput) -> GenerationOutput:
+        if not has_fixed_seed(_input.seed):
+            return await self.generator.generate(_input)
+
+        start_stamp = datetime.now(UTC)
+        model: ImageModel = find_model_by_id(_input.model_name, BEST_OVERALL_MODEL)
+        key = payload_key(model.to_a1_payload(_input.prompt, _input.seed))
+
+        entry = self.__lookup(key)
+
+        if entry is None:
+            output: GenerationOutput[BytesIO] = await self.generator.generate(_input)
+
+            # A render degraded under load (see `DegradationPolicy`) doesn't match the payload it would be cached under.
+            if not (output.extra and output.extra.get("degradations")):
+                self.__store(key, output.data.getvalue(), output.extra)
+
+            return output
+
+        return GenerationOutput[BytesIO](
+            prompt=_input.prompt,
+            model_name=model.model,
+            seed=_input.seed,
+            duration=(datetime.now(UTC) - start_stamp),
+            data=BytesIO(entry[0]),
+            extra=dict(entry[1]) if entry[1] is not None else None,
+        )
+
+    def __lookup(self, key: str) -> Optional[_CacheEntry]:
+        entry = self.memory.get(key)
+
+        if entry is not None or self.disk is None:
+            return entry
+
+        image_bytes = self.disk.get(key)
+
+        if image_bytes is None:
+            return None
+
+        details = self.disk.get(f"{key}-extra")
+        entry = (image_bytes, json.loads(bytes(details)) if details is not None else None)
+        self.memory.set(key, entry)
+
+        return entry
+
+    def __store(self, key: str, image_bytes: bytes, details: Optional[Dict]) -> None:
+        # Binary details (like thumbnails) can't be shared by every hit, nor stored as JSON.
+        details = {name: value for name, value in details.items() if isinstance(value, (str, int, float, bool, type(None)))} if details is not None else None
+        self.memory.set(key, (image_bytes, details))
+
+        if self.disk is None:
+            return
+
+        task = ensure_future(to_thread(self.__write, key, image_bytes, details))
+        self.__writing.add(task)
+        task.add_done_callback(self.__writing.discard)
+
+    def __write(self, key: str, image_bytes: bytes, details: Optional[Dict[str, Any]]) -> None:
+        try:
+            self.disk.set(key, image_bytes)
+
+            if details is not None:
+                self.disk.set(f"{key}-extra", json.dumps(details).encode("utf-8"))
+        except OSError:
+            # Nobody waits for the write, the result is still served from memory.
+            self.disk.stats.errors += 1
@@ -0,0 +1,142 @@
+from asyncio import get_running_loop
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from io import BytesIO
+from time import perf_counter_ns
+from typing import Optional, Tuple, Union
+import base64
+from .types.enums import ImageFormat
+from .types.exceptions import MissingDependencyException
+from .types.structs import PostProcessOptions
+from ..utils.metrics import NULL_TRACE, Trace
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+@dataclass(init=True, repr=True, frozen=True)
+class ProcessedImage:
+    """
+    The result of post-processing a generated image.
+    """
+
+    raw: bytes = field(repr=False)
+    """The encoded image."""
+
+    thumbnail_raw: Optional[bytes] = field(repr=False, default=None)
+    """The encoded thumbnail, if one was requested."""
+
+    format: Optional[ImageFormat] = None
+    """The format the image was re-encoded to, or `None` if it was left as returned by the API."""
+
+    @property
+    def data(self) -> BytesIO:
+        """
+        Returns a new `BytesIO` over the image. The buffer is shared with `raw` until it's written to.
+        """
+
+        return BytesIO(self.raw)
+
+    @property
+    def thumbnail(self) -> Optional[BytesIO]:
+        """
+        Returns a new `BytesIO` over the thumbnail, if any.
+        """
+
+        return BytesIO(self.thumbnail_raw) if self.thumbnail_raw is not None else None
+
+    @property
+    def view(self) -> memoryview:
+        """
+        Returns a read-only view of the image without copying it.
+        """
+
+        return memoryview(self.raw)
+
+class ImagePostProcessor:
+    """
+    Decodes and post-processes generated images off the event loop.
+
+    Decoding multi-megabyte base64 images (and re-encoding them) takes long enough to stall every other coroutine,
+    so the work is done by an executor instead. By default, a thread pool shared by every processor is used,
+    but a `ProcessPoolExecutor` can be provided as well for true parallelism.
+    Re-encoding, thumbnails and metadata stripping require the optional Pillow package.
+    """
+
+    def __init__(self, options: PostProcessOptions = PostProcessOptions(), executor: Optional[Executor] = None) -> None:
+        self.options = options
+        """The default options used when `process()` isn't given any."""
+
+        self.executor = executor
+        """The executor the work is done by. `None` means the shared thread pool."""
+
+    async def process(self, data: Union[str, bytes], options: Optional[PostProcessOptions] = None, trace: Trace = NULL_TRACE) -> ProcessedImage:
+        """
+        Decodes a base64 encoded image returned by A1111 and applies the post-processing `options` to it.
+        The time spent decoding (`"b64_decode"`) and in the executor overall (`"postprocess"`) is recorded to `trace`.
+        """
+
+        options = options if options else self.options
+
+        if options.requires_reencoding and Image is None:
+            raise MissingDependencyException("Pillow", "Re-encoding images")
+
+        start_ns = perf_counter_ns()
+        raw, thumbnail_raw, decode_ns = await get_running_loop().run_in_executor(self.executor if self.executor else _get_shared_executor(), _process, data, options)
+
+        trace.record("postprocess", start_ns)
+        trace.add("b64_decode", decode_ns)
+
+        return ProcessedImage(raw, thumbnail_raw, options.format)
+
+_shared_executor: Optional[ThreadPoolExecutor] = None
+
+def _get_shared_executor() -> ThreadPoolExecutor:
+    global _shared_executor
+
+    if _shared_executor is None:
+        _shared_executor = ThreadPoolExecutor(thread_name_prefix="pmllib-postprocessing")
+
+    return _shared_executor
+
+def _process(data: Union[str, bytes], options: PostProcessOptions) -> Tuple[bytes, Optional[bytes], int]:
+    # Runs in the executor, so it has to stay a picklable module level function.
+    start_ns = perf_counter_ns()
+    raw = base64.b64decode(data)
+    decode_ns = perf_counter_ns() - start_ns
+
+    if not options.requires_reencoding:
+        return raw, None, decode_ns
+
+    with Image.open(BytesIO(raw)) as image:
+        image.load()
+        image_format = options.format if options.format else _get_format(image.format)
+
+        if options.format or options.strip_metadata:
+            raw = _encode(image, image_format, options.quality)
+
+        thumbnail_raw = None
+
+        if options.thumbnail_size:
+            thumbnail = image.copy()
+            thumbnail.thumbnail((options.thumbnail_size.width, options.thumbnail_size.height))
+            thumbnail_raw = _encode(thumbnail, image_format, options.quality)
+
+    return raw, thumbnail_raw, decode_ns
+
+def _get_format(name: Optional[str]) -> ImageFormat:
+    try:
+        return ImageFormat(name)
+    except ValueError:
+        return ImageFormat.PNG
+
+def _encode(image, image_format: ImageFormat, quality: int) -> bytes:
+    # Images are saved without passing their `info`/EXIF data along, which strips the metadata.
+    if image_format == ImageFormat.JPEG and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    output = BytesIO()
+    image.save(output, format=image_format.value, quality=quality)
+
+    return output.getvalue()
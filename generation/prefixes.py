@@ -0,0 +1,73 @@
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+from .constants.llm_constants import PREFIX_CACHE_SIZE
+from ..utils.codec import Fragment, get_codec
+
+class PrefixCache:
+    """
+    Keeps the `context` Ollama's `/api/generate` returns for stable prompt prefixes (like the instructions of a summary),
+    so later calls starting with the same prefix can send the already tokenized context instead of the prefix's text
+    and Ollama doesn't have to evaluate the prefix again (see `ChatGenerator.complete()`).
+
+    Contexts are stored per model name, pre-encoded, and at most `max_entries` of them are kept (the least recently used is dropped first).
+    A context is only valid for the exact model it was produced by, so the contexts of a model have to be dropped
+    with `invalidate()` when it changes (like when a new version is pulled under the same name).
+    """
+
+    def __init__(self, max_entries: int = PREFIX_CACHE_SIZE) -> None:
+        self.max_entries = max_entries
+        """The maximum number of contexts kept."""
+
+        self.hits = 0
+        """How many lookups found a context."""
+
+        self.misses = 0
+        """How many lookups didn't find a context."""
+
+        self.__entries: "OrderedDict[Tuple[str, str], Fragment]" = OrderedDict()
+
+    def get(self, model_name: str, prefix: str) -> Optional[Fragment]:
+        """
+        Returns the encoded context of `prefix` for the given model, or `None` if it's not known.
+        """
+
+        key = (model_name, prefix)
+        context = self.__entries.get(key)
+
+        if context is None:
+            self.misses += 1
+            return None
+
+        self.__entries.move_to_end(key)
+        self.hits += 1
+
+        return context
+
+    def put(self, model_name: str, prefix: str, context: List[int]) -> Fragment:
+        """
+        Stores the context Ollama returned for `prefix` and returns it encoded.
+        """
+
+        key = (model_name, prefix)
+        fragment = self.__entries[key] = get_codec().fragment(context)
+        self.__entries.move_to_end(key)
+
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+        return fragment
+
+    def invalidate(self, model_name: Optional[str] = None, prefix: Optional[str] = None) -> None:
+        """
+        Drops the contexts of the given model (only the one of `prefix` if provided), or every context if no model is given.
+        """
+
+        if model_name is None:
+            self.__entries.clear()
+            return
+
+        for key in [key for key in self.__entries if key[0] == model_name and (prefix is None or key[1] == prefix)]:
+            del self.__entries[key]
+
+    def __len__(self) -> int:
+        return len(self.__entries)
@@ -0,0 +1,174 @@
+from typing import Any, Callable, Dict, Generic, Iterable, Iterator, List, Optional, TypeVar, Union
+import json
+import os
+from .types.enums import ModelCapability
+from .types.structs import ChatModel, ImageModel
+
+# A config file of models to register on top of the built-in ones, loaded along with them.
+MODELS_CONFIG_ENV = "PMLLIB_MODELS_CONFIG"
+
+M = TypeVar("M", ChatModel, ImageModel)
+
+class ModelRegistry(Generic[M]):
+    """
+    Looks up models by ID, alias or filename in constant time, case-insensitively.
+
+    The built-in models are only constructed (by calling `loader`) when the registry is first used,
+    so importing a generator doesn't pay for tables it never looks at.
+    Registering a model with the ID of an already registered one replaces it.
+
+    Models can also be registered from a JSON (or TOML) config file, whose `section` (`"chat"` or `"image"`)
+    is a list of objects of the model's constructor arguments (see `ChatModel.from_config()` and `ImageModel.from_config()`):
+    ```
+    {"image": [{"_id": "flux", "model": "flux_1_schnell_q8p.ckpt", "dimensions": [768, 1024], "aliases": ["schnell"]}]}
+    ```
+    """
+
+    def __init__(
+            self,
+            factory: Callable[[Dict[str, Any]], M],
+            filename: Callable[[M], str],
+            section: str,
+            loader: Optional[Callable[[], Iterable[M]]] = None,
+    ) -> None:
+        self.factory = factory
+        """Constructs a model from an entry of a config file."""
+
+        self.filename = filename
+        """Returns the filename of a model, which it can be looked up by as well."""
+
+        self.section = section
+        """The section of config files the registry's models are read from."""
+
+        self.__loader = loader
+        self.__models: Dict[str, M] = {}
+        self.__index: Dict[str, M] = {}
+
+    def register(self, model: M) -> M:
+        """
+        Adds `model` to the registry (replacing the one with the same ID, if any) and returns it.
+        IDs and aliases take precedence over filenames when they collide.
+        """
+
+        self.__load()
+        key = _fold(model._id)
+        replaced = self.__models.pop(key, None)
+
+        if replaced is not None:
+            self.__index = {name: m for name, m in self.__index.items() if m is not replaced}
+
+        self.__models[key] = model
+
+        filename = self.filename(model)
+
+        if filename:
+            self.__index.setdefault(_fold(filename), model)
+
+        for name in [model._id, *model.aliases]:
+            self.__index[_fold(name)] = model
+
+        return model
+
+    def load_file(self, path: str) -> List[M]:
+        """
+        Registers every model of the registry's section of the config file at `path` and returns them.
+        Files ending in `.toml` are read as TOML, anything else as JSON.
+        """
+
+        if path.endswith(".toml"):
+            import tomllib
+
+            with open(path, "rb") as file:
+                config = tomllib.load(file)
+        else:
+            with open(path, "r", encoding="utf-8") as file:
+                config = json.load(file)
+
+        return [self.register(self.factory(entry)) for entry in config.get(self.section, [])]
+
+    def find(self, name: Optional[str], _fallback: Optional[M] = None) -> Optional[M]:
+        """
+        Returns the model with the given ID, alias or filename.
+        Optionally accepts a `_fallback` value which will be returned if no match was found instead of `None`.
+        """
+
+        self.__load()
+        model = self.__index.get(_fold(name)) if name else None
+
+        return model if model is not None else _fallback
+
+    def find_by_capability(self, *capabilities: Union[ModelCapability, str]) -> List[M]:
+        """
+        Returns every model which has all of the given capabilities, in the order they were registered.
+        """
+
+        required = {ModelCapability(capability) for capability in capabilities}
+
+        return [model for model in self if required <= model.capabilities]
+
+    def __load(self) -> None:
+        if self.__loader is None:
+            return
+
+        loader, self.__loader = self.__loader, None
+
+        for model in loader():
+            self.register(model)
+
+        path = os.environ.get(MODELS_CONFIG_ENV)
+
+        if path:
+            self.load_file(path)
+
+    def __contains__(self, name: str) -> bool:
+        return self.find(name) is not None
+
+    def __iter__(self) -> Iterator[M]:
+        self.__load()
+
+        return iter(list(self.__models.values()))
+
+    def __len__(self) -> int:
+        self.__load()
+
+        return len(self.__models)
+
+def _fold(name: str) -> str:
+    return name.strip().casefold()
+
+def _load_chat_models() -> List[ChatModel]:
+    from .constants.llm_models import MODELS
+
+    return MODELS
+
+def _load_image_models() -> List[ImageModel]:
+    from .constants.diffusion_models import MODELS
+
+    return MODELS
+
+_chat_models: Optional[ModelRegistry[ChatModel]] = None
+_image_models: Optional[ModelRegistry[ImageModel]] = None
+
+def get_chat_models() -> ModelRegistry[ChatModel]:
+    """
+    Returns the process-wide registry of chat models, which starts out with the built-in ones (see `llm_models.MODELS`).
+    """
+
+    global _chat_models
+
+    if _chat_models is None:
+        _chat_models = ModelRegistry(ChatModel.from_config, lambda model: model.name, "chat", _load_chat_models)
+
+    return _chat_models
+
+def get_image_models() -> ModelRegistry[ImageModel]:
+    """
+    Returns the process-wide registry of image models, which starts out with the built-in ones (see `diffusion_models.MODELS`).
+    """
+
+    global _image_models
+
+    if _image_models is None:
+        _image_models = ModelRegistry(ImageModel.from_config, lambda model: model.model, "image", _load_image_models)
+
+    return _image_models
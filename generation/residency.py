@@ -0,0 +1,175 @@
+from asyncio import gather
+from dataclasses import dataclass
+from datetime import datetime, timedelta, UTC
+from typing import Dict, List, Optional
+from .types.structs import ChatModel, ImageModel
+from .types.exceptions import GenerationAPIException
+from .helpers.model_helpers import normalize_chat_model_name
+from .helpers.payload_helpers import get_load_duration, with_keep_alive
+from .constants.img_constants import OPTIONS_ENDPOINT
+from .constants.llm_constants import GENERATE_ENDPOINT, PS_ENDPOINT
+from .chat import _shared_backends as _shared_chat_backends
+from .img import _shared_backends as _shared_image_backends
+from ..utils.backends import Backend, BackendPool
+from ..utils.http import HttpClient, get_default_client
+
+@dataclass
+class ModelLoadStats:
+    """
+    How often and how long a model had to be loaded into memory.
+    """
+
+    loads: int = 0
+    total: timedelta = timedelta()
+    last: Optional[timedelta] = None
+
+    @property
+    def average(self) -> Optional[timedelta]:
+        """
+        Returns the average duration of a load, or `None` if the model was never loaded.
+        """
+
+        return self.total / self.loads if self.loads else None
+
+class ResidencyManager:
+    """
+    Keeps models loaded on the backends and measures how long loading them takes.
+
+    Chat models are loaded by sending Ollama an empty request (with the model's `keep_alive` hint, see `ChatModel`),
+    image models by switching the A1111 checkpoint. Which model a backend has loaded is tracked by its `BackendPool`,
+    so requests are routed to servers that don't have to load anything first.
+
+    Load times are recorded separately from generation times in `stats`. Generators given a manager report
+    the load times they observe to it. An `ImageGenerator` given a manager also switches checkpoints explicitly
+    before rendering on a server that doesn't have the model loaded, so the switch shows up as `load_duration`.
+
+    Usage:
+    ```
+    residency = ResidencyManager()
+    await residency.preload([LLAMA3_8B], [JUGGERNAUTXL_V9_LIGHTNING])
+
+    generator = ImageGenerator(residency=residency)
+    ```
+    """
+
+    def __init__(
+            self,
+            chat_backends: Optional[BackendPool] = None,
+            image_backends: Optional[BackendPool] = None,
+            client: Optional[HttpClient] = None,
+    ) -> None:
+        self.chat_backends = chat_backends if chat_backends else _shared_chat_backends
+        """The Ollama servers chat models are loaded on."""
+
+        self.image_backends = image_backends if image_backends else _shared_image_backends
+        """The A1111 servers image models are loaded on."""
+
+        self.client = client if client else get_default_client()
+
+        self.stats: Dict[str, ModelLoadStats] = {}
+        """The load statistics of every model by name."""
+
+    async def preload(self, chat_models: Optional[List[ChatModel]] = None, image_models: Optional[List[ImageModel]] = None) -> None:
+        """
+        Loads every chat model on every Ollama server and spreads the image models over the A1111 servers,
+        since each of those can only hold a single checkpoint at a time.
+        """
+
+        chat_models = chat_models if chat_models is not None else []
+        image_models = image_models if image_models is not None else []
+
+        loads = [self.load_chat_model(model, backend) for model in chat_models for backend in self.chat_backends.backends]
+
+        for i, model in enumerate(image_models[:len(self.image_backends)]):
+            loads.append(self.load_image_model(model, self.image_backends.backends[i]))
+
+        await gather(*loads)
+
+    async def load_chat_model(self, model: ChatModel, backend: Backend) -> timedelta:
+        """
+        Loads `model` on the Ollama server and returns how long it took.
+        """
+
+        start_stamp = datetime.now(UTC)
+        resp = await self.client.post_json(backend.url + GENERATE_ENDPOINT, with_keep_alive({"model": model.name}, model.keep_alive))
+
+        if "error" in resp.keys():
+            raise GenerationAPIException(resp["error"])
+
+        duration = get_load_duration(resp) or datetime.now(UTC) - start_stamp
+
+        self.chat_backends.record_success(backend, normalize_chat_model_name(model.name))
+        self.record_load(model.name, duration)
+
+        return duration
+
+    async def unload_chat_model(self, model: ChatModel) -> None:
+        """
+        Asks every Ollama server to free the memory used by `model`.
+        """
+
+        async def unload(backend: Backend) -> None:
+            await self.client.post_json(backend.url + GENERATE_ENDPOINT, {"model": model.name, "keep_alive": 0})
+            backend.loaded_models.discard(normalize_chat_model_name(model.name))
+
+        await gather(*[unload(backend) for backend in self.chat_backends.backends])
+
+    async def load_image_model(self, model: ImageModel, backend: Backend) -> timedelta:
+        """
+        Switches the A1111 server to `model` and returns how long it took.
+        """
+
+        return await self.load_checkpoint(model.model, backend)
+
+    async def load_checkpoint(self, checkpoint: str, backend: Backend) -> timedelta:
+        """
+        Switches the A1111 server to the checkpoint with the provided filename and returns how long it took.
+        """
+
+        start_stamp = datetime.now(UTC)
+        resp = await self.client.post_json(backend.url + OPTIONS_ENDPOINT, {"sd_model_checkpoint": checkpoint})
+
+        if isinstance(resp, dict) and resp.get("error"):
+            raise GenerationAPIException(resp["error"])
+
+        duration = datetime.now(UTC) - start_stamp
+
+        self.image_backends.record_success(backend, checkpoint)
+        self.record_load(checkpoint, duration)
+
+        return duration
+
+    async def refresh(self) -> None:
+        """
+        Asks every backend which models it has loaded and updates the pools accordingly.
+        """
+
+        async def refresh_chat(backend: Backend) -> None:
+            resp = await self.client.get_json(backend.url + PS_ENDPOINT)
+            # Ollama reports tagged names (like "llama3:latest"), which chat models may leave out.
+            backend.loaded_models = {normalize_chat_model_name(str(model.get("name"))) for model in resp.get("models", [])}
+
+        async def refresh_image(backend: Backend) -> None:
+            resp = await self.client.get_json(backend.url + OPTIONS_ENDPOINT)
+            checkpoint = resp.get("sd_model_checkpoint")
+
+            # A1111 reports checkpoints as "<filename> [<hash>]".
+            backend.loaded_models = {str(checkpoint).split(" [")[0]} if checkpoint else set()
+
+        await gather(
+            *[refresh_chat(backend) for backend in self.chat_backends.backends],
+            *[refresh_image(backend) for backend in self.image_backends.backends],
+        )
+
+    def record_load(self, model_name: str, duration: Optional[timedelta]) -> None:
+        """
+        Adds a load of `model_name` that took `duration` to the statistics. Nothing is recorded if the duration is unknown.
+        """
+
+        if duration is None:
+            return
+
+        stats = self.stats.setdefault(model_name, ModelLoadStats())
+        stats.loads += 1
+        stats.total += duration
+        stats.last = duration
@@ -0,0 +1,235 @@
+from asyncio import Lock, Task, ensure_future, get_running_loop, shield
+from typing import Dict, List, Optional, TextIO
+import json
+import os
+from .chat import ChatGenerator
+from .embeddings import EmbeddingGenerator
+from .vectors import FlatVectorIndex, VectorIndex
+from .types.structs import ChatHistory, ChatMessage
+from .constants.llm_constants import RETRIEVAL_TOP_K, RETRIEVAL_MIN_SCORE, RETRIEVAL_RECENT_MESSAGES
+
+class MessageRetriever:
+    """
+    Gives a `ChatGenerator` a long-term memory of its whole conversation, without sending all of it with every request.
+
+    Once a turn is over, its messages are embedded (with an `EmbeddingGenerator`) and stored in a `VectorIndex`.
+    Requests then only send the system prompt (and summary), the `recent` latest messages of the history, and in between them
+    the (at most) `top_k` earlier messages most similar to the prompt, oldest first. Recalled messages which are among the latest ones are skipped.
+    The history itself can be kept short, since older messages are recalled whenever they're relevant.
+
+    If a `path` is given, the messages are appended to a JSONL file next to the index (see `FlatVectorIndex`),
+    so the memory of a conversation survives restarts. In `background` mode, turns are stored by separate tasks
+    and generation calls don't wait for them. Storing is traced as `"chat.remember"` through the generator's `metrics`. Recalling is best effort: if embedding the prompt fails, only the history is sent.
+
+    Usage:
+    ```
+    generator = ChatGenerator(None)
+    MessageRetriever(generator, path=f"memory/{conversation_id}")
+
+    await generator.generate(_input)
+    ```
+    """
+
+    def __init__(
+            self,
+            generator: ChatGenerator,
+            embeddings: Optional[EmbeddingGenerator] = None,
+            index: Optional[VectorIndex] = None,
+            path: Optional[str] = None,
+            top_k: int = RETRIEVAL_TOP_K,
+            min_score: Optional[float] = RETRIEVAL_MIN_SCORE,
+            recent: int = RETRIEVAL_RECENT_MESSAGES,
+            background: bool = True,
+    ) -> None:
+        self.generator = generator
+        """The generator whose requests are augmented."""
+
+        self.embeddings = embeddings if embeddings else EmbeddingGenerator(client=generator.client, metrics=generator.metrics)
+        """Embeds the messages and prompts."""
+
+        self.index = index if index else FlatVectorIndex(path=path)
+        """Where the embeddings of the messages are stored, keyed by the order they were stored in."""
+
+        self.path = path
+        """Where the messages are stored. `None` means they're only kept in memory."""
+
+        self.top_k = top_k
+        """The maximum number of earlier messages recalled per request."""
+
+        self.min_score = min_score
+        """How similar (cosine) a message has to be to the prompt to be recalled. `None` means no limit."""
+
+        self.recent = recent
+        """How many of the latest messages of the history are always sent."""
+
+        self.background = background
+        """Whether turns are stored in the background or on the request path."""
+
+        self.__messages: Dict[int, Dict[str, str]] = self.__load()
+        self.__next_key = max(max(self.__messages, default=-1) + 1, len(self.index))
+        self.__file: Optional[TextIO] = None
+        self.__pending: List[ChatMessage] = []
+        self.__lock = Lock()
+        self.__task: Optional[Task] = None
+
+        generator.retriever = self
+
+    @property
+    def pending(self) -> int:
+        """
+        Returns the number of messages which haven't been stored yet.
+        """
+
+        return len(self.__pending)
+
+    async def recall(self, query: str) -> List[ChatMessage]:
+        """
+        Returns the stored messages most similar to `query`, oldest first.
+        """
+
+        # Everything stored is sent anyway while the conversation is shorter than the recent messages.
+        if len(self.__messages) <= self.recent or self.top_k <= 0:
+            return []
+
+        try:
+            vector = await self.embeddings.embed(query)
+        except Exception:
+            return []
+
+        results = self.index.search(vector, self.top_k, self.min_score)
+        keys = sorted(key for key, _ in results if key in self.__messages)
+
+        return [ChatMessage.from_json(self.__messages[key]) for key in keys]
+
+    def to_ollama_payload(self, history: ChatHistory, recalled: List[ChatMessage]) -> List[Dict[str, str]]:
+        """
+        Returns the messages of `history` to send: the pinned message and summary, the `recalled` messages and the recent messages.
+        """
+
+        payload = history.to_ollama_payload()
+        head = len(payload) - (len(history) - (1 if history.pinned else 0))
+        window = payload[head:][-self.recent:] if self.recent > 0 else []
+
+        # Roles may be either `ChatRole`s or plain strings, which don't hash the same.
+        sent = {(str(message["role"]), message["content"]) for message in window}
+        injected = [message.to_json() for message in recalled if (str(message.role), message.content) not in sent]
+
+        return payload[:head] + injected + window
+
+    async def after_turn(self, messages: List[ChatMessage]) -> None:
+        """
+        Called by the generator once a turn is over with its messages. Waits for them to be stored unless running in the background.
+        The turn is already in the history by then, so a failed store is only traced and the messages are retried by the next turn.
+        """
+
+        self.__pending.extend(message for message in messages if message.content.strip())
+
+        if not self.background:
+            await self.__try_store(flush=True)
+            return
+
+        try:
+            get_running_loop()
+        except RuntimeError:
+            # Called outside of an event loop, the messages will be stored on the next flush.
+            return
+
+        if self.__task is None or self.__task.done():
+            self.__task = ensure_future(self.__try_store())
+
+    async def flush(self) -> None:
+        """
+        Stores every pending message, including the ones a background task is already working on, and writes the index to disk.
+        """
+
+        if self.__task and not self.__task.done():
+            await shield(self.__task)
+
+        await self.__store()
+        self.index.flush()
+
+    async def close(self) -> None:
+        """
+        Flushes the pending messages and closes the messages file.
+        """
+
+        await self.flush()
+
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def __load(self) -> Dict[int, Dict[str, str]]:
+        messages: Dict[int, Dict[str, str]] = {}
+
+        if not self.path or not os.path.exists(self.__messages_path):
+            return messages
+
+        with open(self.__messages_path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                    messages[record.pop("key")] = record
+                except (ValueError, KeyError):
+                    # A line left incomplete by a crash, which the next message continues on a line of its own.
+                    pass
+
+        return messages
+
+    @property
+    def __messages_path(self) -> str:
+        return f"{self.path}.messages.jsonl"
+
+    async def __try_store(self, flush: bool = False) -> None:
+        with self.generator.metrics.trace("chat.remember", model=self.generator.model.name) as trace:
+            trace.count("messages", len(self.__pending))
+
+            try:
+                await self.__store()
+
+                if flush:
+                    self.index.flush()
+            except Exception as e:
+                # The messages are kept pending, so the next turn retries them.
+                trace.finish(e)
+
+    async def __store(self) -> None:
+        async with self.__lock:
+            while self.__pending:
+                messages, self.__pending = self.__pending, []
+
+                try:
+                    vectors = await self.embeddings.embed_many([message.content for message in messages])
+                except BaseException:
+                    self.__pending = messages + self.__pending
+                    raise
+
+                # Keys are never reused, so a vector whose message was lost in a crash can't be mistaken for a newer message.
+                keys = list(range(self.__next_key, self.__next_key + len(messages)))
+                self.__next_key += len(messages)
+
+                for key, message in zip(keys, messages):
+                    self.__messages[key] = {"role": str(message.role), "content": message.content}
+
+                self.index.add(keys, vectors)
+                self.__write(keys)
+
+    def __write(self, keys: List[int]) -> None:
+        if not self.path:
+            return
+
+        if self.__file is None:
+            self.__file = open(self.__messages_path, "a+", encoding="utf-8")
+
+            # A crash may have left the last line incomplete, which must not be continued by the next message.
+            if self.__file.tell() > 0:
+                self.__file.seek(self.__file.tell() - 1)
+
+                if self.__file.read(1) != "\n":
+                    self.__file.write("\n")
+
+        self.__file.write("".join(json.dumps({"key": key, **self.__messages[key]}, ensure_ascii=False) + "\n" for key in keys))
+        self.__file.flush()
+
+    def __len__(self) -> int:
+        return len(self.__messages)
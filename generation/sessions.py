@@ -0,0 +1,283 @@
+from asyncio import to_thread
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from time import monotonic
+from typing import AsyncIterator, Callable, Dict, Optional
+import json
+import zlib
+from .types.structs import ChatHistory
+from .constants.llm_constants import SESSION_MAX_IN_MEMORY, SESSION_MAX_BYTES, SESSION_IDLE_TIMEOUT
+from ..utils.singleflight import SingleFlight
+from ..utils.store import SqliteStore
+
+class _Session:
+    def __init__(self, history: ChatHistory) -> None:
+        self.history = history
+        self.last_access = monotonic()
+        self.size = 0
+        self.leases = 0
+
+class SessionManager:
+    """
+    Holds the `ChatHistory` of many independent conversations, keyed by conversation ID.
+
+    Recently used conversations are kept in memory. When there are more than `max_sessions` of them,
+    they take up more than approximately `max_bytes`, or one hasn't been used for `idle_timeout` seconds,
+    the least recently used ones are spilled to `store` (if provided, otherwise they are dropped)
+    and are transparently loaded back the next time they're requested.
+
+    Histories are only persisted when they are spilled or `save()`/`close()` is called,
+    so a history shouldn't be held on to after it could have been spilled.
+    Conversations used through `lease()` are never spilled (except by `close()`) until the `async with` block exits.
+
+    New conversations are created by `factory`, like `ChatGenerator.new_history()` to start them with the system prompt
+    and limit them to the model's context.
+
+    Usage:
+    ```
+    sessions = SessionManager(SqliteStore("sessions.db"), factory=generator.new_history)
+
+    async with sessions.lease(str(channel.id)) as history:
+        generator.replace_history(history)
+        await generator.generate(_input)
+    ```
+    """
+
+    def __init__(
+            self,
+            store: Optional[SqliteStore] = None,
+            max_sessions: int = SESSION_MAX_IN_MEMORY,
+            max_bytes: Optional[int] = SESSION_MAX_BYTES,
+            idle_timeout: Optional[float] = SESSION_IDLE_TIMEOUT,
+            factory: Callable[[], ChatHistory] = ChatHistory,
+    ) -> None:
+        self.store = store
+        """Where spilled conversations are persisted."""
+
+        self.max_sessions = max_sessions
+        """How many conversations may be kept in memory."""
+
+        self.max_bytes = max_bytes
+        """Approximately how much memory the conversations kept in memory may take up. `None` means no limit."""
+
+        self.idle_timeout = idle_timeout
+        """How long (in seconds) an unused conversation is kept in memory. `None` means forever."""
+
+        self.factory = factory
+        """Creates the history of new conversations."""
+
+        self.__sessions: OrderedDict[str, _Session] = OrderedDict()
+        self.__spilling: Dict[str, ChatHistory] = {}
+        self.__loads = SingleFlight[ChatHistory]()
+        self.__size = 0
+        self.__last_id: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        """
+        Returns approximately how much memory the conversations kept in memory take up, as of their last access.
+        """
+
+        return self.__size
+
+    async def get(self, conversation_id: str) -> ChatHistory:
+        """
+        Returns the history of the conversation, loading it from the store or creating a new one if needed.
+        """
+
+        session = await self.__acquire(conversation_id)
+        self.__release(conversation_id, session)
+
+        return session.history
+
+    @asynccontextmanager
+    async def lease(self, conversation_id: str) -> AsyncIterator[ChatHistory]:
+        """
+        Returns the history of the conversation like `get()`, and keeps it in memory for the duration of the `async with` block,
+        so conversations requested meanwhile can't spill it while it's being used.
+        """
+
+        session = await self.__acquire(conversation_id)
+
+        try:
+            yield session.history
+        finally:
+            self.__release(conversation_id, session)
+
+    async def save(self, conversation_id: Optional[str] = None) -> None:
+        """
+        Persists the conversation (or every conversation in memory if no ID is provided) without evicting it.
+        """
+
+        if self.store is None:
+            return
+
+        ids = [conversation_id] if conversation_id else list(self.__sessions.keys())
+
+        for _id in ids:
+            session = self.__sessions.get(_id)
+
+            if session:
+                await to_thread(self.store.set, _id, self.__serialize(session.history))
+
+    async def discard(self, conversation_id: str) -> None:
+        """
+        Forgets the conversation, both in memory and in the store.
+        """
+
+        session = self.__sessions.pop(conversation_id, None)
+
+        if session:
+            self.__size -= session.size
+
+        if self.store:
+            await to_thread(self.store.delete, conversation_id)
+
+    async def evict_idle(self) -> int:
+        """
+        Spills every conversation that has been idle for too long and returns how many were spilled.
+        Is also called on every `get()`.
+        """
+
+        if self.idle_timeout is None:
+            return 0
+
+        evicted = 0
+        deadline = monotonic() - self.idle_timeout
+        expired = []
+
+        for conversation_id, session in self.__sessions.items():
+            if session.last_access > deadline:
+                break
+
+            if not session.leases:
+                expired.append(conversation_id)
+
+        for conversation_id in expired:
+            if await self.__spill_unleased(conversation_id):
+                evicted += 1
+
+        return evicted
+
+    async def close(self) -> None:
+        """
+        Spills every conversation kept in memory.
+        """
+
+        while self.__sessions:
+            await self.__spill(next(iter(self.__sessions)))
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self.__sessions
+
+    def __len__(self) -> int:
+        return len(self.__sessions)
+
+    async def __acquire(self, conversation_id: str) -> _Session:
+        session = self.__sessions.get(conversation_id)
+
+        if session is None:
+            history = await self.__loads.do(conversation_id, lambda: self.__load(conversation_id))
+            session = self.__sessions.get(conversation_id)
+
+            if session is None:
+                session = self.__sessions[conversation_id] = _Session(history)
+        else:
+            self.__sessions.move_to_end(conversation_id)
+
+        session.last_access = monotonic()
+
+        # Histories change after they're handed out, so the previously used one is measured again as well.
+        if self.__last_id in self.__sessions:
+            self.__measure(self.__sessions[self.__last_id])
+
+        self.__measure(session)
+        self.__last_id = conversation_id
+
+        # Leased before enforcing the limits, so a concurrent `get()` can't spill it while this one is waiting for a spill.
+        session.leases += 1
+
+        try:
+            await self.__enforce_limits()
+        except BaseException:
+            self.__release(conversation_id, session)
+            raise
+
+        return session
+
+    def __release(self, conversation_id: str, session: _Session) -> None:
+        session.leases -= 1
+        session.last_access = monotonic()
+
+        # Kept in order of last access, so the idle ones are always at the front.
+        if self.__sessions.get(conversation_id) is session:
+            self.__sessions.move_to_end(conversation_id)
+
+    async def __enforce_limits(self) -> None:
+        await self.evict_idle()
+
+        excess_sessions = len(self.__sessions) - self.max_sessions
+        excess_bytes = self.__size - self.max_bytes if self.max_bytes is not None else 0
+        victims = []
+
+        for conversation_id, session in self.__sessions.items():
+            if excess_sessions <= 0 and excess_bytes <= 0:
+                break
+
+            if not session.leases:
+                victims.append(conversation_id)
+                excess_sessions -= 1
+                excess_bytes -= session.size
+
+        for conversation_id in victims:
+            await self.__spill_unleased(conversation_id)
+
+    async def __spill_unleased(self, conversation_id: str) -> bool:
+        # Leases may have been taken while the previous conversations were being spilled.
+        session = self.__sessions.get(conversation_id)
+
+        if session is None or session.leases:
+            return False
+
+        await self.__spill(conversation_id)
+        return True
+
+    async def __spill(self, conversation_id: str) -> None:
+        session = self.__sessions.pop(conversation_id)
+        self.__size -= session.size
+
+        if self.store is None:
+            return
+
+        # Until the write finishes, the history is served from here so a concurrent `get()` doesn't load a stale copy.
+        self.__spilling[conversation_id] = session.history
+
+        try:
+            await to_thread(self.store.set, conversation_id, self.__serialize(session.history))
+        finally:
+            if self.__spilling.get(conversation_id) is session.history:
+                del self.__spilling[conversation_id]
+
+    async def __load(self, conversation_id: str) -> ChatHistory:
+        if conversation_id in self.__spilling:
+            return self.__spilling[conversation_id]
+
+        blob = await to_thread(self.store.get, conversation_id) if self.store else None
+
+        if blob is None:
+            return self.factory()
+
+        return ChatHistory.from_dict(json.loads(zlib.decompress(blob)))
+
+    def __measure(self, session: _Session) -> None:
+        size = len(session.history.summary or "")
+
+        for message in session.history.items:
+            size += len(message.content) + sum(len(image) for image in message.images or [])
+
+        self.__size += size - session.size
+        session.size = size
+
+    @staticmethod
+    def __serialize(history: ChatHistory) -> bytes:
+        return zlib.compress(json.dumps(history.to_dict(), separators=(",", ":")).encode("utf-8"))
@@ -0,0 +1,168 @@
+from asyncio import Lock, Task, ensure_future, get_running_loop, shield
+from typing import List, Optional
+from .chat import ChatGenerator
+from .types.structs import ChatHistory, ChatMessage
+from .constants.llm_constants import SUMMARY_MAX_TOKENS, SUMMARY_MAX_PENDING
+
+class RollingSummarizer:
+    """
+    Keeps a running summary of the part of a conversation that no longer fits the history.
+
+    Whenever the generator's `ChatHistory` evicts messages, they are queued and later folded into `ChatHistory.summary`,
+    which is sent to the LLM as a compact system message. Only the previous summary and the newly evicted messages are
+    sent to the LLM, so the cost of a fold doesn't grow with the length of the conversation.
+
+    In `background` mode, folds run as separate tasks and generation calls don't wait for them.
+    Otherwise, generation calls that caused an eviction only return once the summary has been updated.
+    Folds are traced as `"chat.summarize"` through the generator's `metrics`. A failed one leaves its messages
+    pending for the next fold, but no more than `max_pending` of them are kept: the oldest are dropped (and counted as `"dropped"`).
+    """
+
+    def __init__(
+            self,
+            generator: ChatGenerator,
+            background: bool = True,
+            assistant_name: str = "Assistant",
+            max_tokens: int = SUMMARY_MAX_TOKENS,
+            max_pending: int = SUMMARY_MAX_PENDING,
+    ) -> None:
+        self.generator = generator
+        """The generator whose history is summarized. It's also used to generate the summaries."""
+
+        self.background = background
+        """Whether folds run in the background or on the request path."""
+
+        self.assistant_name = assistant_name
+        """How the assistant is referred to in the summary."""
+
+        self.max_tokens = max_tokens
+        """The maximum length of the summary in tokens."""
+
+        self.max_pending = max_pending
+        """How many evicted messages may wait to be folded before the oldest ones are dropped."""
+
+        self.__history: Optional[ChatHistory] = None
+        self.__pending: List[ChatMessage] = []
+        self.__lock = Lock()
+        self.__task: Optional[Task] = None
+        self.__dropped = 0
+
+        generator.summarizer = self
+        self.attach(generator.history)
+
+    @property
+    def pending(self) -> int:
+        """
+        Returns the number of evicted messages which haven't been folded into the summary yet.
+        """
+
+        return len(self.__pending)
+
+    def attach(self, history: ChatHistory) -> None:
+        """
+        Starts following `history` instead of the previously attached one. Messages still pending are dropped.
+        """
+
+        if self.__history is not None and self.__history.on_evict == self.__on_evict:
+            self.__history.on_evict = None
+
+        self.__history = history
+        self.__pending = []
+        history.on_evict = self.__on_evict
+
+    async def after_turn(self) -> None:
+        """
+        Called by the generator once a turn is over. Waits for the pending messages to be folded unless running in the background.
+        The turn is already in the history by then, so a failed fold is only traced and the messages are retried by the next turn.
+        """
+
+        if not self.background and self.__pending:
+            await self.__try_fold()
+
+    async def flush(self) -> None:
+        """
+        Folds every pending message into the summary, including the ones a background fold is already working on.
+        """
+
+        if self.__task and not self.__task.done():
+            await shield(self.__task)
+
+        await self.__fold()
+
+    async def summarize(self, summary: Optional[str], messages: List[ChatMessage]) -> str:
+        """
+        Returns `summary` updated with the content of `messages`.
+        """
+
+        messages_as_string = "\n".join([f"{message.role}: {message.content}" for message in messages])
+
+        # The instructions are the same for every fold, so their context is reused (see `ChatGenerator.complete()`).
+        instructions = f"""
+        You are maintaining a running summary of a conversation between {self.assistant_name} and other people.
+        Update the summary with the new messages. Keep every detail that matters for continuing the conversation
+        (names, relationships, facts, open questions) and drop small talk. Only reply with the updated summary.
+        """
+
+        prompt = f"""
+        The current summary:
+        {summary if summary else "(The conversation just started, there is no summary yet.)"}
+
+        The new messages:
+        {messages_as_string}
+        """
+
+        output = await self.generator.complete(prompt, {"num_predict": self.max_tokens}, prefix=instructions)
+        return output.data.strip()
+
+    def __on_evict(self, messages: List[ChatMessage]) -> None:
+        self.__pending.extend(messages)
+        self.__cap_pending()
+
+        if not self.background:
+            return
+
+        try:
+            get_running_loop()
+        except RuntimeError:
+            # Pushed outside of an event loop, the messages will be folded on the next flush.
+            return
+
+        if self.__task is None or self.__task.done():
+            self.__task = ensure_future(self.__try_fold())
+
+    async def __try_fold(self) -> None:
+        with self.generator.metrics.trace("chat.summarize", model=self.generator.model.name) as trace:
+            trace.count("messages", len(self.__pending))
+            trace.count("dropped", self.__dropped)
+            self.__dropped = 0
+
+            try:
+                await self.__fold()
+            except Exception as e:
+                # The messages are kept pending, so the next fold retries them.
+                trace.finish(e)
+
+    async def __fold(self) -> None:
+        async with self.__lock:
+            while self.__pending:
+                history = self.__history
+                messages, self.__pending = self.__pending, []
+
+                try:
+                    summary = await self.summarize(history.summary, messages)
+                except BaseException:
+                    if history is self.__history:
+                        self.__pending = messages + self.__pending
+                        self.__cap_pending()
+
+                    raise
+
+                if history is self.__history:
+                    history.summary = summary
+
+    def __cap_pending(self) -> None:
+        excess = len(self.__pending) - self.max_pending
+
+        if excess > 0:
+            del self.__pending[:excess]
+            self.__dropped += excess
@@ -12,7 +12,7 @@ class GeneratorContract(ABC):
         Generates an applicable resource and
         returns it wrapped in a `GenerationOutput` object.
 
-        May raise a `ServiceBusyException` depending on the implemntation.
+        May raise a `ServiceBusyException` (e.g. when the queue is full or the call timed out waiting in it) depending on the implemntation.
         """
         
         pass
\ No newline at end of file
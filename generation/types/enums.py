@@ -28,4 +28,89 @@ class ChatRole(str, Enum):
     SYSTEM = "system"
 
     def __str__(self) -> str:
-        return self.value
\ No newline at end of file
+        return self.value
+
+class StreamCancelPolicy(str, Enum):
+    """
+    Defines what happens to the conversation history when a streamed chat response doesn't complete
+    (the consumer stops iterating, the task is cancelled or the API returns an error).
+    """
+
+    DISCARD = "discard"
+    """Neither the prompt nor the partial response is added to the history."""
+
+    KEEP_PROMPT = "keep_prompt"
+    """Only the user's prompt is added to the history."""
+
+    KEEP_PARTIAL = "keep_partial"
+    """Both the prompt and the partial response received so far are added to the history."""
+
+    def __str__(self) -> str:
+        return self.value
+
+class ImageFormat(str, Enum):
+    """
+    Holds the image formats generated images can be re-encoded to.
+    """
+
+    PNG = "PNG"
+    JPEG = "JPEG"
+    WEBP = "WEBP"
+
+    def __str__(self) -> str:
+        return self.value
+
+class PriorityClass(int, Enum):
+    """
+    Holds common priorities of generation requests (see `GenerationInput.priority`).
+    Any other integer can be used as well, higher values are served first.
+    """
+
+    BATCH = -10
+    """Background work which only uses capacity nobody else needs."""
+
+    NORMAL = 0
+    """The default priority."""
+
+    INTERACTIVE = 10
+    """Requests someone is actively waiting for."""
+
+    def __str__(self) -> str:
+        return self.name.lower()
+
+class ModelCapability(str, Enum):
+    """
+    Holds the capabilities models can be looked up by (see `ModelRegistry.find_by_capability()`).
+    """
+
+    MULTIMODAL = "multimodal"
+    """The model can take image input."""
+
+    NSFW = "nsfw"
+    """The model doesn't refuse to generate NSFW content."""
+
+    REFINER = "refiner"
+    """The model uses a refiner."""
+
+    def __str__(self) -> str:
+        return self.value
+
+class Degradation(str, Enum):
+    """
+    Holds the ways a `DegradationPolicy` can make an image generation cheaper when the service is under pressure.
+    """
+
+    NO_REFINER = "no_refiner"
+    """The refiner is skipped."""
+
+    REDUCED_STEPS = "reduced_steps"
+    """Fewer sampling steps are used."""
+
+    SMALLER_DIMENSIONS = "smaller_dimensions"
+    """A smaller image is rendered."""
+
+    FALLBACK_MODEL = "fallback_model"
+    """A faster (lightning class) model is used instead."""
+
+    def __str__(self) -> str:
+        return self.value
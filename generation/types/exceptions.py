@@ -1,10 +1,5 @@
-class ServiceBusyException(Exception):
-    """
-    Should be thrown by async services that are limited to certain number of parallel processes.
-    """
-
-    def __init__(self) -> None:
-        super().__init__("The service is already handling another call.")
+from ...utils.service import ServiceBusyException, QueueFullException, QueueTimeoutException, RateLimitExceededException
+from ...utils.resilience import CircuitOpenException, DeadlineExceededException
 
 class GenerationAPIException(Exception):
     """
@@ -12,4 +7,32 @@ class GenerationAPIException(Exception):
     """
 
     def __init__(self, hint: str) -> None:
-        super().__init__(f"The generator ran into an issue outside of it's control. It's likely that this was caused by a programming error on your end. Hint: \"{hint}\"")
\ No newline at end of file
+        super().__init__(f"The generator ran into an issue outside of it's control. It's likely that this was caused by a programming error on your end. Hint: \"{hint}\"")
+
+class ModelUnavailableException(GenerationAPIException):
+    """
+    Should be thrown when a model (or a sampler it uses) isn't available on any of the servers, before the call is queued (see `BackendCatalog`).
+    """
+
+class MissingDependencyException(Exception):
+    """
+    Should be thrown when an optional feature is used without its optional dependency being installed.
+    """
+
+    def __init__(self, package: str, feature: str) -> None:
+        super().__init__(f"{feature} requires the optional \"{package}\" package. Install it with \"pip install {package}\".")
+
+class LoadSheddingException(ServiceBusyException):
+    """
+    Should be thrown when a call is rejected up front because it wouldn't complete within the latency objective,
+    not even with every degradation applied (see `DegradationPolicy`).
+    """
+
+    def __init__(self, expected: float, objective: float) -> None:
+        super().__init__(f"The call can't be handled at this time because it would take about {expected:.1f} seconds, which exceeds the objective of {objective:.1f} seconds.")
+
+        self.expected = expected
+        """How long (in seconds) the call was expected to take, waiting in line included."""
+
+        self.objective = objective
+        """How long (in seconds) the call was allowed to take."""
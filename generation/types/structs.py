@@ -1,11 +1,16 @@
 from dataclasses import dataclass, field
-from typing import List, Optional, Union, Dict, Generic, TypeVar
+from typing import TYPE_CHECKING, Any, Callable, Deque, List, Optional, Set, Tuple, Union, Dict, Generic, TypeVar
 from datetime import timedelta
+from collections import deque
+from copy import copy
 
-from ...generation.constants.llm_constants import get_system_prompt
+from ...generation.constants.llm_constants import get_system_prompt, RESPONSE_TOKEN_RESERVE
 from ..constants import img_constants
-from .enums import ImageSampler, ChatRole
-from ...utils.stack import Stack
+from .enums import ImageSampler, ChatRole, ImageFormat, ModelCapability
+from ..helpers.token_helpers import estimate_tokens
+
+if TYPE_CHECKING:
+    from ...utils.codec import PayloadTemplate
 
 T = TypeVar("T")
 
@@ -33,6 +38,9 @@ class GenerationOutput(Generic[T]):
     duration: Optional[timedelta] = None
     """The duration of the generation."""
 
+    load_duration: Optional[timedelta] = None
+    """The part of `duration` spent loading the model into memory, if known."""
+
 @dataclass(init=True, repr=True, frozen=True)
 class GenerationInput:
     """
@@ -51,6 +59,15 @@ class GenerationInput:
     image: Optional[str] = None
     """Optional base64 encoded image data that models that support image input can use."""
 
+    priority: int = 0
+    """The priority of the request when it has to wait for the service. Higher values are served first (see `PriorityClass`)."""
+
+    tenant: Optional[str] = None
+    """The user (or other party) the request is made on behalf of. The service is shared fairly between tenants."""
+
+    timeout: Optional[float] = None
+    """The time budget (in seconds) of the call, including the time spent waiting in line. `None` uses the generator's default."""
+
 @dataclass(init=True, repr=True, frozen=True)
 class ImageSize:
     """
@@ -60,6 +77,32 @@ class ImageSize:
     width: int
     height: int
 
+@dataclass(init=True, repr=True, frozen=True)
+class PostProcessOptions:
+    """
+    Defines how generated images should be post-processed.
+    """
+
+    format: Optional[ImageFormat] = None
+    """The format to re-encode the image to. `None` keeps the image as returned by the API."""
+
+    quality: int = 90
+    """The quality used by lossy formats."""
+
+    thumbnail_size: Optional[ImageSize] = None
+    """If set, a thumbnail fitting these dimensions is generated as well."""
+
+    strip_metadata: bool = False
+    """Whether to remove metadata (such as the generation parameters A1111 embeds) from the image."""
+
+    @property
+    def requires_reencoding(self) -> bool:
+        """
+        Returns `True` if the options can't be applied without decoding the image itself.
+        """
+
+        return self.format is not None or self.thumbnail_size is not None or self.strip_metadata
+
 @dataclass(repr=True)
 class ImageModel:
     """
@@ -82,6 +125,8 @@ class ImageModel:
             seed_mode: str = "Scale Alike",
             refiner_start: float = 0.85,
             user_description: str = "This model is a general-purpose image generation model.",
+            allows_nsfw: bool = True,
+            aliases: Optional[List[str]] = None,
     ) -> None:
         self._id = _id
         """A unique identifier for the model."""
@@ -119,6 +164,93 @@ class ImageModel:
         self.user_description = user_description
         """A user-friendly description of the model."""
 
+        self.allows_nsfw = allows_nsfw
+        """Whether the model is meant to generate NSFW content or not (filtered models aren't)."""
+
+        self.aliases = aliases if aliases else []
+        """Other names the model can be looked up by (see `ModelRegistry`)."""
+
+        self.__payload_template: Optional["PayloadTemplate"] = None
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ImageModel":
+        """
+        Returns a model defined by a JSON object of the constructor's arguments (like an entry of a model config file).
+        `dimensions` may be given as `[width, height]` and `sampler` by its name (like `"Euler a"`).
+        """
+
+        config = dict(config)
+
+        if isinstance(config.get("dimensions"), (list, tuple)):
+            config["dimensions"] = ImageSize(*config["dimensions"])
+        elif isinstance(config.get("dimensions"), dict):
+            config["dimensions"] = ImageSize(**config["dimensions"])
+
+        if "sampler" in config:
+            config["sampler"] = ImageSampler(config["sampler"])
+
+        return cls(**config)
+
+    @property
+    def capabilities(self) -> Set[ModelCapability]:
+        """
+        Returns what the model is capable of.
+        """
+
+        capabilities: Set[ModelCapability] = set()
+
+        if self.allows_nsfw:
+            capabilities.add(ModelCapability.NSFW)
+
+        if self.refiner_model:
+            capabilities.add(ModelCapability.REFINER)
+
+        return capabilities
+
+    def copy(self, **changes: Any) -> "ImageModel":
+        """
+        Returns a copy of the model with the given attributes (like `steps` or `dimensions`) changed.
+        """
+
+        model = copy(self)
+
+        for name, value in changes.items():
+            setattr(model, name, value)
+
+        # The template of the original has its settings baked in.
+        model.__payload_template = None
+        return model
+
+    @property
+    def payload_template(self) -> "PayloadTemplate":
+        """
+        Returns a template which encodes the payloads of the model (see `to_a1_payload()`)
+        with the model's settings (negative prompt, sampler, dimensions, etc.) pre-encoded.
+        """
+
+        if self.__payload_template is None:
+            # Imported here, so the JSON libraries are only loaded by processes that actually send payloads.
+            from ...utils.codec import PayloadTemplate
+
+            static = self.to_a1_payload("")
+            del static["prompt"], static["seed"]
+
+            self.__payload_template = PayloadTemplate(static)
+
+        return self.__payload_template
+
+    def estimate_cost(self) -> float:
+        """
+        Returns how expensive a generation with the model is compared to the reference
+        (512x512 pixels in 20 steps without a refiner), which costs `1.0`.
+        """
+
+        pixels = self.dimensions.width * self.dimensions.height
+        steps = self.steps if self.steps else img_constants.COST_REFERENCE_STEPS
+        cost = steps * pixels / (img_constants.COST_REFERENCE_STEPS * img_constants.COST_REFERENCE_PIXELS)
+
+        return cost * img_constants.REFINER_COST_FACTOR if self.refiner_model else cost
+
     def to_a1_payload(self, prompt: str, __seed: int = __default_seed) -> dict[str, Union[str, int, float]]:
         """
         Returns the model's details in an A1111 compatible JSON object.
@@ -158,18 +290,234 @@ class ChatMessage:
             role=payload["message"]["role"],
             content=payload["message"]["content"].strip()
         )
+
+    @classmethod
+    def from_json(cls, payload: Dict[str, str]):
+        return ChatMessage(
+            role=ChatRole(payload["role"]),
+            content=payload["content"],
+            images=payload.get("images"),
+        )
     
-class ChatHistory(Stack[ChatMessage]):
-    def __init__(self, _n_size: int = 25, _pop_index: int = 1) -> None:
-        super().__init__(_n_size, _pop_index)
+class ChatHistory:
+    """
+    Holds the messages of a conversation, oldest first.
+
+    The history is capped by the number of messages (`_n_size`) and optionally by the approximate number of tokens
+    the messages take up (`token_budget`). When either limit is exceeded, the oldest messages are evicted.
+    The first system message pushed to an empty history (usually the system prompt) is pinned, which means it's never evicted.
+
+    Each message is serialized only once, when it's pushed, so building the payload for a request doesn't re-serialize the whole conversation.
+
+    Optionally, a summary of the earlier (already evicted) part of the conversation can be stored in `summary`,
+    which is sent as a compact system message right after the pinned message. `on_evict` is called with the evicted messages
+    whenever a limit is exceeded, so they can be folded into the summary.
+
+    `_pop_index` is only accepted for compatibility: evicting from index `1` (right after the system prompt) is what pinning does,
+    and no other index is supported.
+    """
+
+    def __init__(self, _n_size: int = 25, _pop_index: int = 1, *, token_budget: Optional[int] = None) -> None:
+        if _pop_index != 1:
+            raise ValueError(f"Messages can only be evicted right after the pinned system prompt (_pop_index=1), not at {_pop_index}.")
+
+        self._n_size = _n_size
+        """The maximum number of messages (including the pinned one) to keep."""
+
+        self.token_budget = token_budget
+        """The maximum approximate number of tokens the messages may take up. `None` means no limit."""
+
+        self.on_evict: Optional[Callable[[List[ChatMessage]], None]] = None
+        """Optional callback which is called with the messages evicted because a limit was exceeded."""
+
+        self.__pinned: Optional[Tuple[ChatMessage, Dict[str, str], int]] = None
+        self.__summary: Optional[Tuple[ChatMessage, Dict[str, str], int]] = None
+        self.__summary_text: Optional[str] = None
+        self.__entries: Deque[Tuple[ChatMessage, Dict[str, str], int]] = deque()
+        self.__tokens = 0
+
+    @property
+    def items(self) -> List[ChatMessage]:
+        """
+        Returns the messages, including the pinned one.
+        """
+
+        messages = [entry[0] for entry in self.__entries]
+        return [self.__pinned[0]] + messages if self.__pinned else messages
+
+    @property
+    def pinned(self) -> Optional[ChatMessage]:
+        """
+        Returns the pinned message, if any.
+        """
+
+        return self.__pinned[0] if self.__pinned else None
+
+    @property
+    def summary(self) -> Optional[str]:
+        """
+        Returns the summary of the earlier part of the conversation, if any.
+        """
+
+        return self.__summary_text
+
+    @summary.setter
+    def summary(self, summary: Optional[str]) -> None:
+        self.__summary_text = summary if summary else None
+        self.__summary = self.__make_entry(ChatMessage(
+            role=ChatRole.SYSTEM,
+            content=f"Summary of the earlier conversation:\n{summary}",
+        )) if summary else None
+        self.__evict()
+
+    @property
+    def tokens(self) -> int:
+        """
+        Returns the approximate number of tokens the messages (and the summary) take up.
+        """
+
+        return self.__tokens + (self.__pinned[2] if self.__pinned else 0) + (self.__summary[2] if self.__summary else 0)
+
+    def pin(self, message: ChatMessage) -> None:
+        """
+        Sets `message` as the pinned message, replacing the previous one.
+        """
+
+        self.__pinned = self.__make_entry(message)
+        self.__evict()
+
+    def push(self, message: ChatMessage) -> None:
+        """
+        Appends `message` to the history, evicting the oldest messages if a limit is exceeded.
+        """
+
+        if self.__pinned is None and not self.__entries and message.role == ChatRole.SYSTEM:
+            self.pin(message)
+            return
+
+        entry = self.__make_entry(message)
+        self.__entries.append(entry)
+        self.__tokens += entry[2]
+        self.__evict()
+
+    def pop(self, _index: Optional[int] = None) -> ChatMessage:
+        """
+        Removes and returns the message at `_index` (counting the pinned message).
+        By default, the oldest message that isn't pinned is removed.
+        """
+
+        if _index is None:
+            entry = self.__entries.popleft()
+        else:
+            _index = _index if _index >= 0 else len(self) + _index
+
+            if self.__pinned and _index == 0:
+                entry, self.__pinned = self.__pinned, None
+                return entry[0]
+
+            offset = 1 if self.__pinned else 0
+            entry = self.__entries[_index - offset]
+            del self.__entries[_index - offset]
+
+        self.__tokens -= entry[2]
+        return entry[0]
+
+    def is_empty(self) -> bool:
+        """
+        Returns `True` if the history is empty and `False` if not.
+        """
+
+        return len(self) == 0
+
+    def pop_all(self) -> None:
+        """
+        Removes all messages, including the pinned one.
+        """
+
+        self.__pinned = None
+        self.__summary = None
+        self.__summary_text = None
+        self.__entries.clear()
+        self.__tokens = 0
+
+    def get_first(self) -> Optional[ChatMessage]:
+        """
+        Returns the first message, or `None` if the history is empty.
+        """
+
+        if self.__pinned:
+            return self.__pinned[0]
+
+        return self.__entries[0][0] if self.__entries else None
+
+    def get_last(self) -> Optional[ChatMessage]:
+        """
+        Returns the last message, or `None` if the history is empty.
+        """
+
+        if self.__entries:
+            return self.__entries[-1][0]
+
+        return self.__pinned[0] if self.__pinned else None
 
     def to_ollama_payload(self) -> List[Dict[str, str]]:
         """
         Returns a list of `ChatMessage` objects serialized to JSON.
         """
 
-        return [msg.to_json() for msg in self.items]
-    
+        head = [entry[1] for entry in (self.__pinned, self.__summary) if entry]
+        return head + [entry[1] for entry in self.__entries]
+
+    def to_dict(self) -> Dict:
+        """
+        Returns the history (including its limits and summary) as a JSON serializable dict.
+        """
+
+        return {
+            "n_size": self._n_size,
+            "token_budget": self.token_budget,
+            "summary": self.summary,
+            "pinned": self.__pinned[1] if self.__pinned else None,
+            "messages": [entry[1] for entry in self.__entries],
+        }
+
+    @classmethod
+    def from_dict(cls, payload: Dict) -> "ChatHistory":
+        """
+        Restores a history serialized with `to_dict()`.
+        """
+
+        history = cls(payload["n_size"], token_budget=payload["token_budget"])
+
+        if payload["pinned"]:
+            history.pin(ChatMessage.from_json(payload["pinned"]))
+
+        history.summary = payload["summary"]
+
+        for message in payload["messages"]:
+            history.push(ChatMessage.from_json(message))
+
+        return history
+
+    def __len__(self) -> int:
+        return len(self.__entries) + (1 if self.__pinned else 0)
+
+    def __evict(self) -> None:
+        evicted: List[ChatMessage] = []
+
+        # The newest message is always kept, even if it doesn't fit the budget on its own.
+        while len(self.__entries) > 1 and (len(self) > self._n_size or (self.token_budget is not None and self.tokens > self.token_budget)):
+            entry = self.__entries.popleft()
+            self.__tokens -= entry[2]
+            evicted.append(entry[0])
+
+        if evicted and self.on_evict:
+            self.on_evict(evicted)
+
+    @staticmethod
+    def __make_entry(message: ChatMessage) -> Tuple[ChatMessage, Dict[str, str], int]:
+        return (message, message.to_json(), estimate_tokens(message.content, len(message.images) if message.images else 0))
+
 @dataclass(repr=True)
 class ChatModel:
     """
@@ -181,8 +529,13 @@ class ChatModel:
             _id: str,
             name: str,
             is_multimodal: bool = False,
-            system_prompt: str = get_system_prompt(),
+            system_prompt: Optional[str] = None,
             allows_nsfw: bool = True,
+            context_size: int = 2048,
+            keep_alive: Optional[Union[str, int]] = None,
+            aliases: Optional[List[str]] = None,
+            cache_responses: bool = True,
+            image_resolution: Optional[int] = None,
     ) -> None:
         self._id = _id
         """A unique identifier for the model."""
@@ -193,8 +546,67 @@ class ChatModel:
         self.is_multimodal = is_multimodal
         """Whether the model is multimodal or not. Multimodal models can take image input."""
 
-        self.system_prompt = system_prompt
-        """The default system prompt for the model. Usually meant to be overridden."""
+        self.__system_prompt = system_prompt
 
         self.allows_nsfw = allows_nsfw
-        """Whether the model will refuse to generate NSFW content or not."""
\ No newline at end of file
+        """Whether the model will refuse to generate NSFW content or not."""
+
+        self.context_size = context_size
+        """The size of the context window (in tokens) requested from Ollama."""
+
+        self.keep_alive = keep_alive
+        """How long Ollama should keep the model loaded after a request (like `"30m"`, or `-1` for forever). `None` means Ollama's default."""
+
+        self.aliases = aliases if aliases else []
+        """Other names the model can be looked up by (see `ModelRegistry`)."""
+
+        self.cache_responses = cache_responses
+        """Whether responses of the model may be served from a `ResponseCache`. Models expected to answer differently every time should opt out."""
+
+        self.image_resolution = image_resolution
+        """The largest width or height (in pixels) the model looks at images in. Larger images are downscaled to it before they're sent (see `AttachmentStore`). `None` means they're sent as they are."""
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "ChatModel":
+        """
+        Returns a model defined by a JSON object of the constructor's arguments (like an entry of a model config file).
+        """
+
+        return cls(**config)
+
+    @property
+    def system_prompt(self) -> str:
+        """
+        Returns the default system prompt for the model. Usually meant to be overridden.
+        Unless one was given, it's built when first needed (see `get_system_prompt()`), so it always has the current date.
+        """
+
+        return self.__system_prompt if self.__system_prompt is not None else get_system_prompt()
+
+    @system_prompt.setter
+    def system_prompt(self, value: Optional[str]) -> None:
+        self.__system_prompt = value
+
+    @property
+    def capabilities(self) -> Set[ModelCapability]:
+        """
+        Returns what the model is capable of.
+        """
+
+        capabilities: Set[ModelCapability] = set()
+
+        if self.is_multimodal:
+            capabilities.add(ModelCapability.MULTIMODAL)
+
+        if self.allows_nsfw:
+            capabilities.add(ModelCapability.NSFW)
+
+        return capabilities
+
+    @property
+    def token_budget(self) -> int:
+        """
+        Returns how many tokens of the context window the conversation history may take up.
+        """
+
+        return max(self.context_size - RESPONSE_TOKEN_RESERVE, 0)
\ No newline at end of file
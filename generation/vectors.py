@@ -0,0 +1,247 @@
+from abc import ABC, abstractmethod
+from typing import Collection, Iterable, List, Optional, Sequence, Tuple
+import os
+from .types.exceptions import MissingDependencyException
+from .constants.llm_constants import VECTOR_INDEX_CAPACITY
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import hnswlib
+except ImportError:
+    hnswlib = None
+
+class VectorIndex(ABC):
+    """
+    Stores embedding vectors under non-negative integer keys and finds the ones most similar to a query (by cosine similarity).
+    """
+
+    @abstractmethod
+    def add(self, keys: Sequence[int], vectors: Sequence[Sequence[float]]) -> None:
+        """
+        Stores `vectors` under the corresponding `keys`.
+        """
+
+        pass
+
+    @abstractmethod
+    def search(self, vector: Sequence[float], k: int, min_score: Optional[float] = None, exclude: Collection[int] = ()) -> List[Tuple[int, float]]:
+        """
+        Returns the keys and similarities of the (at most) `k` vectors most similar to `vector`, most similar first.
+        Vectors less similar than `min_score` and the keys in `exclude` are left out.
+        """
+
+        pass
+
+    def flush(self) -> None:
+        """
+        Writes the index to disk, if it's backed by a file.
+        """
+
+        pass
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+class FlatVectorIndex(VectorIndex):
+    """
+    Compares the query to every stored vector, using NumPy.
+
+    Vectors are normalized when they're added, so a search is a single matrix-vector product followed by a partial sort,
+    which takes about a millisecond for the thousands of messages of a conversation. The result is always exact.
+
+    If a `path` is given, the vectors and their keys are kept in memory-mapped `.npy` files next to it,
+    so the operating system pages them in as needed and opening the same path again continues where it left off.
+    The number of dimensions is taken from the first vector added (or the existing files) unless provided.
+    """
+
+    def __init__(self, dimensions: Optional[int] = None, path: Optional[str] = None, capacity: int = VECTOR_INDEX_CAPACITY) -> None:
+        if np is None:
+            raise MissingDependencyException("numpy", "Vector indexes")
+
+        self.dimensions = dimensions
+        """The number of dimensions of the vectors."""
+
+        self.path = path
+        """Where the index is stored. `None` means it's only kept in memory."""
+
+        self.__capacity = capacity
+        self.__count = 0
+        self.__vectors: Optional["np.ndarray"] = None
+        self.__keys: Optional["np.ndarray"] = None
+
+        if path and os.path.exists(self.__keys_path):
+            self.__keys = np.load(self.__keys_path, mmap_mode="r+")
+            self.__vectors = np.load(self.__vectors_path, mmap_mode="r+")
+            self.__capacity, self.dimensions = self.__vectors.shape
+
+            # Vectors are stored contiguously, unused slots have a key of -1.
+            unused = np.flatnonzero(self.__keys < 0)
+            self.__count = int(unused[0]) if len(unused) else self.__capacity
+
+    def add(self, keys: Sequence[int], vectors: Sequence[Sequence[float]]) -> None:
+        if not len(keys):
+            return
+
+        matrix = np.asarray(vectors, dtype=np.float32).reshape(len(keys), -1)
+
+        if self.dimensions is None:
+            self.dimensions = matrix.shape[1]
+
+        if matrix.shape[1] != self.dimensions:
+            raise ValueError(f"Expected vectors of {self.dimensions} dimensions but received {matrix.shape[1]}.")
+
+        if min(keys) < 0:
+            raise ValueError("Keys must not be negative.")
+
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix = np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+        self.__reserve(self.__count + len(keys))
+        self.__vectors[self.__count:self.__count + len(keys)] = matrix
+        self.__keys[self.__count:self.__count + len(keys)] = keys
+        self.__count += len(keys)
+
+    def search(self, vector: Sequence[float], k: int, min_score: Optional[float] = None, exclude: Collection[int] = ()) -> List[Tuple[int, float]]:
+        if not self.__count or k <= 0:
+            return []
+
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+
+        if not norm:
+            return []
+
+        scores = self.__vectors[:self.__count] @ (query / norm)
+        candidates = min(k + len(exclude), self.__count)
+
+        # Only the best candidates are sorted.
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        top = top[np.argsort(-scores[top])]
+
+        return _select(((int(self.__keys[i]), float(scores[i])) for i in top), k, min_score, exclude)
+
+    def flush(self) -> None:
+        if self.path and self.__vectors is not None:
+            self.__vectors.flush()
+            self.__keys.flush()
+
+    @property
+    def __keys_path(self) -> str:
+        return f"{self.path}.keys.npy"
+
+    @property
+    def __vectors_path(self) -> str:
+        return f"{self.path}.vectors.npy"
+
+    def __reserve(self, count: int) -> None:
+        if self.__vectors is not None and count <= self.__capacity:
+            return
+
+        capacity = self.__capacity
+
+        while capacity < count:
+            capacity *= 2
+
+        if not self.path:
+            vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            keys = np.full(capacity, -1, dtype=np.int64)
+        else:
+            # Grown into new files, which replace the old ones once they're complete.
+            vectors = np.lib.format.open_memmap(f"{self.__vectors_path}.tmp", mode="w+", dtype=np.float32, shape=(capacity, self.dimensions))
+            keys = np.lib.format.open_memmap(f"{self.__keys_path}.tmp", mode="w+", dtype=np.int64, shape=(capacity,))
+            keys[:] = -1
+
+        if self.__vectors is not None:
+            vectors[:self.__count] = self.__vectors[:self.__count]
+            keys[:self.__count] = self.__keys[:self.__count]
+
+        if self.path:
+            vectors.flush()
+            keys.flush()
+            self.__vectors = self.__keys = None
+            os.replace(f"{self.__vectors_path}.tmp", self.__vectors_path)
+            os.replace(f"{self.__keys_path}.tmp", self.__keys_path)
+            vectors = np.load(self.__vectors_path, mmap_mode="r+")
+            keys = np.load(self.__keys_path, mmap_mode="r+")
+
+        self.__vectors, self.__keys, self.__capacity = vectors, keys, capacity
+
+    def __len__(self) -> int:
+        return self.__count
+
+class HnswVectorIndex(VectorIndex):
+    """
+    Finds similar vectors in a Hierarchical Navigable Small World graph, using the optional hnswlib package.
+
+    Searches take roughly logarithmic time, so they stay fast for millions of vectors, at the cost of
+    occasionally missing one of the most similar vectors. `ef` trades search speed for accuracy.
+    If a `path` is given, the index is loaded from it if it exists, and written to it by `flush()`.
+    """
+
+    def __init__(self, dimensions: int, path: Optional[str] = None, capacity: int = VECTOR_INDEX_CAPACITY, m: int = 16, ef_construction: int = 200, ef: int = 64) -> None:
+        if hnswlib is None:
+            raise MissingDependencyException("hnswlib", "HNSW vector indexes")
+
+        self.dimensions = dimensions
+        """The number of dimensions of the vectors."""
+
+        self.path = path
+        """Where the index is stored. `None` means it's only kept in memory."""
+
+        self.__index = hnswlib.Index(space="cosine", dim=dimensions)
+
+        if path and os.path.exists(path):
+            self.__index.load_index(path)
+        else:
+            self.__index.init_index(max_elements=capacity, ef_construction=ef_construction, M=m)
+
+        self.__index.set_ef(ef)
+
+    def add(self, keys: Sequence[int], vectors: Sequence[Sequence[float]]) -> None:
+        if not len(keys):
+            return
+
+        required = self.__index.get_current_count() + len(keys)
+
+        if required > self.__index.get_max_elements():
+            self.__index.resize_index(max(required, self.__index.get_max_elements() * 2))
+
+        self.__index.add_items(vectors, list(keys))
+
+    def search(self, vector: Sequence[float], k: int, min_score: Optional[float] = None, exclude: Collection[int] = ()) -> List[Tuple[int, float]]:
+        count = self.__index.get_current_count()
+
+        if not count or k <= 0:
+            return []
+
+        labels, distances = self.__index.knn_query([vector], k=min(k + len(exclude), count))
+
+        # The distance of the cosine space is 1 - similarity.
+        return _select(((int(key), 1.0 - float(distance)) for key, distance in zip(labels[0], distances[0])), k, min_score, exclude)
+
+    def flush(self) -> None:
+        if self.path:
+            self.__index.save_index(self.path)
+
+    def __len__(self) -> int:
+        return self.__index.get_current_count()
+
+def _select(results: Iterable[Tuple[int, float]], k: int, min_score: Optional[float], exclude: Collection[int]) -> List[Tuple[int, float]]:
+    selected: List[Tuple[int, float]] = []
+
+    for key, score in results:
+        if min_score is not None and score < min_score:
+            break
+
+        if key not in exclude:
+            selected.append((key, score))
+
+        if len(selected) >= k:
+            break
+
+    return selected
@@ -0,0 +1,250 @@
+from asyncio import Task, TimeoutError, ensure_future, gather, get_running_loop, sleep
+from contextlib import asynccontextmanager
+from enum import Enum
+from time import monotonic
+from typing import AsyncIterator, Collection, List, Optional, Set
+from aiohttp import ClientError, ClientResponseError, ClientTimeout
+from .http import HttpClient, get_default_client
+from .resilience import CircuitBreaker, CircuitOpenException
+
+class RoutingStrategy(str, Enum):
+    """
+    Holds the ways a `BackendPool` can pick a backend for a request.
+    """
+
+    LEAST_OUTSTANDING = "least_outstanding"
+    """Picks the backend handling the fewest requests."""
+
+    MODEL_AFFINITY = "model_affinity"
+    """Prefers backends which already have the requested model loaded, then falls back to the fewest requests."""
+
+    def __str__(self) -> str:
+        return self.value
+
+class Backend:
+    """
+    A single server of a `BackendPool`.
+    """
+
+    def __init__(self, url: str, breaker: Optional[CircuitBreaker] = None) -> None:
+        self.url = url
+        """The base URL of the server."""
+
+        self.breaker = breaker if breaker else CircuitBreaker()
+        """Stops requests from being sent to the server while it keeps failing."""
+
+        self.outstanding = 0
+        """The number of requests currently being handled."""
+
+        self.loaded_models: Set[str] = set()
+        """The models the server is known to have loaded."""
+
+        self.healthy = True
+        """Whether the server is routed to."""
+
+        self.last_checked: Optional[float] = None
+        """When the server's health was last checked (`time.monotonic()`)."""
+
+    def __repr__(self) -> str:
+        return f"Backend(url={self.url!r}, outstanding={self.outstanding}, healthy={self.healthy})"
+
+class BackendPool:
+    """
+    Spreads requests over several servers exposing the same API.
+
+    Every request is routed to a healthy backend according to `strategy`. A backend that fails `max_failures` requests
+    in a row (because it couldn't be reached, timed out or responded with a server error) trips its `CircuitBreaker`
+    and isn't sent any requests for `reset_timeout` seconds, after which a single trial request decides whether
+    it's used again. If every suitable circuit is open, requests fail fast with a `CircuitOpenException`.
+
+    Health checks (a GET request to `health_path`, which has to be answered within `health_timeout` seconds) run
+    every `health_interval` seconds in the background once the pool is first used. Backends failing them are ejected until they pass again, and passing them closes
+    an open circuit. If every backend is ejected, requests are routed to all of them anyway rather than failing outright.
+    """
+
+    def __init__(
+            self,
+            urls: List[str],
+            strategy: RoutingStrategy = RoutingStrategy.MODEL_AFFINITY,
+            exclusive_models: bool = False,
+            health_path: str = "/",
+            health_interval: Optional[float] = 15.0,
+            health_timeout: float = 5.0,
+            max_failures: int = 3,
+            reset_timeout: float = 30.0,
+            client: Optional[HttpClient] = None,
+    ) -> None:
+        self.backends = [Backend(url, CircuitBreaker(max_failures, reset_timeout)) for url in urls]
+        """Every backend of the pool."""
+
+        self.strategy = strategy
+        """How backends are picked."""
+
+        self.exclusive_models = exclusive_models
+        """Whether a server can only have a single model loaded at a time (like A1111)."""
+
+        self.health_path = health_path
+        """The path requested to check whether a backend is healthy."""
+
+        self.health_interval = health_interval
+        """How often (in seconds) backends are checked. `None` disables periodic checks."""
+
+        self.health_timeout = health_timeout
+        """How long (in seconds) a backend has to answer a health check. One that hangs counts as unhealthy."""
+
+        self.client = client if client else get_default_client()
+        """The client used for health checks."""
+
+        self.__health_task: Optional[Task] = None
+
+    @property
+    def key(self) -> str:
+        """
+        Returns a string identifying the set of servers in the pool.
+        """
+
+        return ",".join(backend.url for backend in self.backends)
+
+    @property
+    def healthy(self) -> List[Backend]:
+        """
+        Returns the backends currently routed to.
+        """
+
+        return [backend for backend in self.backends if backend.healthy]
+
+    @property
+    def available(self) -> List[Backend]:
+        """
+        Returns the backends a request could be sent to right now.
+        """
+
+        return [backend for backend in (self.healthy or self.backends) if backend.breaker.available]
+
+    def pick(self, model: Optional[str] = None, exclude: Collection[str] = ()) -> Backend:
+        """
+        Returns the backend the next request for `model` should be sent to, avoiding the backends with the URLs in `exclude` if possible.
+        Raises a `CircuitOpenException` if no backend is available.
+        """
+
+        candidates = self.available
+
+        if not candidates:
+            raise CircuitOpenException()
+
+        candidates = [backend for backend in candidates if backend.url not in exclude] or candidates
+
+        if self.strategy == RoutingStrategy.MODEL_AFFINITY and model:
+            with_model = [backend for backend in candidates if model in backend.loaded_models]
+
+            # Waiting a bit for a server that has the model loaded is still cheaper than loading it somewhere else.
+            if with_model:
+                candidates = with_model
+
+        return min(candidates, key=lambda backend: backend.outstanding)
+
+    @asynccontextmanager
+    async def acquire(self, model: Optional[str] = None, exclude: Collection[str] = ()) -> AsyncIterator[Backend]:
+        """
+        Picks a backend for a request for `model` and tracks the request for the duration of the `async with` block.
+        """
+
+        self.__ensure_health_checks()
+
+        backend = self.pick(model, exclude)
+        backend.breaker.on_request()
+        backend.outstanding += 1
+
+        try:
+            yield backend
+        except ClientResponseError as e:
+            # Client errors (like an unknown model) are the caller's fault, not the backend's.
+            if e.status >= 500:
+                self.record_failure(backend)
+            else:
+                self.record_success(backend)
+
+            raise
+        except (ClientError, TimeoutError, OSError):
+            self.record_failure(backend)
+            raise
+        except BaseException:
+            backend.breaker.release()
+            raise
+        else:
+            self.record_success(backend, model)
+        finally:
+            backend.outstanding -= 1
+
+    def record_success(self, backend: Backend, model: Optional[str] = None) -> None:
+        """
+        Marks a request to `backend` as successful and remembers that it has `model` loaded.
+        """
+
+        backend.breaker.record_success()
+
+        if model:
+            if self.exclusive_models:
+                backend.loaded_models.clear()
+
+            backend.loaded_models.add(model)
+
+    def record_failure(self, backend: Backend) -> None:
+        """
+        Marks a request to `backend` as failed, opening its circuit if it failed too many times in a row.
+        """
+
+        backend.breaker.record_failure()
+
+        if not backend.breaker.available:
+            backend.loaded_models.clear()
+
+    async def check_health(self) -> None:
+        """
+        Checks every backend and ejects or re-admits them accordingly.
+        """
+
+        await gather(*[self.__check(backend) for backend in self.backends])
+
+    def stop_health_checks(self) -> None:
+        """
+        Stops the periodic health checks. They are started again the next time the pool is used.
+        """
+
+        if self.__health_task and not self.__health_task.done():
+            self.__health_task.cancel()
+
+        self.__health_task = None
+
+    def __len__(self) -> int:
+        return len(self.backends)
+
+    async def __check(self, backend: Backend) -> None:
+        try:
+            # The session has no read timeout, so a server that accepts the connection and hangs would stall the whole round.
+            async with self.client.session.get(backend.url + self.health_path, timeout=ClientTimeout(total=self.health_timeout)) as resp:
+                healthy = resp.status < 500
+        except (ClientError, TimeoutError, OSError):
+            healthy = False
+
+        backend.last_checked = monotonic()
+
+        if healthy:
+            backend.healthy = True
+            backend.breaker.record_success()
+        else:
+            backend.healthy = False
+            backend.loaded_models.clear()
+
+    def __ensure_health_checks(self) -> None:
+        if self.health_interval is None or len(self.backends) < 2:
+            return
+
+        # The task dies with its event loop, so it's restarted when the pool is used from a new one.
+        if self.__health_task is None or self.__health_task.done() or self.__health_task.get_loop() is not get_running_loop():
+            self.__health_task = ensure_future(self.__run_health_checks())
+
+    async def __run_health_checks(self) -> None:
+        while True:
+            await sleep(self.health_interval)
+            await self.check_health()
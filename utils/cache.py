@@ -0,0 +1,261 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import RLock
+from time import monotonic, time
+from typing import Callable, Generic, Hashable, Optional, Tuple, TypeVar
+import mmap
+import os
+
+T = TypeVar("T")
+
+@dataclass(repr=True)
+class CacheStats:
+    """
+    Hit/miss statistics of a cache.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    errors: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        Returns the ratio of lookups that were hits.
+        """
+
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+class LRUCache(Generic[T]):
+    """
+    An in-memory least recently used cache limited by the total size of its values.
+
+    The size of each value is measured with `sizeof` (`len` by default).
+    When adding a value would exceed `max_bytes`, the least recently used entries are evicted.
+    Entries older than `ttl` seconds are treated as missing.
+    """
+
+    def __init__(self, max_bytes: int, ttl: Optional[float] = None, sizeof: Callable[[T], int] = len) -> None:
+        self.max_bytes = max_bytes
+        """The total size the values may take up."""
+
+        self.ttl = ttl
+        """How long (in seconds) an entry stays valid. `None` means forever."""
+
+        self.sizeof = sizeof
+        """Returns the size of a value."""
+
+        self.stats = CacheStats()
+        """Hit/miss statistics."""
+
+        self.__entries: OrderedDict[Hashable, Tuple[T, int, float]] = OrderedDict()
+        self.__size = 0
+
+    @property
+    def size(self) -> int:
+        """
+        Returns the total size of the cached values.
+        """
+
+        return self.__size
+
+    def get(self, key: Hashable) -> Optional[T]:
+        """
+        Returns the value stored under `key`, or `None` if it's missing or expired.
+        """
+
+        entry = self.__entries.get(key)
+
+        if entry is None or (self.ttl is not None and monotonic() - entry[2] > self.ttl):
+            if entry is not None:
+                self.delete(key)
+
+            self.stats.misses += 1
+            return None
+
+        self.__entries.move_to_end(key)
+        self.stats.hits += 1
+        return entry[0]
+
+    def set(self, key: Hashable, value: T) -> None:
+        """
+        Stores `value` under `key`. Values larger than `max_bytes` aren't stored.
+        """
+
+        size = self.sizeof(value)
+        self.delete(key)
+
+        if size > self.max_bytes:
+            return
+
+        while self.__entries and self.__size + size > self.max_bytes:
+            _, (_, evicted_size, _) = self.__entries.popitem(last=False)
+            self.__size -= evicted_size
+            self.stats.evictions += 1
+
+        self.__entries[key] = (value, size, monotonic())
+        self.__size += size
+
+    def delete(self, key: Hashable) -> None:
+        """
+        Removes the entry stored under `key`, if any.
+        """
+
+        entry = self.__entries.pop(key, None)
+
+        if entry is not None:
+            self.__size -= entry[1]
+
+    def clear(self) -> None:
+        """
+        Removes every entry.
+        """
+
+        self.__entries.clear()
+        self.__size = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self.__entries
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+class DiskCache:
+    """
+    A least recently used cache which stores raw bytes on disk, one file per key.
+
+    Values are read through a read-only memory map, so a hit doesn't copy the file into memory up front.
+    The returned `memoryview` keeps the mapping open for as long as it's referenced.
+    Keys are used as file names, so they should be safe for that (e.g. hex digests).
+    It's safe to use from multiple threads, so slow writes can be moved off the event loop.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: Optional[float] = None) -> None:
+        self.directory = directory
+        """Where the cached files are stored."""
+
+        self.max_bytes = max_bytes
+        """The total size the cached files may take up."""
+
+        self.ttl = ttl
+        """How long (in seconds) an entry stays valid. `None` means forever."""
+
+        self.stats = CacheStats()
+        """Hit/miss statistics."""
+
+        self.__entries: OrderedDict[str, int] = OrderedDict()
+        self.__size = 0
+        self.__lock = RLock()
+
+        os.makedirs(directory, exist_ok=True)
+        self.__load_index()
+
+    @property
+    def size(self) -> int:
+        """
+        Returns the total size of the cached files.
+        """
+
+        return self.__size
+
+    def get(self, key: str) -> Optional[memoryview]:
+        """
+        Returns a read-only view of the bytes stored under `key`, or `None` if they're missing or expired.
+        """
+
+        with self.__lock:
+            if key not in self.__entries:
+                self.stats.misses += 1
+                return None
+
+            path = self.__path(key)
+
+            try:
+                if self.ttl is not None and time() - os.path.getmtime(path) > self.ttl:
+                    self.delete(key)
+                    self.stats.misses += 1
+                    return None
+
+                with open(path, "rb") as f:
+                    view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+            except (OSError, ValueError):
+                self.__forget(key)
+                self.stats.misses += 1
+                return None
+
+            self.__entries.move_to_end(key)
+            self.stats.hits += 1
+            return view
+
+    def set(self, key: str, data: bytes) -> None:
+        """
+        Stores `data` under `key`. Values larger than `max_bytes` aren't stored.
+        """
+
+        with self.__lock:
+            size = len(data)
+            self.delete(key)
+
+            if size > self.max_bytes or size == 0:
+                return
+
+            while self.__entries and self.__size + size > self.max_bytes:
+                evicted_key = next(iter(self.__entries))
+                self.delete(evicted_key)
+                self.stats.evictions += 1
+
+            path = self.__path(key)
+            temp_path = f"{path}.tmp"
+
+            with open(temp_path, "wb") as f:
+                f.write(data)
+
+            os.replace(temp_path, path)
+            self.__entries[key] = size
+            self.__size += size
+
+    def delete(self, key: str) -> None:
+        """
+        Removes the file stored under `key`, if any.
+        """
+
+        with self.__lock:
+            if key not in self.__entries:
+                return
+
+            try:
+                os.remove(self.__path(key))
+            except OSError:
+                pass
+
+            self.__forget(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.__entries
+
+    def __len__(self) -> int:
+        return len(self.__entries)
+
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def __forget(self, key: str) -> None:
+        size = self.__entries.pop(key, None)
+
+        if size is not None:
+            self.__size -= size
+
+    def __load_index(self) -> None:
+        # Files are indexed from least to most recently used based on their access/modification time.
+        files = []
+
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                files.append((max(stat.st_atime, stat.st_mtime), entry.name, stat.st_size))
+
+        for _, name, size in sorted(files):
+            self.__entries[name] = size
+            self.__size += size
@@ -0,0 +1,374 @@
+from typing import Any, Callable, Dict, List, Optional, Union
+import json
+import os
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+# Unique to the process, so a placeholder can't collide with a string that's actually part of a document.
+_PLACEHOLDER_PREFIX = f"pmllib-fragment-{os.urandom(8).hex()}-"
+
+class Fragment:
+    """
+    A piece of already encoded JSON, spliced into documents as-is instead of being encoded again.
+
+    Useful for large values which are sent over and over again unchanged (like system prompts).
+    Fragments can be used anywhere a value is expected in a document encoded by a `JsonCodec`.
+    """
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+        """The encoded JSON."""
+
+    def __str__(self) -> str:
+        return self.data.decode("utf-8")
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, Fragment) and other.data == self.data
+
+    def __hash__(self) -> int:
+        return hash(self.data)
+
+class JsonCodec:
+    """
+    Encodes and decodes JSON documents. Use `get_codec()` to get the fastest one available.
+    """
+
+    name = "json"
+    """The name of the library used."""
+
+    def dumps(self, obj: Any) -> bytes:
+        """
+        Returns `obj` encoded as compact UTF-8 JSON. `Fragment` values are spliced in as-is.
+        """
+
+        return _splice(lambda default: json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=default).encode("utf-8"))
+
+    def loads(self, data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        """
+        Returns the decoded JSON document.
+        """
+
+        return json.loads(bytes(data) if isinstance(data, memoryview) else data)
+
+    def fragment(self, obj: Any) -> Fragment:
+        """
+        Returns `obj` encoded once as a `Fragment`.
+        """
+
+        return Fragment(self.dumps(obj))
+
+class OrjsonCodec(JsonCodec):
+    """
+    Uses the optional orjson package, which is several times faster than the standard library.
+    """
+
+    name = "orjson"
+
+    def dumps(self, obj: Any) -> bytes:
+        if hasattr(orjson, "Fragment"):
+            return orjson.dumps(obj, default=_to_orjson_fragment)
+
+        return _splice(lambda default: orjson.dumps(obj, default=default))
+
+    def loads(self, data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        return orjson.loads(data)
+
+class MsgspecCodec(JsonCodec):
+    """
+    Uses the optional msgspec package, which is several times faster than the standard library.
+    """
+
+    name = "msgspec"
+
+    def __init__(self) -> None:
+        self.__encoder = msgspec.json.Encoder(enc_hook=_to_msgspec_raw)
+        self.__decoder = msgspec.json.Decoder()
+
+    def dumps(self, obj: Any) -> bytes:
+        return self.__encoder.encode(obj)
+
+    def loads(self, data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        return self.__decoder.decode(data)
+
+class PayloadTemplate:
+    """
+    Encodes documents which share most of their members with `static`, encoding the shared members only once.
+
+    Every member of a rendered document whose value is the same as in `static` is spliced in pre-encoded,
+    so only the members that differ (like the prompt and the seed) are actually encoded.
+
+    Usage:
+    ```
+    template = PayloadTemplate({"negative_prompt": "...", "steps": 20, "sampler": "Euler a"})
+    body = template.render({"prompt": "A cat", "negative_prompt": "...", "steps": 20, "sampler": "Euler a"})
+    ```
+    """
+
+    def __init__(self, static: Dict[str, Any], codec: Optional[JsonCodec] = None) -> None:
+        self.static = dict(static)
+        """The values shared by most documents."""
+
+        self.codec = codec if codec else get_codec()
+        """The codec used to encode documents."""
+
+        self.__members = {key: self.codec.dumps({key: value})[1:-1] for key, value in self.static.items()}
+
+    def render(self, payload: Dict[str, Any]) -> bytes:
+        """
+        Returns `payload` encoded as a JSON object.
+        """
+
+        members: List[bytes] = []
+        dynamic: Dict[str, Any] = {}
+        missing = object()
+
+        for key, value in payload.items():
+            static = self.static.get(key, missing)
+
+            if static is value or (static is not missing and type(static) is type(value) and static == value):
+                members.append(self.__members[key])
+            else:
+                dynamic[key] = value
+
+        if dynamic:
+            members.append(self.codec.dumps(dynamic)[1:-1])
+
+        return b"{" + b",".join(members) + b"}"
+
+class JsonArrayExtractor:
+    """
+    Pulls the string items of an array member of a JSON object (like the `images` of an A1111 response)
+    out of the document while it's being received, without decoding them into Python strings.
+
+    Chunks of the document are passed to `feed()` as they arrive. Only the rest of the document is decoded by `result()`,
+    so a response made up mostly of a few huge strings is never held as Python objects (or as a whole) in memory.
+    The items are returned as the raw bytes between their quotes, which e.g. `base64.b64decode()` accepts as-is.
+    """
+
+    def __init__(self, field: str, codec: Optional[JsonCodec] = None) -> None:
+        self.field = field
+        """The name of the top-level member holding the array."""
+
+        self.codec = codec if codec else get_codec()
+        """The codec used to decode the rest of the document."""
+
+        self.items: List[bytes] = []
+        """The items extracted so far."""
+
+        self.__field = field.encode("utf-8")
+        self.__rest = bytearray()
+        self.__pending = b""
+        self.__depth = 0
+        self.__in_string = False
+        self.__in_array = False
+        self.__expecting_array = False
+        self.__extracted = False
+        self.__item: Optional[bytearray] = None
+        self.__key: Optional[bytearray] = None
+
+    @property
+    def size(self) -> int:
+        """
+        Returns how many bytes of the document were kept for decoding so far.
+        """
+
+        return len(self.__rest)
+
+    def feed(self, chunk: bytes) -> None:
+        """
+        Processes the next chunk of the document.
+        """
+
+        data = self.__pending + chunk if self.__pending else chunk
+        self.__pending = b""
+        view = memoryview(data)
+        position = 0
+        length = len(data)
+
+        while position < length:
+            if self.__in_string:
+                # Strings are skipped with `find()` (memchr), which is much faster than a regex over megabytes of base64.
+                quote = data.find(b'"', position)
+                backslash = data.find(b"\\", position, quote if quote >= 0 else length)
+
+                if backslash >= 0: # A backslash escapes the next byte, which may not have arrived yet.
+                    if backslash + 1 >= length:
+                        self.__write_string(view[position:backslash])
+                        self.__pending = data[backslash:]
+                        break
+
+                    self.__write_string(view[position:backslash + 2])
+                    position = backslash + 2
+                    continue
+
+                if quote < 0:
+                    self.__write_string(view[position:])
+                    break
+
+                self.__write_string(view[position:quote])
+                self.__close_string()
+                position = quote + 1
+                continue
+
+            match = _STRUCTURAL.search(data, position)
+
+            if match is None:
+                self.__write(view[position:])
+                break
+
+            end = match.start()
+            self.__write(view[position:end])
+            self.__handle_structural(data[end])
+            position = end + 1
+
+    def result(self) -> Dict[str, Any]:
+        """
+        Returns the decoded document, with the extracted items (as `bytes`) in place of the array.
+        A member that isn't an array (like `null`) is left as it is.
+        """
+
+        document = self.codec.loads(self.__rest)
+
+        if self.__extracted and isinstance(document, dict) and self.field in document:
+            document[self.field] = self.items
+
+        return document
+
+    def __write(self, data: Union[bytes, memoryview]) -> None:
+        # Whitespace and commas between the items of the array are dropped along with them.
+        if not self.__in_array:
+            self.__rest += data
+
+    def __write_string(self, data: Union[bytes, memoryview]) -> None:
+        if self.__item is not None:
+            self.__item += data
+            return
+
+        self.__rest += data
+
+        if self.__key is not None and len(self.__key) <= len(self.__field):
+            self.__key += data
+
+    def __close_string(self) -> None:
+        self.__in_string = False
+
+        if self.__item is not None:
+            item = bytes(self.__item)
+            self.__item = None
+
+            # Escapes are only possible in theory, base64 doesn't need any.
+            self.items.append(item if b"\\" not in item else self.codec.loads(b'"' + item + b'"').encode("utf-8"))
+            return
+
+        self.__rest += b'"'
+
+        if self.__key is not None:
+            self.__expecting_array = self.__key == self.__field
+            self.__key = None
+
+    def __handle_structural(self, char: int) -> None:
+        if char == 0x22: # "
+            self.__in_string = True
+
+            if self.__in_array and self.__depth == 2:
+                self.__item = bytearray()
+                return
+
+            self.__rest += b'"'
+            self.__key = bytearray() if self.__depth == 1 else None
+            return
+
+        if char == 0x5B and self.__expecting_array and self.__depth == 1: # [
+            self.__rest += b"["
+            self.__depth += 1
+            self.__in_array = True
+            self.__expecting_array = False
+            self.__extracted = True
+            return
+
+        if char == 0x5D and self.__in_array and self.__depth == 2: # ]
+            self.__in_array = False
+            self.__depth -= 1
+            self.__rest += b"]"
+            return
+
+        if char in (0x7B, 0x5B): # { [
+            self.__depth += 1
+        elif char in (0x7D, 0x5D): # } ]
+            self.__depth -= 1
+
+        if char != 0x3A: # Anything but the colon after the member's name means it isn't followed by the array.
+            self.__expecting_array = False
+
+        if not self.__in_array:
+            self.__rest.append(char)
+
+_STRUCTURAL = re.compile(rb'[\[\]{}":,]')
+
+def _splice(encode: Callable[[Callable[[Any], Any]], bytes]) -> bytes:
+    # Fragments are encoded as unique placeholder strings first, which are then replaced by the fragments themselves.
+    fragments: List[Fragment] = []
+
+    def default(obj: Any) -> Any:
+        if isinstance(obj, Fragment):
+            fragments.append(obj)
+            return f"{_PLACEHOLDER_PREFIX}{len(fragments) - 1}"
+
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    data = encode(default)
+
+    for index, fragment in enumerate(fragments):
+        data = data.replace(f'"{_PLACEHOLDER_PREFIX}{index}"'.encode("utf-8"), fragment.data, 1)
+
+    return data
+
+def _to_orjson_fragment(obj: Any) -> Any:
+    if isinstance(obj, Fragment):
+        return orjson.Fragment(obj.data)
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def _to_msgspec_raw(obj: Any) -> Any:
+    if isinstance(obj, Fragment):
+        return msgspec.Raw(obj.data)
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+_default_codec: Optional[JsonCodec] = None
+
+def get_codec() -> JsonCodec:
+    """
+    Returns the process-wide codec: orjson or msgspec if installed, otherwise the standard library.
+    """
+
+    global _default_codec
+
+    if _default_codec is None:
+        if orjson is not None:
+            _default_codec = OrjsonCodec()
+        elif msgspec is not None:
+            _default_codec = MsgspecCodec()
+        else:
+            _default_codec = JsonCodec()
+
+    return _default_codec
+
+def set_codec(codec: JsonCodec) -> None:
+    """
+    Overrides the process-wide codec, e.g. to force the standard library.
+    """
+
+    global _default_codec
+    _default_codec = codec
@@ -0,0 +1,340 @@
+from asyncio import AbstractEventLoop, Task, ensure_future, get_running_loop, run_coroutine_threadsafe
+from time import perf_counter_ns
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Optional, Set
+from aiohttp import ClientResponse, ClientResponseError, ClientSession, ClientTimeout, TCPConnector, TraceConfig
+from .metrics import NULL_TRACE, Trace
+from .codec import JsonArrayExtractor, JsonCodec, get_codec
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+class HttpClient:
+    """
+    A long-lived, pooled HTTP client meant to be shared by generators.
+
+    Connections are kept alive between calls, so consecutive requests to the same backend
+    reuse an already open TCP connection instead of paying for DNS resolution and a new handshake every time.
+    The underlying session is created lazily on first use and can be released either by calling `close()`
+    or by using the client as an async context manager.
+
+    Requests can be given a `Trace`, to which the time spent encoding the payload (`"json_encode"`), acquiring a connection (`"connection"`),
+    waiting for the response headers (`"ttfb"`), reading the body (`"body_read"`) and decoding it (`"json_parse"`) are recorded.
+
+    Error responses (a status of 400 or above) are detected from the status line, before the body is parsed as a result,
+    and raised as an `aiohttp.ClientResponseError` carrying the backend's error message.
+
+    Bodies are encoded and decoded with `codec` (the fastest one available by default, see `get_codec()`).
+    Payloads may contain pre-encoded `Fragment`s, or be already encoded `bytes` (e.g. rendered by a `PayloadTemplate`).
+    """
+
+    def __init__(
+            self,
+            limit: int = 100,
+            limit_per_host: int = 8,
+            keepalive_timeout: float = 60.0,
+            dns_cache_ttl: int = 300,
+            connect_timeout: Optional[float] = 10.0,
+            read_timeout: Optional[float] = None,
+            total_timeout: Optional[float] = None,
+            codec: Optional[JsonCodec] = None,
+    ) -> None:
+        self.limit = limit
+        """The maximum number of simultaneous connections in the pool."""
+
+        self.limit_per_host = limit_per_host
+        """The maximum number of simultaneous connections to a single host."""
+
+        self.keepalive_timeout = keepalive_timeout
+        """How long (in seconds) an idle connection is kept open for reuse."""
+
+        self.dns_cache_ttl = dns_cache_ttl
+        """How long (in seconds) resolved host names are cached."""
+
+        self.timeout = ClientTimeout(
+            total=total_timeout,
+            sock_connect=connect_timeout,
+            sock_read=read_timeout,
+        )
+        """Default timeouts applied to every request made through the client."""
+
+        self.codec = codec if codec else get_codec()
+        """Encodes request bodies and decodes responses."""
+
+        self.__session: Optional[ClientSession] = None
+        self.__loop: Optional[AbstractEventLoop] = None
+        self.__closing: Set[Task] = set()
+
+    @property
+    def session(self) -> ClientSession:
+        """
+        Returns the underlying `aiohttp.ClientSession`, creating it if needed.
+
+        A session is bound to the event loop it was created in, so a new one is created
+        when the client is used from a different loop (e.g. after a second `asyncio.run()`), and the previous one is closed.
+        """
+
+        loop = get_running_loop()
+
+        if self.__session is not None and not self.__session.closed and self.__loop is not loop:
+            self.__discard(self.__session, self.__loop)
+
+        if self.__session is None or self.__session.closed or self.__loop is not loop:
+            connector = TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+            )
+            self.__session = ClientSession(connector=connector, timeout=self.timeout, trace_configs=[_connection_trace_config()])
+            self.__loop = loop
+
+        return self.__session
+
+    @property
+    def closed(self) -> bool:
+        """
+        Returns `True` if the client has no open session.
+        """
+
+        return self.__session is None or self.__session.closed
+
+    async def close(self) -> None:
+        """
+        Closes the underlying session and all of its pooled connections.
+        The client can still be used afterwards, in which case a new session is created.
+        """
+
+        if self.__session is not None and not self.__session.closed:
+            await self.__session.close()
+
+        self.__session = None
+        self.__loop = None
+
+    def __discard(self, session: ClientSession, loop: Optional[AbstractEventLoop]) -> None:
+        if loop is not None and loop.is_running():
+            # Still serving another thread, so the session is closed over there.
+            run_coroutine_threadsafe(session.close(), loop)
+            return
+
+        # Once its loop is closed, the pooled connections are just dropped instead of being shut down,
+        # so closing the session doesn't wait on anything from that loop.
+        task = ensure_future(session.close())
+        self.__closing.add(task)
+        task.add_done_callback(self.__closing.discard)
+        task.add_done_callback(_closed)
+
+    async def post_json(self, url: str, payload: Any, trace: Trace = NULL_TRACE) -> Dict[str, Any]:
+        """
+        Sends `payload` as a JSON body to `url` and returns the decoded JSON response.
+        """
+
+        if not trace.enabled:
+            async with self.session.post(url=url, data=self.encode(payload), headers=_JSON_HEADERS) as resp:
+                if resp.status >= 400:
+                    await self.__raise_for_status(resp)
+
+                return self.codec.loads(await resp.read())
+
+        start_ns = perf_counter_ns()
+
+        if isinstance(payload, (bytes, bytearray)):
+            body = payload
+        else:
+            with trace.phase("json_encode"):
+                body = self.encode(payload)
+
+        async with self.session.post(url=url, data=body, headers=_JSON_HEADERS, trace_request_ctx=trace) as resp:
+            return await self.__read_json(resp, trace, start_ns)
+
+    async def post_json_extract(self, url: str, payload: Any, field: str, trace: Trace = NULL_TRACE) -> Dict[str, Any]:
+        """
+        Sends `payload` as a JSON body to `url` and returns the decoded JSON response, with the string items of
+        its top-level array `field` as raw `bytes` (see `JsonArrayExtractor`).
+
+        Meant for responses made up mostly of huge strings (like A1111's base64 encoded `images`), which are extracted
+        while the body is being received instead of being buffered and decoded along with the rest of the document.
+        """
+
+        start_ns = perf_counter_ns()
+        body = self.encode(payload)
+
+        async with self.session.post(url=url, data=body, headers=_JSON_HEADERS, trace_request_ctx=trace if trace.enabled else None) as resp:
+            headers_ns = perf_counter_ns()
+            trace.record("ttfb", start_ns, headers_ns)
+
+            if resp.status >= 400:
+                await self.__raise_for_status(resp)
+
+            extractor = JsonArrayExtractor(field, self.codec)
+            size = 0
+
+            async for chunk in resp.content.iter_any():
+                size += len(chunk)
+                extractor.feed(chunk)
+
+            body_ns = perf_counter_ns()
+            trace.record("body_read", headers_ns, body_ns)
+
+            data = extractor.result()
+            trace.record("json_parse", body_ns)
+            trace.count("response_bytes", size)
+
+            return data
+
+    async def get_json(self, url: str, trace: Trace = NULL_TRACE) -> Dict[str, Any]:
+        """
+        Sends a GET request to `url` and returns the decoded JSON response.
+        """
+
+        if not trace.enabled:
+            async with self.session.get(url) as resp:
+                if resp.status >= 400:
+                    await self.__raise_for_status(resp)
+
+                return self.codec.loads(await resp.read())
+
+        start_ns = perf_counter_ns()
+
+        async with self.session.get(url, trace_request_ctx=trace) as resp:
+            return await self.__read_json(resp, trace, start_ns)
+
+    async def stream_json_lines(self, url: str, payload: Any, trace: Trace = NULL_TRACE) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Sends `payload` as a JSON body to `url` and yields every line of the
+        newline delimited JSON (NDJSON) response as soon as it arrives.
+
+        When traced, `"ttfb"` lasts until the first line arrives and `"body_read"` until the last one does.
+
+        Closing the iterator early (or cancelling the task iterating it) closes the connection, which aborts the request on the server's end.
+        """
+
+        start_ns = perf_counter_ns()
+
+        async with self.session.post(url=url, data=self.encode(payload), headers=_JSON_HEADERS, trace_request_ctx=trace if trace.enabled else None) as resp:
+            if resp.status >= 400:
+                await self.__raise_for_status(resp)
+
+            first_line_ns: Optional[int] = None
+            parse_ns = 0
+
+            try:
+                async for line in resp.content:
+                    line = line.strip()
+
+                    if not line:
+                        continue
+
+                    if not trace.enabled:
+                        yield self.codec.loads(line)
+                        continue
+
+                    if first_line_ns is None:
+                        first_line_ns = perf_counter_ns()
+                        trace.record("ttfb", start_ns, first_line_ns)
+
+                    parse_start_ns = perf_counter_ns()
+                    chunk = self.codec.loads(line)
+                    parse_ns += perf_counter_ns() - parse_start_ns
+
+                    yield chunk
+            except BaseException:
+                # Closing (rather than releasing) the connection is what makes the server stop generating,
+                # so a stream that is cancelled or closed early doesn't keep the server busy with a response nobody reads.
+                resp.close()
+                raise
+            finally:
+                if first_line_ns is not None:
+                    trace.record("body_read", first_line_ns)
+                    trace.add("json_parse", parse_ns)
+
+    def encode(self, payload: Any) -> bytes:
+        """
+        Returns `payload` encoded as a JSON body, unless it already is.
+        """
+
+        if isinstance(payload, (bytes, bytearray)):
+            return payload
+
+        return self.codec.dumps(payload)
+
+    async def __raise_for_status(self, resp: ClientResponse) -> None:
+        body = await resp.text(errors="replace")
+        message = body or resp.reason or ""
+
+        # Both Ollama and A1111 report errors as JSON, but with different keys.
+        try:
+            error = self.codec.loads(body)
+
+            if isinstance(error, dict):
+                message = str(error.get("error") or error.get("detail") or error.get("message") or message)
+        except ValueError:
+            pass
+
+        raise ClientResponseError(resp.request_info, resp.history, status=resp.status, message=message, headers=resp.headers)
+
+    async def __read_json(self, resp: ClientResponse, trace: Trace, start_ns: int) -> Dict[str, Any]:
+        headers_ns = perf_counter_ns()
+        trace.record("ttfb", start_ns, headers_ns)
+
+        if resp.status >= 400:
+            await self.__raise_for_status(resp)
+
+        body = await resp.read()
+        body_ns = perf_counter_ns()
+        trace.record("body_read", headers_ns, body_ns)
+
+        data = self.codec.loads(body)
+        trace.record("json_parse", body_ns)
+        trace.count("response_bytes", len(body))
+
+        return data
+
+    async def __aenter__(self) -> "HttpClient":
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        await self.close()
+
+def _closed(task: Task) -> None:
+    # Connections left on a loop that was stopped without being closed can't be waited for from another one.
+    if not task.cancelled():
+        task.exception()
+
+def _connection_trace_config() -> TraceConfig:
+    # Only requests given a trace (as `trace_request_ctx`) are measured.
+    async def on_request_start(_, context: SimpleNamespace, __) -> None:
+        if context.trace_request_ctx is not None:
+            context.start_ns = perf_counter_ns()
+
+    async def on_connection_acquired(_, context: SimpleNamespace, __) -> None:
+        if context.trace_request_ctx is not None:
+            context.trace_request_ctx.record("connection", context.start_ns)
+
+    config = TraceConfig()
+    config.on_request_start.append(on_request_start)
+    config.on_connection_create_end.append(on_connection_acquired)
+    config.on_connection_reuseconn.append(on_connection_acquired)
+
+    return config
+
+_default_client: Optional[HttpClient] = None
+
+def get_default_client() -> HttpClient:
+    """
+    Returns the process-wide client shared by generators that weren't given one explicitly.
+    """
+
+    global _default_client
+
+    if _default_client is None:
+        _default_client = HttpClient()
+
+    return _default_client
+
+async def close_default_client() -> None:
+    """
+    Closes the process-wide client. Should be called once on shutdown.
+    """
+
+    if _default_client is not None:
+        await _default_client.close()
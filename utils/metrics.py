@@ -0,0 +1,416 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import deque
+from time import perf_counter_ns, time_ns
+from typing import Any, Callable, ContextManager, Deque, Dict, Iterator, List, Optional, Tuple
+from contextlib import contextmanager, nullcontext
+import os
+
+# Upper bounds (in seconds) of the histogram buckets, spanning sub-millisecond phases to multi-minute renders.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+class Trace:
+    """
+    Collects the timings and counters of a single operation (like one `generate()` call).
+
+    Phases are measured with `time.perf_counter_ns()` and handed to every sink of the `Metrics` registry
+    once the trace is finished. Traces are only created while at least one sink is registered,
+    otherwise `NULL_TRACE` is handed out instead, whose methods do nothing.
+    """
+
+    enabled = True
+
+    def __init__(self, operation: str, sinks: List["MetricsSink"], attributes: Optional[Dict[str, Any]] = None) -> None:
+        self.operation = operation
+        """The name of the traced operation, like `"chat.generate"`."""
+
+        self.attributes: Dict[str, Any] = dict(attributes) if attributes else {}
+        """Details about the operation, like the model name."""
+
+        self.phases: List[Tuple[str, int, int]] = []
+        """The measured phases as `(name, start, end)` in `perf_counter_ns()` time."""
+
+        self.counters: Dict[str, float] = {}
+        """Counted values, like the number of tokens generated."""
+
+        self.start_ns = perf_counter_ns()
+        """When the operation started in `perf_counter_ns()` time."""
+
+        self.end_ns: Optional[int] = None
+        """When the operation finished in `perf_counter_ns()` time."""
+
+        self.error: Optional[str] = None
+        """The name of the exception the operation failed with, if any."""
+
+        self.epoch_offset_ns = time_ns() - self.start_ns
+        """Converts `perf_counter_ns()` time to nanoseconds since the epoch."""
+
+        self.__sinks = sinks
+
+    @property
+    def duration_ns(self) -> int:
+        """
+        Returns how long the operation took (so far) in nanoseconds.
+        """
+
+        return (self.end_ns if self.end_ns is not None else perf_counter_ns()) - self.start_ns
+
+    def record(self, phase: str, start_ns: int, end_ns: Optional[int] = None) -> None:
+        """
+        Records a phase which started at `start_ns` and ended at `end_ns` (now by default).
+        """
+
+        self.phases.append((phase, start_ns, end_ns if end_ns is not None else perf_counter_ns()))
+
+    def add(self, phase: str, duration_ns: int) -> None:
+        """
+        Records a phase of which only the duration is known (like one measured by the backend), as if it just ended.
+        """
+
+        end_ns = perf_counter_ns()
+        self.phases.append((phase, end_ns - duration_ns, end_ns))
+
+    @contextmanager
+    def phase(self, phase: str) -> Iterator[None]:
+        """
+        Records the duration of the `with` block as a phase.
+        """
+
+        start_ns = perf_counter_ns()
+
+        try:
+            yield
+        finally:
+            self.record(phase, start_ns)
+
+    def count(self, name: str, value: float = 1) -> None:
+        """
+        Adds `value` to the counter called `name`.
+        """
+
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        Sets an attribute of the operation.
+        """
+
+        self.attributes[key] = value
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """
+        Ends the operation and hands the trace to the sinks. Only the first call has an effect.
+        """
+
+        if self.end_ns is not None:
+            return
+
+        self.end_ns = perf_counter_ns()
+        self.error = type(error).__name__ if error else None
+
+        for sink in self.__sinks:
+            sink.export(self)
+
+    def __enter__(self) -> "Trace":
+        return self
+
+    def __exit__(self, _, error: Optional[BaseException], __) -> None:
+        self.finish(error)
+
+class _NullTrace(Trace):
+    enabled = False
+
+    def __init__(self) -> None:
+        pass
+
+    def record(self, phase: str, start_ns: int, end_ns: Optional[int] = None) -> None:
+        pass
+
+    def add(self, phase: str, duration_ns: int) -> None:
+        pass
+
+    def phase(self, phase: str) -> ContextManager[None]:
+        return _NULL_PHASE
+
+    def count(self, name: str, value: float = 1) -> None:
+        pass
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        pass
+
+    def __exit__(self, *_) -> None:
+        pass
+
+_NULL_PHASE = nullcontext()
+
+NULL_TRACE: Trace = _NullTrace()
+"""The trace handed out while metrics are disabled. Every method is a no-op."""
+
+class MetricsSink(ABC):
+    """
+    Receives every finished `Trace`. Sinks are called on the event loop, so they have to be fast.
+    """
+
+    @abstractmethod
+    def export(self, trace: Trace) -> None:
+        """
+        Handles a finished trace.
+        """
+
+        pass
+
+class Metrics:
+    """
+    The registry of sinks traces are handed to.
+
+    Instrumented code calls `trace()` for every operation, which returns `NULL_TRACE` while no sinks are registered,
+    so disabled metrics only cost a few attribute lookups per phase.
+
+    Usage:
+    ```
+    histograms = HistogramSink()
+    get_default_metrics().add_sink(histograms)
+
+    await generator.generate(_input)
+    print(histograms.get("chat.generate", "ttfb").percentile(95))
+    ```
+    """
+
+    def __init__(self) -> None:
+        self.sinks: List[MetricsSink] = []
+        """Every registered sink."""
+
+    @property
+    def enabled(self) -> bool:
+        """
+        Returns `True` if at least one sink is registered.
+        """
+
+        return bool(self.sinks)
+
+    def add_sink(self, sink: MetricsSink) -> None:
+        """
+        Registers `sink`, enabling metrics.
+        """
+
+        self.sinks.append(sink)
+
+    def remove_sink(self, sink: MetricsSink) -> None:
+        """
+        Unregisters `sink`. Metrics are disabled once no sinks are left.
+        """
+
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+
+    def trace(self, operation: str, **attributes: Any) -> Trace:
+        """
+        Starts tracing an operation. The returned trace should be used as a context manager or `finish()`ed explicitly.
+        """
+
+        if not self.sinks:
+            return NULL_TRACE
+
+        return Trace(operation, list(self.sinks), attributes)
+
+_default_metrics: Optional[Metrics] = None
+
+def get_default_metrics() -> Metrics:
+    """
+    Returns the process-wide registry used by generators that weren't given one explicitly.
+    """
+
+    global _default_metrics
+
+    if _default_metrics is None:
+        _default_metrics = Metrics()
+
+    return _default_metrics
+
+class Histogram:
+    """
+    A cumulative histogram of durations in seconds with fixed bucket bounds.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        """The upper bounds of the buckets. Values above the last bound fall into an implicit `+Inf` bucket."""
+
+        self.counts = [0] * (len(buckets) + 1)
+        """The number of values that fell into each bucket (not cumulative)."""
+
+        self.count = 0
+        """The number of observed values."""
+
+        self.sum = 0.0
+        """The sum of the observed values."""
+
+    def observe(self, value: float) -> None:
+        """
+        Adds a value to the histogram.
+        """
+
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Returns an estimate of the `p`th percentile (0-100), interpolated within its bucket, or `None` if it's empty.
+        """
+
+        if not self.count:
+            return None
+
+        rank = self.count * p / 100
+        seen = 0
+
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else lower
+
+                return lower + (upper - lower) * max(rank - seen, 0) / count
+
+            seen += count
+
+        return self.buckets[-1]
+
+class HistogramSink(MetricsSink):
+    """
+    Aggregates the phases of every trace into in-process histograms keyed by operation and phase,
+    and sums up the counters. Besides its phases, every trace is recorded as a `"total"` phase.
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        """The bucket bounds of newly created histograms."""
+
+        self.histograms: Dict[Tuple[str, str], Histogram] = {}
+        """Every histogram by `(operation, phase)`."""
+
+        self.counters: Dict[Tuple[str, str], float] = {}
+        """Every counter by `(operation, name)`. Failed operations are counted as `"errors"`."""
+
+    def get(self, operation: str, phase: str) -> Histogram:
+        """
+        Returns the histogram of the phase of the operation, creating an empty one if needed.
+        """
+
+        key = (operation, phase)
+
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(self.buckets)
+
+        return self.histograms[key]
+
+    def export(self, trace: Trace) -> None:
+        for phase, start_ns, end_ns in trace.phases:
+            self.get(trace.operation, phase).observe((end_ns - start_ns) / 1e9)
+
+        self.get(trace.operation, "total").observe(trace.duration_ns / 1e9)
+
+        for name, value in trace.counters.items():
+            self.counters[(trace.operation, name)] = self.counters.get((trace.operation, name), 0) + value
+
+        if trace.error:
+            self.counters[(trace.operation, "errors")] = self.counters.get((trace.operation, "errors"), 0) + 1
+
+class PrometheusSink(HistogramSink):
+    """
+    A `HistogramSink` which can render its data in the Prometheus text exposition format,
+    e.g. to be served from a `/metrics` endpoint.
+    """
+
+    def __init__(self, prefix: str = "pmllib", buckets: Tuple[float, ...] = DEFAULT_BUCKETS) -> None:
+        super().__init__(buckets)
+
+        self.prefix = prefix
+        """Prepended to the name of every metric."""
+
+    def render(self) -> str:
+        """
+        Returns every histogram and counter in the Prometheus text exposition format (version 0.0.4).
+        """
+
+        name = f"{self.prefix}_phase_duration_seconds"
+        lines = [
+            f"# HELP {name} Duration of the phases of traced operations.",
+            f"# TYPE {name} histogram",
+        ]
+
+        for (operation, phase), histogram in sorted(self.histograms.items()):
+            labels = f'operation="{_escape(operation)}",phase="{_escape(phase)}"'
+            cumulative = 0
+
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        for counter in sorted({counter for _, counter in self.counters}):
+            counter_name = f"{self.prefix}_{counter}_total"
+            lines.append(f"# TYPE {counter_name} counter")
+
+            for (operation, name_), value in sorted(self.counters.items()):
+                if name_ == counter:
+                    lines.append(f'{counter_name}{{operation="{_escape(operation)}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+class SpanSink(MetricsSink):
+    """
+    Turns every trace into OpenTelemetry style spans: a root span for the operation and a child span for each phase.
+
+    Spans are dictionaries using the field names of the OTLP JSON encoding. They're passed to `exporter` if provided
+    (which can forward them to a collector), and the most recent `max_spans` are kept in `spans` either way.
+    """
+
+    def __init__(self, exporter: Optional[Callable[[List[Dict[str, Any]]], None]] = None, max_spans: int = 1000) -> None:
+        self.exporter = exporter
+        """Called with the spans of every finished trace."""
+
+        self.spans: Deque[Dict[str, Any]] = deque(maxlen=max_spans)
+        """The most recent spans."""
+
+    def export(self, trace: Trace) -> None:
+        trace_id = os.urandom(16).hex()
+        root_id = os.urandom(8).hex()
+        offset = trace.epoch_offset_ns
+
+        spans = [{
+            "traceId": trace_id,
+            "spanId": root_id,
+            "parentSpanId": None,
+            "name": trace.operation,
+            "startTimeUnixNano": trace.start_ns + offset,
+            "endTimeUnixNano": trace.end_ns + offset,
+            "attributes": {**trace.attributes, **trace.counters},
+            "status": {"code": "ERROR", "message": trace.error} if trace.error else {"code": "OK"},
+        }]
+
+        for phase, start_ns, end_ns in trace.phases:
+            spans.append({
+                "traceId": trace_id,
+                "spanId": os.urandom(8).hex(),
+                "parentSpanId": root_id,
+                "name": f"{trace.operation}.{phase}",
+                "startTimeUnixNano": start_ns + offset,
+                "endTimeUnixNano": end_ns + offset,
+                "attributes": {},
+                "status": {"code": "OK"},
+            })
+
+        self.spans.extend(spans)
+
+        if self.exporter:
+            self.exporter(spans)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
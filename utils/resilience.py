@@ -0,0 +1,337 @@
+from asyncio import FIRST_COMPLETED, CancelledError, Task, TimeoutError, ensure_future, sleep, timeout as _timeout, wait, wait_for
+from collections import deque
+from contextlib import asynccontextmanager
+from enum import Enum
+from time import monotonic
+from typing import AsyncIterator, Awaitable, Callable, Deque, List, Optional, TypeVar
+import random
+from aiohttp import ClientConnectorError, ClientError, ClientResponseError, ServerDisconnectedError
+from .service import ServiceBusyException
+
+T = TypeVar("T")
+
+# Status codes which mean the backend is overloaded or restarting rather than that the request is wrong.
+RETRYABLE_STATUSES = (429, 502, 503, 504)
+
+class CircuitState(str, Enum):
+    """
+    Holds the states of a `CircuitBreaker`.
+    """
+
+    CLOSED = "closed"
+    """Requests are let through."""
+
+    OPEN = "open"
+    """Requests fail fast without reaching the backend."""
+
+    HALF_OPEN = "half_open"
+    """A single trial request is let through to find out whether the backend recovered."""
+
+    def __str__(self) -> str:
+        return self.value
+
+class CircuitBreaker:
+    """
+    Stops sending requests to a backend that keeps failing.
+
+    After `failure_threshold` failures in a row the circuit opens and requests fail fast. Once `reset_timeout` seconds
+    have passed, a single trial request is let through: if it succeeds the circuit closes again, otherwise it reopens.
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        """How many failures in a row open the circuit."""
+
+        self.reset_timeout = reset_timeout
+        """How long (in seconds) the circuit stays open before a trial request is let through."""
+
+        self.failures = 0
+        """The number of failures in a row."""
+
+        self.__state = CircuitState.CLOSED
+        self.__opened_at = 0.0
+        self.__trial_in_flight = False
+
+    @property
+    def state(self) -> CircuitState:
+        """
+        Returns the current state, moving from open to half-open once the reset timeout passed.
+        """
+
+        if self.__state == CircuitState.OPEN and monotonic() - self.__opened_at >= self.reset_timeout:
+            self.__state = CircuitState.HALF_OPEN
+            self.__trial_in_flight = False
+
+        return self.__state
+
+    @property
+    def available(self) -> bool:
+        """
+        Returns `True` if a request would be let through right now.
+        """
+
+        state = self.state
+        return state == CircuitState.CLOSED or (state == CircuitState.HALF_OPEN and not self.__trial_in_flight)
+
+    def on_request(self) -> None:
+        """
+        Must be called when a request is let through, so only a single trial request is sent while half-open.
+        """
+
+        if self.state == CircuitState.HALF_OPEN:
+            self.__trial_in_flight = True
+
+    def release(self) -> None:
+        """
+        Must be called when a let-through request ended without telling anything about the backend (e.g. it was cancelled).
+        """
+
+        self.__trial_in_flight = False
+
+    def record_success(self) -> None:
+        """
+        Closes the circuit.
+        """
+
+        self.failures = 0
+        self.__state = CircuitState.CLOSED
+        self.__trial_in_flight = False
+
+    def record_failure(self) -> None:
+        """
+        Counts a failure, opening the circuit if there were too many in a row or the trial request failed.
+        """
+
+        self.failures += 1
+
+        if self.__state == CircuitState.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.__state = CircuitState.OPEN
+            self.__opened_at = monotonic()
+            self.__trial_in_flight = False
+
+class RetryPolicy:
+    """
+    Retries failed backend calls with exponential backoff and full jitter.
+
+    Failures to connect are always retried, because the request never reached the backend.
+    Other transient failures (timeouts, dropped connections, and `RETRYABLE_STATUSES`) are only retried
+    if the call is idempotent, so e.g. unseeded image generations aren't silently rendered twice.
+    Every attempt is limited to `attempt_timeout` seconds, and no retry is started past the caller's deadline.
+    """
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.25, max_delay: float = 4.0, attempt_timeout: Optional[float] = None) -> None:
+        self.attempts = attempts
+        """The maximum number of attempts (including the first one)."""
+
+        self.base_delay = base_delay
+        """The upper bound (in seconds) of the delay before the first retry. It doubles with every retry."""
+
+        self.max_delay = max_delay
+        """The largest delay (in seconds) between two attempts."""
+
+        self.attempt_timeout = attempt_timeout
+        """How long (in seconds) a single attempt may take. `None` means only the deadline applies."""
+
+    def is_retryable(self, e: BaseException, idempotent: bool) -> bool:
+        """
+        Returns `True` if the call that raised `e` can be retried.
+        """
+
+        if isinstance(e, ClientConnectorError):
+            return True
+
+        if not idempotent:
+            return False
+
+        if isinstance(e, ClientResponseError):
+            return e.status in RETRYABLE_STATUSES
+
+        return isinstance(e, (TimeoutError, ServerDisconnectedError, ClientError, ConnectionError))
+
+    def get_delay(self, retry: int) -> float:
+        """
+        Returns a random delay before the `retry`th retry (starting at 1).
+        """
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (retry - 1)))
+
+    async def run(self, call: Callable[[], Awaitable[T]], idempotent: bool = True, deadline: Optional["Deadline"] = None) -> T:
+        """
+        Awaits `call()`, retrying it as long as the policy and the `deadline` allow, and returns its result.
+        The exception of the last attempt is raised if every attempt failed.
+        """
+
+        for attempt in range(1, self.attempts + 1):
+            try:
+                if self.attempt_timeout is None:
+                    return await call()
+
+                return await wait_for(call(), self.attempt_timeout)
+            except Exception as e:
+                if attempt >= self.attempts or not self.is_retryable(e, idempotent):
+                    raise
+
+                delay = self.get_delay(attempt)
+
+                if deadline is not None and deadline.remaining is not None and deadline.remaining <= delay:
+                    raise
+
+                await sleep(delay)
+
+        raise RuntimeError("Unreachable")
+
+class Deadline:
+    """
+    The time budget of a single call, shared by everything the call does (waiting in line, retries, hedges).
+    """
+
+    def __init__(self, budget: Optional[float]) -> None:
+        self.budget = budget
+        """The total budget in seconds. `None` means unlimited."""
+
+        self.expires_at = monotonic() + budget if budget is not None else None
+        """When the budget runs out (`time.monotonic()`)."""
+
+    @property
+    def remaining(self) -> Optional[float]:
+        """
+        Returns how many seconds are left, or `None` if the budget is unlimited.
+        """
+
+        return max(self.expires_at - monotonic(), 0.0) if self.expires_at is not None else None
+
+    @asynccontextmanager
+    async def enforce(self) -> AsyncIterator["Deadline"]:
+        """
+        Cancels the `async with` block once the budget runs out and raises a `DeadlineExceededException` instead.
+        """
+
+        try:
+            async with _timeout(self.remaining):
+                yield self
+        except TimeoutError as e:
+            if self.remaining == 0:
+                raise DeadlineExceededException(self.budget) from e
+
+            raise
+
+class LatencyWindow:
+    """
+    Keeps the most recent `size` latencies to estimate percentiles from.
+    """
+
+    def __init__(self, size: int = 200) -> None:
+        self.samples: Deque[float] = deque(maxlen=size)
+        """The most recent latencies in seconds."""
+
+    def add(self, latency: float) -> None:
+        """
+        Adds a latency in seconds.
+        """
+
+        self.samples.append(latency)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """
+        Returns the `p`th percentile (0-100) of the recent latencies, or `None` if there are none.
+        """
+
+        if not self.samples:
+            return None
+
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)]
+
+class HedgePolicy:
+    """
+    Sends a second copy of a slow request to another backend and uses whichever response arrives first.
+
+    The second copy is sent once the request took longer than the `percentile`th percentile of recent latencies
+    (but at least `min_delay` seconds), so only the slowest requests are duplicated.
+    Nothing is hedged until `min_samples` latencies have been observed.
+    """
+
+    def __init__(self, percentile: float = 95, min_delay: float = 0.05, min_samples: int = 20, window: int = 200) -> None:
+        self.percentile = percentile
+        """Which percentile of recent latencies triggers the second request."""
+
+        self.min_delay = min_delay
+        """The shortest delay (in seconds) before the second request is sent."""
+
+        self.min_samples = min_samples
+        """How many latencies have to be observed before requests are hedged."""
+
+        self.latencies = LatencyWindow(window)
+        """The recent latencies of successful requests."""
+
+    @property
+    def delay(self) -> Optional[float]:
+        """
+        Returns how long to wait before hedging, or `None` if there aren't enough samples yet.
+        """
+
+        if len(self.latencies.samples) < self.min_samples:
+            return None
+
+        return max(self.latencies.percentile(self.percentile), self.min_delay)
+
+    async def run(self, attempt: Callable[[int], Awaitable[T]]) -> T:
+        """
+        Awaits `attempt(0)`, and additionally `attempt(1)` if the first one is too slow, returning the first successful result.
+        The other attempt is cancelled. If both fail, the exception of the first one is raised.
+        """
+
+        delay = self.delay
+        start = monotonic()
+
+        if delay is None:
+            result = await attempt(0)
+            self.latencies.add(monotonic() - start)
+
+            return result
+
+        tasks: List[Task] = [ensure_future(attempt(0))]
+
+        try:
+            done, _ = await wait(tasks, timeout=delay)
+
+            if not done:
+                tasks.append(ensure_future(attempt(1)))
+
+            first_error: Optional[BaseException] = None
+
+            while True:
+                done, _ = await wait([task for task in tasks if not task.done()] or tasks, return_when=FIRST_COMPLETED)
+
+                for task in sorted(done, key=tasks.index):
+                    if task.cancelled():
+                        continue
+
+                    if task.exception() is None:
+                        self.latencies.add(monotonic() - start)
+                        return task.result()
+
+                    first_error = first_error or task.exception()
+
+                if all(task.done() for task in tasks):
+                    raise first_error if first_error else CancelledError()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+class CircuitOpenException(ServiceBusyException):
+    """
+    Thrown when a call fails fast because the circuit breaker of every suitable backend is open.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("The call can't be handled at this time because the backend is failing and temporarily not sent any requests.")
+
+class DeadlineExceededException(TimeoutError):
+    """
+    Thrown when a call couldn't be completed within its time budget.
+    """
+
+    def __init__(self, budget: Optional[float]) -> None:
+        super().__init__(f"The call couldn't be completed within its time budget of {budget} seconds.")
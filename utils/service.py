@@ -1,4 +1,9 @@
-from asyncio import Lock
+from asyncio import Future, TimeoutError, get_running_loop, wait_for
+from contextlib import asynccontextmanager
+from heapq import heapify, heappop, heappush
+from itertools import count
+from time import monotonic
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
 
 class Service:
     """
@@ -7,27 +12,453 @@ class Service:
 
     pass
 
+class Ticket:
+    """
+    Represents a single call waiting for (or holding) a slot of a `Scheduler`.
+    """
+
+    def __init__(
+            self,
+            priority: int,
+            sequence: int,
+            on_position: Optional[Callable[[int], None]] = None,
+            group: Optional[str] = None,
+            tenant: Optional[str] = None,
+            cost: float = 1.0,
+    ) -> None:
+        self.priority = priority
+        """The priority of the call. Higher values are served first."""
+
+        self.sequence = sequence
+        """Monotonically increasing number used to keep calls with the same priority and tag in FIFO order."""
+
+        self.group = group
+        """Optional key (like the model name) of calls that are cheaper to handle back to back."""
+
+        self.tenant = tenant
+        """Optional key of the user (or other party) the call is made on behalf of, used to share the service fairly."""
+
+        self.cost = cost
+        """How expensive the call is compared to others, e.g. `1.0` for an average call."""
+
+        self.tag = 0.0
+        """The virtual time at which the call is due according to fair queuing. Set by the `Scheduler`."""
+
+        self.granted = False
+        """Whether the ticket holds a slot."""
+
+        self.on_position = on_position
+        """Optional callback which is called with the new queue position whenever it changes."""
+
+        self._future: Optional[Future] = None
+        self._last_position = 0
+
+    def __lt__(self, other: "Ticket") -> bool:
+        return (-self.priority, self.tag, self.sequence) < (-other.priority, other.tag, other.sequence)
+
+class TokenBucket:
+    """
+    Allows `rate` units per second on average, with bursts of up to `capacity` units.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        """How many units are added per second."""
+
+        self.capacity = capacity
+        """The most units the bucket can hold."""
+
+        self.__tokens = capacity
+        self.__updated = monotonic()
+
+    @property
+    def tokens(self) -> float:
+        """
+        Returns how many units are available right now.
+        """
+
+        now = monotonic()
+        self.__tokens = min(self.capacity, self.__tokens + (now - self.__updated) * self.rate)
+        self.__updated = now
+
+        return self.__tokens
+
+    def try_take(self, amount: float) -> bool:
+        """
+        Takes `amount` units if available and returns whether it did.
+        Amounts larger than the capacity require (and drain) a full bucket.
+        """
+
+        amount = min(amount, self.capacity)
+
+        if self.tokens < amount:
+            return False
+
+        self.__tokens -= amount
+        return True
+
+    def time_until(self, amount: float) -> float:
+        """
+        Returns how many seconds it takes until `amount` units are available.
+        """
+
+        missing = min(amount, self.capacity) - self.tokens
+        return max(missing, 0.0) / self.rate if self.rate > 0 else float("inf")
+
+class RateLimiter:
+    """
+    Limits how much every tenant can use a service with a `TokenBucket` per tenant.
+
+    Every tenant may spend `rate` cost units per second on average and up to `burst` at once,
+    unless `overrides` maps the tenant to its own `(rate, burst)`.
+    """
+
+    def __init__(self, rate: float, burst: float, overrides: Optional[Dict[str, Tuple[float, float]]] = None) -> None:
+        self.rate = rate
+        """How many cost units a tenant may spend per second on average."""
+
+        self.burst = burst
+        """How many cost units a tenant may spend at once."""
+
+        self.overrides = overrides if overrides else {}
+        """Custom `(rate, burst)` limits of specific tenants."""
+
+        self.__buckets: Dict[str, TokenBucket] = {}
+
+    def check(self, tenant: str, cost: float = 1.0) -> None:
+        """
+        Charges `tenant` with `cost`, or raises a `RateLimitExceededException` if it's over its limit.
+        """
+
+        bucket = self.__buckets.get(tenant)
+
+        if bucket is None:
+            # Full buckets behave like new ones, so they're dropped to keep the number of tracked tenants bounded.
+            if len(self.__buckets) >= _MAX_TRACKED_TENANTS:
+                self.__buckets = {key: value for key, value in self.__buckets.items() if value.tokens < value.capacity}
+
+            bucket = self.__buckets[tenant] = TokenBucket(*self.overrides.get(tenant, (self.rate, self.burst)))
+
+        if not bucket.try_take(cost):
+            raise RateLimitExceededException(bucket.time_until(cost))
+
+class Scheduler:
+    """
+    Limits how many calls can be handled at once and queues the rest.
+
+    Up to `concurrency` calls hold a slot at the same time. Additional calls wait in a bounded queue
+    ordered by priority (and by arrival within the same priority) until a slot frees up or `timeout` seconds pass.
+    The preferred way to use it is via `slot()`, which guarantees that the slot is released no matter how the call ends.
+
+    Calls with the same priority are shared fairly between tenants using start-time fair queuing: every call is tagged
+    with the virtual time at which its tenant is due, which advances by the call's `cost` divided by the tenant's weight
+    (see `weights`, `1.0` by default). So a tenant queuing many expensive calls only gets its share of the slots,
+    while a tenant sending an occasional cheap call is served next. Calls without a tenant share a single anonymous one,
+    which keeps them in FIFO order. If a `RateLimiter` is provided, calls with a tenant are also charged against its limits.
+
+    If `max_group_streak` is set, a freed slot is handed to the oldest waiting call of the same `group` (and priority)
+    as the call that released it, ahead of older calls of other groups, up to `max_group_streak` times in a row.
+    This keeps e.g. requests for the same model together so the backend has to swap models less often.
+    """
+
+    def __init__(
+            self,
+            concurrency: int = 1,
+            max_queue_size: Optional[int] = None,
+            timeout: Optional[float] = None,
+            max_group_streak: Optional[int] = None,
+            weights: Optional[Dict[str, float]] = None,
+            rate_limiter: Optional[RateLimiter] = None,
+    ) -> None:
+        self.concurrency = concurrency
+        """How many calls can hold a slot at the same time."""
+
+        self.max_queue_size = max_queue_size
+        """How many calls can wait for a slot. `None` means unbounded, `0` disables waiting."""
+
+        self.timeout = timeout
+        """The default number of seconds a call may wait for a slot. `None` means forever."""
+
+        self.max_group_streak = max_group_streak
+        """How many times in a row a call may be served ahead of older ones because of its group. `None` disables grouping."""
+
+        self.weights = weights if weights else {}
+        """The share of every tenant relative to others. Tenants not listed have a weight of `1.0`."""
+
+        self.rate_limiter = rate_limiter
+        """Optional per-tenant limits calls are charged against before being queued."""
+
+        self.__virtual_time = 0.0
+        self.__tenant_tags: Dict[Optional[str], float] = {}
+        self.__active = 0
+        self.__active_cost = 0.0
+        self.__streak = 0
+        self.__queue: List[Ticket] = []
+        self.__sequence = count()
+
+    @classmethod
+    def for_backend(cls, key: str, concurrency: int = 1, max_queue_size: Optional[int] = None, timeout: Optional[float] = None) -> "Scheduler":
+        """
+        Returns the scheduler shared by every service talking to the backend identified by `key`,
+        creating it with the provided settings if it doesn't exist yet.
+        """
+
+        if key not in _backend_schedulers:
+            _backend_schedulers[key] = cls(concurrency, max_queue_size, timeout)
+
+        return _backend_schedulers[key]
+
+    @property
+    def active(self) -> int:
+        """
+        Returns the number of calls currently holding a slot.
+        """
+
+        return self.__active
+
+    @property
+    def queue_size(self) -> int:
+        """
+        Returns the number of calls waiting for a slot.
+        """
+
+        return len(self.__queue)
+
+    @property
+    def pending_cost(self) -> float:
+        """
+        Returns the total cost of the calls holding or waiting for a slot.
+        """
+
+        return self.__active_cost + sum(ticket.cost for ticket in self.__queue)
+
+    @property
+    def is_saturated(self) -> bool:
+        """
+        Returns `True` if there are no free slots.
+        """
+
+        return self.__active >= self.concurrency
+
+    def position(self, ticket: Ticket) -> int:
+        """
+        Returns the 1 based position of `ticket` in the queue, or `0` if it isn't waiting.
+        """
+
+        if ticket.granted:
+            return 0
+
+        ahead = 0
+        waiting = False
+
+        for t in self.__queue:
+            if t is ticket:
+                waiting = True
+            elif t < ticket:
+                ahead += 1
+
+        return 1 + ahead if waiting else 0
+
+    async def acquire(
+            self,
+            priority: int = 0,
+            timeout: Optional[float] = None,
+            on_position: Optional[Callable[[int], None]] = None,
+            group: Optional[str] = None,
+            tenant: Optional[str] = None,
+            cost: float = 1.0,
+    ) -> Ticket:
+        """
+        Waits for a free slot and returns the granted `Ticket`, which must be passed to `release()` afterwards.
+
+        Raises a `RateLimitExceededException` if the tenant is over its limit, a `QueueFullException` if the queue is full
+        and a `QueueTimeoutException` if no slot was freed up in time.
+        """
+
+        ticket = Ticket(priority, next(self.__sequence), on_position, group, tenant, cost)
+
+        if not self.is_saturated and not self.__queue:
+            self.__charge(ticket)
+            self.__grant(ticket)
+            self.__active += 1
+            return ticket
+
+        if self.max_queue_size is not None and len(self.__queue) >= self.max_queue_size:
+            raise QueueFullException()
+
+        self.__charge(ticket)
+
+        ticket._future = get_running_loop().create_future()
+        heappush(self.__queue, ticket)
+        self.__notify_positions()
+
+        try:
+            await wait_for(ticket._future, timeout if timeout is not None else self.timeout)
+        except TimeoutError:
+            self.__abandon(ticket)
+            raise QueueTimeoutException()
+        except BaseException:
+            self.__abandon(ticket)
+            raise
+
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """
+        Releases the slot held by `ticket` and hands it over to the next call in the queue.
+        """
+
+        if not ticket.granted:
+            return
+
+        ticket.granted = False
+        self.__active_cost -= ticket.cost
+
+        while self.__queue:
+            waiter = self.__pop_next(ticket.group)
+
+            if waiter._future.done():
+                continue
+
+            self.__grant(waiter)
+            waiter._future.set_result(None)
+            self.__notify_positions()
+            return
+
+        self.__active -= 1
+
+    @asynccontextmanager
+    async def slot(
+            self,
+            priority: int = 0,
+            timeout: Optional[float] = None,
+            on_position: Optional[Callable[[int], None]] = None,
+            group: Optional[str] = None,
+            tenant: Optional[str] = None,
+            cost: float = 1.0,
+    ) -> AsyncIterator[Ticket]:
+        """
+        Waits for a free slot and holds it for the duration of the `async with` block.
+        The slot is released even if the block raises an exception or gets cancelled.
+        """
+
+        ticket = await self.acquire(priority, timeout, on_position, group, tenant, cost)
+
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def __charge(self, ticket: Ticket) -> None:
+        if self.rate_limiter is not None and ticket.tenant is not None:
+            self.rate_limiter.check(ticket.tenant, ticket.cost)
+
+        # A tenant that was idle starts at the current virtual time instead of where it left off, so it can't save up a share.
+        ticket.tag = max(self.__virtual_time, self.__tenant_tags.get(ticket.tenant, 0.0))
+        self.__tenant_tags[ticket.tenant] = ticket.tag + ticket.cost / self.weights.get(ticket.tenant, 1.0)
+
+        if len(self.__tenant_tags) >= _MAX_TRACKED_TENANTS:
+            self.__tenant_tags = {key: value for key, value in self.__tenant_tags.items() if value > self.__virtual_time}
+
+    def __grant(self, ticket: Ticket) -> None:
+        ticket.granted = True
+        self.__active_cost += ticket.cost
+        self.__virtual_time = max(self.__virtual_time, ticket.tag)
+
+    def __pop_next(self, group: Optional[str]) -> Ticket:
+        head = self.__queue[0]
+
+        if self.max_group_streak is None or group is None or head.group == group or self.__streak >= self.max_group_streak:
+            self.__streak = 0
+            return heappop(self.__queue)
+
+        same_group = [t for t in self.__queue if t.group == group and t.priority == head.priority and not t._future.done()]
+
+        if not same_group:
+            self.__streak = 0
+            return heappop(self.__queue)
+
+        self.__streak += 1
+        waiter = min(same_group)
+        self.__queue.remove(waiter)
+        heapify(self.__queue)
+
+        return waiter
+
+    def __abandon(self, ticket: Ticket) -> None:
+        # The slot may have been handed over right as the wait was cancelled or timed out,
+        # in which case it has to be passed on instead of being lost.
+        if ticket.granted:
+            self.release(ticket)
+            return
+
+        if ticket in self.__queue:
+            self.__queue.remove(ticket)
+            heapify(self.__queue)
+            self.__notify_positions()
+
+    def __notify_positions(self) -> None:
+        if not any(ticket.on_position is not None for ticket in self.__queue):
+            return
+
+        # The heap isn't fully ordered, so it's sorted once instead of counting the tickets ahead of every ticket.
+        for position, ticket in enumerate(sorted(self.__queue), 1):
+            if ticket.on_position is None:
+                continue
+
+            if position != ticket._last_position:
+                ticket._last_position = position
+                ticket.on_position(position)
+
+# How many tenants the fair queuing and rate limiting state is kept for before idle ones are dropped.
+_MAX_TRACKED_TENANTS = 10000
+
+_backend_schedulers: Dict[str, Scheduler] = {}
+
 class AsyncService(Service):
     """
     A general meta class to implement async services.
-    """
 
-    __lock: Lock = Lock()
+    Calls are admitted through a `Scheduler`, which is usually shared by every service using the same backend.
+    """
 
-    # Intended to be used when you only want to allow one use at a time.
-    __is_busy: bool = False
+    def __init__(self, scheduler: Scheduler) -> None:
+        self.scheduler = scheduler
 
     async def get_busyness(self) -> bool:
         """
-        Returns `True` if the service is busy, otherwise `False`.
+        Returns `True` if the service is busy (has no free slots), otherwise `False`.
         """
-        
-        async with self.__lock:
-            return self.__is_busy
-        
-    def set_busyness(self, v: bool) -> None:
-        self.__is_busy = v
+
+        return self.scheduler.is_saturated
 
 class ServiceBusyException(Exception):
+    def __init__(self, message: str = "The call can't be handled at this time because the service is busy handling another.") -> None:
+        super().__init__(message)
+
+class QueueFullException(ServiceBusyException):
+    """
+    Thrown by a `Scheduler` when a call can't be queued because the queue is full.
+    """
+
+    def __init__(self) -> None:
+        super().__init__("The call can't be handled at this time because the service's queue is full.")
+
+class RateLimitExceededException(ServiceBusyException):
+    """
+    Thrown by a `Scheduler` when a tenant made more calls than its `RateLimiter` allows.
+    """
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__(f"The call can't be handled at this time because too many calls were made. Try again in {retry_after:.1f} seconds.")
+
+        self.retry_after = retry_after
+        """How many seconds to wait before the call would be allowed."""
+
+class QueueTimeoutException(ServiceBusyException):
+    """
+    Thrown by a `Scheduler` when a call waited for a slot longer than allowed.
+    """
+
     def __init__(self) -> None:
-        super().__init__("The call can't be handled at this time because the service is busy handling another.")
\ No newline at end of file
+        super().__init__("The call timed out while waiting for the service to become available.")
@@ -0,0 +1,78 @@
+from asyncio import Task, ensure_future, shield
+from typing import Any, Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+class _Flight(Generic[T]):
+    def __init__(self, task: Task, state: Any) -> None:
+        self.task = task
+        self.state = state
+        self.waiters = 0
+
+class SingleFlight(Generic[T]):
+    """
+    Deduplicates concurrent calls which share the same key.
+
+    The first call with a given key starts the work, every identical call arriving while it's still
+    running waits for the same result instead of starting the work again.
+    A waiter that gets cancelled only stops waiting; the shared work is only cancelled once every waiter has left.
+    Keep in mind that every waiter receives the very same result object.
+    """
+
+    def __init__(self) -> None:
+        self.__flights: Dict[Hashable, _Flight[T]] = {}
+
+    @property
+    def in_flight(self) -> int:
+        """
+        Returns the number of distinct calls currently running.
+        """
+
+        return len(self.__flights)
+
+    def waiters(self, key: Hashable) -> int:
+        """
+        Returns the number of callers waiting for the call identified by `key`.
+        """
+
+        flight = self.__flights.get(key)
+        return flight.waiters if flight else 0
+
+    def get_state(self, key: Hashable) -> Any:
+        """
+        Returns the `state` the call identified by `key` was started with, or `None` if no such call is running.
+        """
+
+        flight = self.__flights.get(key)
+        return flight.state if flight else None
+
+    async def do(self, key: Hashable, factory: Callable[[], Awaitable[T]], state: Any = None) -> T:
+        """
+        Returns the result of `factory()`, unless a call with the same `key` is already running,
+        in which case its result is returned instead.
+
+        `state` is kept along with a call that is started, so later callers can find it with `get_state()`
+        (like to hand the shared work their callbacks).
+        """
+
+        flight = self.__flights.get(key)
+
+        if flight is None:
+            flight = _Flight(ensure_future(factory()), state)
+            self.__flights[key] = flight
+            flight.task.add_done_callback(lambda _: self.__land(key, flight))
+
+        flight.waiters += 1
+
+        try:
+            return await shield(flight.task)
+        finally:
+            flight.waiters -= 1
+
+            if flight.waiters == 0 and not flight.task.done():
+                flight.task.cancel()
+                self.__land(key, flight)
+
+    def __land(self, key: Hashable, flight: _Flight[T]) -> None:
+        if self.__flights.get(key) is flight:
+            del self.__flights[key]
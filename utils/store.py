@@ -0,0 +1,68 @@
+from threading import Lock
+from typing import Optional
+import sqlite3
+
+class SqliteStore:
+    """
+    A small persistent key-value store of binary blobs backed by a single SQLite file.
+
+    Every method is blocking, but the store is safe to use from multiple threads,
+    so calls can be moved off the event loop with `asyncio.to_thread()`.
+    """
+
+    def __init__(self, path: str, table: str = "blobs") -> None:
+        self.path = path
+        """The path of the SQLite database file."""
+
+        self.table = table
+        """The name of the table the blobs are stored in."""
+
+        self.__lock = Lock()
+        self.__connection = sqlite3.connect(path, check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, value BLOB NOT NULL)")
+        self.__connection.commit()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """
+        Returns the blob stored under `key`, or `None` if there's none.
+        """
+
+        with self.__lock:
+            row = self.__connection.execute(f"SELECT value FROM {self.table} WHERE key = ?", (key,)).fetchone()
+
+        return bytes(row[0]) if row else None
+
+    def set(self, key: str, value: bytes) -> None:
+        """
+        Stores `value` under `key`, replacing the previous blob.
+        """
+
+        with self.__lock:
+            self.__connection.execute(f"INSERT OR REPLACE INTO {self.table} (key, value) VALUES (?, ?)", (key, value))
+            self.__connection.commit()
+
+    def delete(self, key: str) -> None:
+        """
+        Removes the blob stored under `key`, if any.
+        """
+
+        with self.__lock:
+            self.__connection.execute(f"DELETE FROM {self.table} WHERE key = ?", (key,))
+            self.__connection.commit()
+
+    def __contains__(self, key: str) -> bool:
+        with self.__lock:
+            return self.__connection.execute(f"SELECT 1 FROM {self.table} WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self.__lock:
+            return self.__connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def close(self) -> None:
+        """
+        Closes the underlying database connection.
+        """
+
+        with self.__lock:
+            self.__connection.close()